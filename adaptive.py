@@ -0,0 +1,63 @@
+# Adaptive parameter sweeps.
+# Instead of a dense grid, start from a coarse one and spend the remaining budget where the result changes most.
+# Points are tuples of integer parameters, e.g. (num_qs, max_rank). A line is a set of points that differ in one
+# parameter only; between neighbours on a line, the larger the change of the metric, the worse a straight line
+# through the two describes the curve, so the next points go in the middle of the steepest intervals.
+# Midpoints are geometric (the grids are roughly log-spaced) and rounded to integers.
+
+import math
+
+from sweep import default_workers, run_sweep
+
+def midpoint(lo, hi):
+    """Integer geometric midpoint strictly between lo and hi, None if there is none"""
+    if hi - lo < 2:
+        return None
+    mid = round(math.sqrt(lo*hi)) if lo > 0 else (lo + hi)//2
+    return min(max(mid, lo + 1), hi - 1)
+
+def candidates(values):
+    """
+        (score, new point) for every interval between neighbours on every line of the evaluated points.
+        values maps point -> metric. Score is the absolute change of the metric across the interval.
+    """
+    points = list(values)
+    dims = len(points[0]) if points else 0
+    out = {}
+    for d in range(dims):
+        lines = {}
+        for p in points:
+            lines.setdefault(p[:d] + p[d + 1:], []).append(p)
+        for line in lines.values():
+            line.sort(key=lambda p: p[d])
+            for a, b in zip(line, line[1:]):
+                mid = midpoint(a[d], b[d])
+                if mid is None:
+                    continue
+                p = a[:d] + (mid, ) + a[d + 1:]
+                if p not in values:
+                    out[p] = max(out.get(p, 0), abs(values[b] - values[a]))
+    return sorted(((score, p) for p, score in out.items()), reverse=True)
+
+def adaptive_sweep(run_config, metric, grid, budget, batch=None, workers=None):
+    """
+        Run run_config(point) on every point of the coarse grid, then in rounds of batch points (default: one
+        per worker) on the midpoints of the steepest intervals, until budget points in total have run or no
+        interval is left to split. metric(record) is the value refined on.
+        Returns the records of all points, sorted by point. Each record gets the "round" it ran in (0: grid).
+    """
+    if batch is None:
+        batch = workers or default_workers()
+    points = list(dict.fromkeys(tuple(p) for p in grid))[:budget]
+    records = {}
+    values = {}
+    rnd = 0
+    while points:
+        for p, rec in zip(points, run_sweep(run_config, points, workers)):
+            rec["round"] = rnd
+            records[p] = rec
+            values[p] = metric(rec)
+        rnd += 1
+        left = budget - len(records)
+        points = [p for _, p in candidates(values)[:min(batch, left)]]
+    return [records[p] for p in sorted(records)]
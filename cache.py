@@ -0,0 +1,94 @@
+# On-disk cache of sweep results.
+# A cell (one sweep configuration) is keyed by the content hash of its trace, the engine, the algorithm
+# versions and the rest of its configuration, so a repeated or extended sweep only computes new cells.
+# Stored in one SQLite file, records as JSON. The trace path and chunk size are not part of the key:
+# the same trace under another name, or streamed instead of loaded, gives the same result.
+# engine, scheduler and replay each have a VERSION, bumped when a change to them alters results:
+# cells computed under an older version no longer match and are recomputed.
+
+import hashlib
+import json
+import os
+import sqlite3
+
+import engine
+import replay
+import scheduler
+import warmstart
+
+HASH_BLOCK = 1 << 20
+UNKEYED = ("trace", "chunk")                    # Config fields that do not change the result
+
+def file_digest(path):
+    """sha256 of the file contents"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class ResultCache:
+    """
+        SQLite result cache. params (e.g. iterations=ITERATIONS) are added to every key,
+        for script settings that change the result but are not in the configs.
+    """
+    def __init__(self, path, **params) -> None:
+        self.path = path
+        self.params = params
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS cells (key TEXT PRIMARY KEY, config TEXT, record TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS traces (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT)")
+        self.db.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self) -> str:
+        return(f"ResultCache: {self.path}, {self.hits} hits, {self.misses} misses")
+
+    def trace_digest(self, inpf):
+        """Content hash of a trace (or any other input file), rehashed only if its size or mtime changed"""
+        path = os.path.abspath(inpf)
+        st = os.stat(path)
+        row = self.db.execute("SELECT size, mtime_ns, digest FROM traces WHERE path = ?", (path, )).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+        digest = file_digest(path)
+        self.db.execute("INSERT OR REPLACE INTO traces VALUES (?, ?, ?, ?)", (path, st.st_size, st.st_mtime_ns, digest))
+        self.db.commit()
+        return digest
+
+    def describe(self, cfg):
+        """Everything the result of cfg depends on, as canonical JSON"""
+        desc = {k: v for k, v in cfg.items() if k not in UNKEYED}
+        desc.update(self.params)
+        desc["trace"] = self.trace_digest(cfg["trace"])
+        desc["engine_version"] = engine.VERSION
+        if cfg["engine"] == "pifo" or cfg.get("rates"):
+            desc["scheduler_version"] = scheduler.VERSION
+        if cfg.get("replay"):
+            desc["replay_version"] = replay.VERSION
+        if cfg.get("warm_start"):
+            """Contents of the files the spec points to, not just their names"""
+            desc["warm_start_files"] = [self.trace_digest(path) for path in warmstart.spec_files(cfg["warm_start"])]
+        return json.dumps(desc, sort_keys=True)
+
+    def key(self, cfg):
+        return hashlib.sha256(self.describe(cfg).encode()).hexdigest()
+
+    def get(self, cfg):
+        """Cached record for cfg, with cfg's trace path, or None"""
+        row = self.db.execute("SELECT record FROM cells WHERE key = ?", (self.key(cfg), )).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        rec = json.loads(row[0])
+        rec["trace"] = cfg["trace"]
+        return rec
+
+    def put(self, cfg, rec):
+        self.db.execute("INSERT OR REPLACE INTO cells VALUES (?, ?, ?)", (self.key(cfg), self.describe(cfg), json.dumps(rec)))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
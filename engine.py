@@ -0,0 +1,527 @@
+# In-process SP-PIFO engines.
+# Runs the same push-up/push-down bound logic as sppfio() in sp-pifo.py, over a whole rank trace,
+# without the generator/consumer processes and mp.Queue hops.
+# If Numba is installed the per-packet loop is JIT compiled (sppifo_kernel), otherwise it runs as plain Python.
+# Push-up binary searches the bounds and push-down is O(1) through a lazy offset (see _sppifo_loop()).
+
+import time
+
+import numpy as np
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+VERSION = 3
+
+def _sppifo_loop_linear(ranks, bounds, qids, inversions_per_rank, q_counts=None):
+    """
+        Push-up/push-down exactly as written in sppfio(): linear scan for push-up, every bound updated on push-down.
+        Works on int64 arrays (compiled) or lists (plain Python).
+        Fills qids, updates bounds and inversions_per_rank in place and returns the inversion count.
+        q_counts, if given, counts the packets put in every q (compiled without the check when None).
+    """
+    num_qs = len(bounds)
+    last = num_qs - 1
+    inversions = 0
+    for k in range(len(ranks)):
+        rank = ranks[k]
+        # PUSHUP
+        bound_1 = bounds[last]
+        i = 0
+        while rank < bounds[i] and i != last:
+            i += 1
+        bounds[i] = rank
+        qids[k] = last - i
+        if q_counts is not None:
+            q_counts[last - i] += 1
+
+        # PUSHDOWN
+        if rank < bound_1:
+            inversions += 1
+            inversions_per_rank[rank] += 1
+            cost = bounds[last] - rank
+            if cost != 0:                       # Subtracting 0 changes nothing, skip the O(num_qs) pass
+                for j in range(last):
+                    bounds[j] = bounds[j] - cost
+    return inversions
+
+def _sppifo_loop(ranks, bounds, qids, inversions_per_rank, q_counts=None):
+    """
+        Same result as _sppifo_loop_linear() in O(log num_qs) per packet, for non-increasing bounds
+        (bounds[0] largest). That holds from the all-zero start: push-up only writes a rank between
+        its neighbours, and push-down moves all but the last bound together.
+        While running, bounds[:last] are relative to a lazy offset, so push-down is one subtraction,
+        and push-up binary searches the monotone bounds. The offset is folded back in at the end.
+    """
+    last = len(bounds) - 1
+    offset = 0
+    inversions = 0
+    for k in range(len(ranks)):
+        rank = ranks[k]
+        # PUSHUP: first i with rank >= bounds[i], else the highest priority q
+        bound_1 = bounds[last]
+        rel = rank - offset
+        lo = 0
+        hi = last
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if bounds[mid] <= rel:
+                hi = mid
+            else:
+                lo = mid + 1
+        if lo == last:
+            bounds[last] = rank
+        else:
+            bounds[lo] = rel
+        qids[k] = last - lo
+        if q_counts is not None:
+            q_counts[last - lo] += 1
+
+        # PUSHDOWN
+        if rank < bound_1:
+            inversions += 1
+            inversions_per_rank[rank] += 1
+            offset -= bounds[last] - rank
+    for j in range(last):
+        bounds[j] = bounds[j] + offset
+    return inversions
+
+if HAVE_NUMBA:
+    _sppifo_loop_linear = njit(cache=True, nogil=True)(_sppifo_loop_linear)
+    _sppifo_loop = njit(cache=True, nogil=True)(_sppifo_loop)
+
+def _sppifo_sampled(ranks, bounds, qids, inversions_per_rank, linear, start, every, q_counts,
+                    bound_snaps, q_snaps, snap_at, samples):
+    """
+        The same loop, run in segments that end every `every` packets (counting from start packets already pushed).
+        After each segment the bounds and the running per-q packet counts (q_counts) are copied into row `samples`
+        of the preallocated bound_snaps/q_snaps (dropped once they are full).
+        Returns (inversions, samples).
+    """
+    last = len(bounds) - 1
+    inversions = 0
+    lo = 0
+    while lo < len(ranks):
+        hi = min(len(ranks), lo + every - (start + lo) % every)
+        if linear:
+            inversions += _sppifo_loop_linear(ranks[lo:hi], bounds, qids[lo:hi], inversions_per_rank, q_counts)
+        else:
+            inversions += _sppifo_loop(ranks[lo:hi], bounds, qids[lo:hi], inversions_per_rank, q_counts)
+        if (start + hi) % every == 0:
+            if samples < len(snap_at):
+                for q in range(last + 1):
+                    bound_snaps[samples, q] = bounds[q]
+                    q_snaps[samples, q] = q_counts[q]
+                snap_at[samples] = start + hi
+            samples += 1
+        lo = hi
+    return inversions, samples
+
+if HAVE_NUMBA:
+    _sppifo_sampled = njit(cache=True, nogil=True)(_sppifo_sampled)
+
+def _sppifo_segmented(ranks, bounds, qids, inversions_per_rank, linear, ends, seg_inversions):
+    """The same loop, run segment by segment (segment i ends before ends[i]), inversions of each into seg_inversions"""
+    inversions = 0
+    lo = 0
+    for i in range(len(ends)):
+        hi = ends[i]
+        if linear:
+            seg = _sppifo_loop_linear(ranks[lo:hi], bounds, qids[lo:hi], inversions_per_rank)
+        else:
+            seg = _sppifo_loop(ranks[lo:hi], bounds, qids[lo:hi], inversions_per_rank)
+        seg_inversions[i] = seg
+        inversions += seg
+        lo = hi
+    return inversions
+
+if HAVE_NUMBA:
+    _sppifo_segmented = njit(cache=True, nogil=True)(_sppifo_segmented)
+
+def is_monotone(bounds):
+    """True if bounds are non-increasing, so the O(log num_qs) loop applies"""
+    return all(bounds[j] >= bounds[j + 1] for j in range(len(bounds) - 1))
+
+def quantile_bounds(hist, num_qs):
+    """
+        Bounds (SPPIFO.bounds order) splitting a rank histogram into num_qs bands of equal packet mass,
+        q 0 getting the lowest ranks: the state SP-PIFO settles around, used to skip its cold-start transient.
+    """
+    cdf = np.cumsum(np.asarray(hist, dtype=np.int64))
+    if not len(cdf) or cdf[-1] == 0:
+        return [0 for _ in range(num_qs)]
+    lower = np.searchsorted(cdf, np.arange(num_qs)*cdf[-1]/num_qs, side='right')   # Lowest rank of every q
+    return lower[::-1].tolist()
+
+def sppifo_kernel(ranks, num_qs, max_rank, bounds=None, linear=False, recorder=None, windows=None, ids=None):
+    """
+        SP-PIFO over a rank array with the compiled loop (plain Python if Numba is missing).
+        bounds, if given, is an int64 array of num_qs bounds (same order as SPPIFO.bounds), updated in place.
+        linear=True forces the O(num_qs) loop; it is also used when bounds are not monotone.
+        recorder, an instrument.StageRecorder, gets bound and per-q samples (its enqueued count is the packets already pushed).
+        windows, a windows.InversionWindows, gets packets and inversions per window (ids: packet stamps, for time windows).
+        Returns (qids, inversions, inversions_per_rank) with qids and inversions_per_rank as int64 arrays.
+        inversions_per_rank has max_rank entries, more if the trace has larger ranks.
+    """
+    ranks = np.ascontiguousarray(ranks, dtype=np.int64)
+    if len(ranks) and ranks.min() < 0:
+        raise ValueError("Ranks must not be negative")
+    if bounds is None:
+        bounds = np.zeros(num_qs, dtype=np.int64)
+    num_ranks = max(max_rank, int(ranks.max()) + 1 if len(ranks) else 0)
+    qids = np.empty(len(ranks), dtype=np.int64)
+    inversions_per_rank = np.zeros(num_ranks, dtype=np.int64)
+    linear = linear or not is_monotone(bounds)
+    if windows is not None:
+        wins, ends = windows.split(len(ranks), ids)
+        seg_inversions = np.zeros(len(ends), dtype=np.int64)
+        if recorder is None:
+            inversions = _sppifo_segmented(ranks, bounds, qids, inversions_per_rank, linear, ends, seg_inversions)
+        else:
+            lo = 0
+            for i, hi in enumerate(ends.tolist()):
+                seg_inversions[i] = _sppifo_recorded(recorder, ranks[lo:hi], bounds, qids[lo:hi], inversions_per_rank, linear)
+                lo = hi
+            inversions = seg_inversions.sum()
+        windows.add(wins, np.diff(ends, prepend=0), seg_inversions)
+        return qids, int(inversions), inversions_per_rank
+    if recorder is not None:
+        inversions = _sppifo_recorded(recorder, ranks, bounds, qids, inversions_per_rank, linear)
+        return qids, inversions, inversions_per_rank
+    loop = _sppifo_loop_linear if linear else _sppifo_loop
+    inversions = loop(ranks, bounds, qids, inversions_per_rank)
+    return qids, int(inversions), inversions_per_rank
+
+def _sppifo_recorded(r, ranks, bounds, qids, inversions_per_rank, linear):
+    """_sppifo_sampled() over ranks, the packets following the r.enqueued already recorded. Returns the inversions"""
+    inversions, r.samples = _sppifo_sampled(ranks, bounds, qids, inversions_per_rank, linear, r.enqueued, r.every,
+                                            r.q_counts, r.bounds, r.q_cumulative, r.packet, r.samples)
+    r.enqueued += len(ranks)
+    r.inversions += int(inversions)
+    return int(inversions)
+
+class SPPIFO:
+    """
+        SP-PIFO bound state and inversion counters.
+        Ranks are pushed one chunk at a time; the bounds carry over from one chunk to the next,
+        so a trace can be fed in pieces and give the same result as feeding it whole.
+    """
+    def __init__(self, num_qs, max_rank) -> None:
+        self.num_qs = num_qs
+        # Bounds are reversed. 1st bound is for lowest priority q, last bound is for highest priority q
+        self.bounds = [0 for _ in range(num_qs)]
+        self.packets = 0
+        self.inversions = 0
+        self.inversions_per_rank = [0 for _ in range(max_rank)]
+        self.recorder = None                    # instrument.StageRecorder, only set when instrumenting
+        self.windows = None                     # windows.InversionWindows, only set for windowed metrics
+
+    def __repr__(self) -> str:
+        return(f"SP-PIFO: {self.num_qs} qs, {self.packets} pkts, {self.inversions} inversions")
+
+    def seed(self, hist):
+        """Start from quantile_bounds(hist) instead of all-zero bounds"""
+        self.bounds = quantile_bounds(hist, self.num_qs)
+
+    def reset_counters(self):
+        """Zero packets and inversions, keeping the bounds (end of a warm-up window)"""
+        self.packets = 0
+        self.inversions = 0
+        self.inversions_per_rank = [0 for _ in range(len(self.inversions_per_rank))]
+
+    def push(self, ranks, qids=None, ids=None):
+        """
+            Enqueue a chunk of ranks.
+            If qids is a list, the q index of every packet is appended to it (0 is the highest priority q).
+            ids (packet stamps) are only needed for time windows.
+            Returns the number of inversions in this chunk.
+        """
+        if HAVE_NUMBA or self.recorder is not None or self.windows is not None:
+            return self.push_kernel(ranks, qids, ids)
+
+        if isinstance(ranks, np.ndarray):
+            ranks = ranks.tolist()                  # Python ints are much faster to compare one at a time
+
+        chunk_qids = [0 for _ in range(len(ranks))]
+        loop = _sppifo_loop if is_monotone(self.bounds) else _sppifo_loop_linear
+        inversions = loop(ranks, self.bounds, chunk_qids, self.inversions_per_rank)
+        if qids is not None:
+            qids.extend(chunk_qids)
+
+        self.packets += len(ranks)
+        self.inversions += inversions
+        return inversions
+
+    def push_kernel(self, ranks, qids=None, ids=None):
+        """push() through sppifo_kernel()"""
+        if self.recorder is not None:
+            start = time.perf_counter()
+        bounds = np.array(self.bounds, dtype=np.int64)
+        chunk_qids, inversions, chunk_inv_per_rank = sppifo_kernel(ranks, self.num_qs, len(self.inversions_per_rank), bounds,
+                                                                   recorder=self.recorder, windows=self.windows, ids=ids)
+        self.bounds = bounds.tolist()
+
+        inversions_per_rank = self.inversions_per_rank
+        for r in np.flatnonzero(chunk_inv_per_rank).tolist():
+            inversions_per_rank[r] += int(chunk_inv_per_rank[r])      # IndexError past max_rank, like the Python loop
+        if qids is not None:
+            qids.extend(chunk_qids.tolist())
+
+        self.packets += len(chunk_qids)
+        self.inversions += inversions
+        if self.recorder is not None:
+            self.recorder.time_s += time.perf_counter() - start
+        return inversions
+
+class HierPIFO:
+    """
+        N-stage hierarchical PIFO: a chain of SP-PIFO stages, stage k with stage_qs[k] qs.
+        Packets stage k puts in one of its feeds[k] qs go on, in order, to stage k+1; the other qs are served directly.
+        feeds defaults to the highest priority q of every stage, as in hp-pifo.py.
+        Every stage keeps its own SPPIFO counters, plus the packets it put in each q so far (enqueued: nothing is
+        dequeued here, so this is each q's share of the traffic, not its occupancy).
+    """
+    def __init__(self, stage_qs, max_rank, feeds=None) -> None:
+        if not stage_qs:
+            raise ValueError("Need at least one stage")
+        if feeds is None:
+            feeds = [[0] for _ in range(len(stage_qs) - 1)]
+        if len(feeds) != len(stage_qs) - 1:
+            raise ValueError(f"{len(stage_qs)} stages need {len(stage_qs) - 1} feed lists, got {len(feeds)}")
+        for k, feed in enumerate(feeds):
+            if not feed or not all(0 <= q < stage_qs[k] for q in feed):
+                raise ValueError(f"Stage {k} feeds {list(feed)}, must be a non-empty subset of its {stage_qs[k]} qs")
+
+        self.stages = [SPPIFO(num_qs, max_rank) for num_qs in stage_qs]
+        self.feeds = [sorted(set(feed)) for feed in feeds]
+        self.enqueued = [[0 for _ in range(num_qs)] for num_qs in stage_qs]
+
+    def attach(self, recorder):
+        """Instrument every stage with a StageRecorder from recorder (an instrument.Recorder), named s1, s2, ..."""
+        for k, stage in enumerate(self.stages):
+            stage.recorder = recorder.stage(f"s{k + 1}", stage.num_qs)
+
+    def attach_windows(self, windows):
+        """Windowed metrics for every stage, windows holding one windows.InversionWindows per stage"""
+        for stage, stage_windows in zip(self.stages, windows):
+            stage.windows = stage_windows
+
+    def seed(self, hist):
+        """
+            Seed every stage with quantile_bounds() of the ranks it would see: stage 1 from hist,
+            stage k+1 from the part of stage k's histogram falling in its feeding qs.
+        """
+        hist = np.asarray(hist, dtype=np.int64)
+        for k, stage in enumerate(self.stages):
+            stage.seed(hist)
+            if k == len(self.feeds):
+                break
+            lower = stage.bounds[::-1]                          # Lowest rank of every q, q 0 first
+            upper = lower[1:] + [len(hist)]
+            fed = np.zeros_like(hist)
+            for q in self.feeds[k]:
+                lo = 0 if q == 0 else lower[q]                  # q 0 also takes ranks below every bound
+                fed[lo:upper[q]] = hist[lo:upper[q]]
+            hist = fed
+
+    def reset_counters(self):
+        """Zero every stage's counters and the enqueued counts, keeping the bounds"""
+        for stage in self.stages:
+            stage.reset_counters()
+        self.enqueued = [[0 for _ in range(stage.num_qs)] for stage in self.stages]
+
+    def __repr__(self) -> str:
+        return("Hier-PIFO: " + ", ".join(f"S{k + 1} [{stage}]" for k, stage in enumerate(self.stages)))
+
+    def push(self, ranks, qids=None, ids=None):
+        """
+            Enqueue a chunk of ranks through every stage.
+            If qids is a list of one list per stage, stage k's list gets the q index of every packet that reached stage k.
+            ids (packet stamps) are only needed for time windows.
+        """
+        ranks = np.asarray(ranks)
+        if ids is not None and len(ids):
+            for stage in self.stages:
+                if stage.windows is not None and stage.windows.origin is None:
+                    stage.windows.origin = float(ids[0])   # Time windows of every stage start at the first packet of the trace
+        for k, stage in enumerate(self.stages):
+            stage_qids = []
+            stage.push(ranks, qids=stage_qids, ids=ids)
+            stage_qids = np.asarray(stage_qids, dtype=np.int64)
+            counts = np.bincount(stage_qids, minlength=stage.num_qs)
+            enqueued = self.enqueued[k]
+            for q in range(stage.num_qs):
+                enqueued[q] += int(counts[q])
+            if qids is not None:
+                qids[k].extend(stage_qids.tolist())
+            if k == len(self.feeds):
+                break
+            fed = np.isin(stage_qids, self.feeds[k])
+            ranks = ranks[fed]
+            if ids is not None:
+                ids = np.asarray(ids)[fed]
+            if stage.recorder is not None:
+                stage.recorder.forwarded += len(ranks)
+
+    def service_order(self):
+        """
+            (stage, q) of every served q in strict priority order.
+            The next stage takes the place of the highest priority q feeding it, the other feeding qs are never served.
+        """
+        def order(k):
+            if k == len(self.feeds):
+                return [(k, q) for q in range(self.stages[k].num_qs)]
+            out = []
+            for q in range(self.stages[k].num_qs):
+                if q == self.feeds[k][0]:
+                    out.extend(order(k + 1))
+                elif q not in self.feeds[k]:
+                    out.append((k, q))
+            return out
+        return order(0)
+
+    def global_qids(self, qids):
+        """
+            Map the per-stage qids filled by push() to one strict priority q index per packet (trace order),
+            position in service_order(). This is the q a packet finally waits in.
+        """
+        index = {sq: i for i, sq in enumerate(self.service_order())}
+        gqids = None
+        for k in range(len(self.stages) - 1, -1, -1):
+            stage_qids = np.asarray(qids[k], dtype=np.int64)
+            lut = np.array([index.get((k, q), -1) for q in range(self.stages[k].num_qs)], dtype=np.int64)
+            out = lut[stage_qids]
+            if gqids is not None:
+                out[np.isin(stage_qids, self.feeds[k])] = gqids     # Fed packets reached stage k+1 in this order
+            gqids = out
+        return gqids
+
+class HPPIFO(HierPIFO):
+    """
+        Two-stage HP-PIFO as in hp-pifo.py.
+        Packets put in the highest priority stage 1 q are fed, in order, to stage 2.
+    """
+    def __init__(self, num_s1_qs, num_s2_qs, max_rank) -> None:
+        super().__init__([num_s1_qs, num_s2_qs], max_rank)
+
+    @property
+    def s1(self):
+        return self.stages[0]
+
+    @property
+    def s2(self):
+        return self.stages[1]
+
+    def __repr__(self) -> str:
+        return(f"HP-PIFO: S1 [{self.s1}], S2 [{self.s2}]")
+
+    def push(self, ranks, s1_qids=None, s2_qids=None, ids=None):
+        """
+            Enqueue a chunk of ranks through both stages.
+            s1_qids/s2_qids lists get the q index of every packet in each stage, like SPPIFO.push(qids=...).
+        """
+        qids = [[] if s1_qids is None else s1_qids, [] if s2_qids is None else s2_qids]
+        super().push(ranks, qids=qids, ids=ids)
+
+def _split_chunk(chunk):
+    """(ids, ranks) of a stream chunk: a rank array, or an (ids, ranks) pair of trace_io.iter_chunks()"""
+    return chunk if isinstance(chunk, tuple) else (None, chunk)
+
+def sppifo_batch(ranks, num_qs, max_rank, qids=None, recorder=None, windows=None, ids=None):
+    """
+        Run SP-PIFO over an array of ranks.
+        If qids is a list, the q index of every packet is appended to it (0 is the highest priority q).
+        recorder (instrument.Recorder), if given, instruments the run as stage "s1".
+        windows (windows.InversionWindows), if given, gets the inversions per window (ids: packet stamps, for time windows).
+        Returns (inversions, inversions_per_rank)
+    """
+    sp = SPPIFO(num_qs, max_rank)
+    if recorder is not None:
+        sp.recorder = recorder.stage("s1", num_qs)
+    sp.windows = windows
+    sp.push(ranks, qids=qids, ids=ids)
+    return sp.inversions, sp.inversions_per_rank
+
+def hppifo_batch(ranks, num_s1_qs, num_s2_qs, max_rank, recorder=None, windows=None, ids=None):
+    """
+        Run two-stage HP-PIFO over an array of ranks. windows, if given, is one windows.InversionWindows per stage.
+        Returns (s1_inversions, s1_inversions_per_rank, s2_inversions, s2_inversions_per_rank)
+    """
+    hp = HPPIFO(num_s1_qs, num_s2_qs, max_rank)
+    if recorder is not None:
+        hp.attach(recorder)
+    if windows is not None:
+        hp.attach_windows(windows)
+    hp.push(ranks, ids=ids)
+    return hp.s1.inversions, hp.s1.inversions_per_rank, hp.s2.inversions, hp.s2.inversions_per_rank
+
+def sppifo_stream(chunks, num_qs, max_rank, recorder=None, windows=None):
+    """
+        Run SP-PIFO over an iterable of rank chunks (e.g. trace_io.iter_ranks()), in constant memory.
+        Time windows need (ids, ranks) chunks (trace_io.iter_chunks()).
+        Returns (inversions, inversions_per_rank, packets)
+    """
+    sp = SPPIFO(num_qs, max_rank)
+    if recorder is not None:
+        sp.recorder = recorder.stage("s1", num_qs)
+    sp.windows = windows
+    for chunk in chunks:
+        ids, ranks = _split_chunk(chunk)
+        sp.push(ranks, ids=ids)
+    return sp.inversions, sp.inversions_per_rank, sp.packets
+
+def hppifo_stream(chunks, num_s1_qs, num_s2_qs, max_rank, recorder=None, windows=None):
+    """
+        Run two-stage HP-PIFO over an iterable of rank chunks, in constant memory (windows as in hppifo_batch()).
+        Returns (s1_inversions, s1_inversions_per_rank, s2_inversions, s2_inversions_per_rank, packets)
+    """
+    hp = HPPIFO(num_s1_qs, num_s2_qs, max_rank)
+    if recorder is not None:
+        hp.attach(recorder)
+    if windows is not None:
+        hp.attach_windows(windows)
+    for chunk in chunks:
+        ids, ranks = _split_chunk(chunk)
+        hp.push(ranks, ids=ids)
+    return hp.s1.inversions, hp.s1.inversions_per_rank, hp.s2.inversions, hp.s2.inversions_per_rank, hp.s1.packets
+
+def hier_stream(chunks, stage_qs, max_rank, feeds=None, recorder=None, windows=None):
+    """
+        Run an N-stage hierarchy (see HierPIFO) over an iterable of rank chunks, e.g. [ranks] for a whole trace.
+        windows, if given, is one windows.InversionWindows per stage.
+        Returns (inversions, inversions_per_rank, packets, enqueued), each a list with one entry per stage.
+    """
+    hier = HierPIFO(stage_qs, max_rank, feeds)
+    if recorder is not None:
+        hier.attach(recorder)
+    if windows is not None:
+        hier.attach_windows(windows)
+    for chunk in chunks:
+        ids, ranks = _split_chunk(chunk)
+        hier.push(ranks, ids=ids)
+    return ([stage.inversions for stage in hier.stages], [stage.inversions_per_rank for stage in hier.stages],
+            [stage.packets for stage in hier.stages], hier.enqueued)
+
+def push_steady(pifo, chunks, warmup=0):
+    """
+        Push an iterable of rank chunks into an SPPIFO or HierPIFO, discarding the counters of the first warmup packets:
+        they only move the bounds out of their starting state. Returns the packets counted after the warm-up.
+    """
+    seen = 0
+    for ranks in chunks:
+        if seen < warmup:
+            head = warmup - seen
+            pifo.push(ranks[:head])
+            seen += len(ranks[:head])
+            if seen < warmup:
+                continue
+            pifo.reset_counters()
+            ranks = ranks[head:]
+        pifo.push(ranks)
+        seen += len(ranks)
+    if seen < warmup:
+        pifo.reset_counters()                   # Trace shorter than the warm-up, nothing counted
+    return max(seen - warmup, 0)
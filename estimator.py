@@ -0,0 +1,90 @@
+# Analytical SP-PIFO inversion estimates from a rank histogram, without simulating packets.
+# Ranks are taken as i.i.d. draws from the histogram. Write B_q for the bound of q (q 0 highest priority,
+# B_0 <= B_1 <= ...). From the all-zero start push-down never moves a bound (see engine._sppifo_loop()),
+# so a packet of rank r only sets B_q = r for the q with B_q <= r < B_q+1, and is an inversion iff r < B_0.
+# Hence:
+#   - B_1 .. B_n-1 never decrease and, given enough packets, end on the n-1 largest ranks of the support.
+#   - B_0 is then the rank of the last packet below B_1, a fresh draw from the histogram under B_1,
+#     and the inversion rate is P(r < B_0) for two independent such draws (steady_state(), exact in the limit).
+#   - On a finite trace the upper bounds may not have got there yet (large max rank, many qs, thin tails).
+#     mean_field() follows the distribution of every bound over the trace, treating bounds as independent.
+# Both return (expected inversions per packet, expected inversions per packet by rank), the counterpart of
+# inversions/max_packets and inversions_per_rank/max_packets of the simulators.
+
+import numpy as np
+
+GROWTH = 0.05                                   # mean_field() block length, as a fraction of the packets so far
+
+def _support(hist):
+    """Ranks with packets (plus rank 0, where the bounds start) and their probabilities"""
+    hist = np.asarray(hist, dtype=np.float64)
+    if hist.sum() <= 0:
+        raise ValueError("Empty rank histogram")
+    ranks = np.flatnonzero(hist)
+    if ranks[0] != 0:
+        ranks = np.concatenate(([0], ranks))
+    return ranks, hist[ranks]/hist.sum()
+
+def _per_rank(hist, ranks, values):
+    """Spread values over the support back onto len(hist) ranks"""
+    out = np.zeros(len(hist))
+    out[ranks] = values
+    return out
+
+def _tail(x):
+    """sum(x[..., s] for s > r) for every r along the last axis, without cancellation for small tails"""
+    return np.cumsum(x[..., ::-1], axis=-1)[..., ::-1] - x
+
+def steady_state(hist, num_qs):
+    """Inversion rate once the upper bounds have settled on the num_qs-1 largest ranks (any trace length if num_qs is 1)"""
+    ranks, p = _support(hist)
+    live = np.flatnonzero(p)
+    if num_qs < 1:
+        raise ValueError("Need at least one q")
+    if num_qs == 1:
+        below = p
+    elif len(live) < num_qs:
+        return 0.0, np.zeros(len(hist))         # Every rank gets a q of its own
+    else:
+        below = np.where(np.arange(len(p)) < live[-(num_qs - 1)], p, 0.0)
+    per_rank = below*_tail(below)/below.sum()   # P(r) P(B_0 > r), B_0 drawn under B_1
+    return float(per_rank.sum()), _per_rank(hist, ranks, per_rank)
+
+def mean_field(hist, num_qs, packets, growth=GROWTH):
+    """
+        Expected inversions over the first packets packets from all-zero bounds.
+        Each bound's distribution is advanced in blocks of about growth*t packets. Within a block the bound
+        above is frozen, so B_q moves to the largest rank it accepts: P(B_q <= r) gets multiplied by
+        (1 - P(a packet lands in q above r))^k. Bounds are updated together from the previous block, which also
+        delays every q by one block behind the q above it, much as the real cascade lags.
+    """
+    if packets < 1:
+        raise ValueError("Need at least one packet")
+    ranks, p = _support(hist)
+    cdf = np.ones((num_qs, len(p)))             # P(B_q <= rank), all bounds start at 0
+    per_rank = np.zeros(len(p))
+    t = 0
+    while t < packets:
+        k = min(max(1, int(t*growth)), packets - t)
+        above = np.ones((num_qs, len(p)))       # P(B_q+1 > rank), no bound above the lowest priority q
+        above[:-1] = 1 - cdf[1:]
+        accept = p*above                        # A packet of this rank lands in q if B_q <= rank
+        new = cdf*(1 - np.clip(_tail(accept), 0, 1))**k
+
+        # q 0 takes every packet under B_1, its bound is the last of them
+        a0 = min(accept[0].sum(), 1.0)
+        fresh = np.cumsum(accept[0]/a0) if a0 > 0 else np.ones(len(p))
+        stay = (1 - a0)**k
+        old_weight = (1 - stay)/a0 if a0 > 0 else k    # Packets of the block that still see the old B_0
+        per_rank += p*(old_weight*(1 - cdf[0]) + (k - old_weight)*(1 - fresh))
+        new[0] = stay*cdf[0] + (1 - stay)*fresh
+
+        cdf = new
+        t += k
+    return float(per_rank.sum()/packets), _per_rank(hist, ranks, per_rank/packets)
+
+def estimate(hist, num_qs, packets=None):
+    """mean_field() over packets packets, or steady_state() if packets is None"""
+    if packets is None:
+        return steady_state(hist, num_qs)
+    return mean_field(hist, num_qs, packets)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# Time the SP-PIFO bound update: linear push-up/push-down scan vs binary search with a lazy offset (engine.py)
+# Both loops must give the same qids, inversions and final bounds; the script checks that for every q count.
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from engine import HAVE_NUMBA, sppifo_kernel
+
+def best_of(repeat, fn):
+    """Smallest wall time of repeat calls, and the result of the last one"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-mp', help="Packets per run", type=int, default=1000000)
+    parser.add_argument('-mr', help="Max rank (uniform ranks)", type=int, default=1000)
+    parser.add_argument('-q', help="Comma separated q counts", type=str, default="2,4,8,16,32,64,128,256,512,1024")
+    parser.add_argument('-n', help="Repeats per measurement (best is kept)", type=int, default=3)
+    parser.add_argument('-s', help="Seed", type=int, default=0)
+
+    args = parser.parse_args()
+
+    ranks = np.random.default_rng(args.s).integers(0, args.mr, args.mp)
+    num_qs_list = [int(q) for q in args.q.split(",")]
+    if not HAVE_NUMBA:
+        print("Numba not installed, timing the plain Python loops")
+
+    sppifo_kernel(ranks[:1000], 2, args.mr)                 # JIT warm-up
+    sppifo_kernel(ranks[:1000], 2, args.mr, linear=True)
+
+    print(f"{'Num Qs':>7} {'linear (s)':>11} {'lazy (s)':>9} {'speedup':>8}")
+    for num_qs in num_qs_list:
+        lin_bounds = np.zeros(num_qs, dtype=np.int64)
+        lazy_bounds = np.zeros(num_qs, dtype=np.int64)
+        t_lin, lin = best_of(args.n, lambda: sppifo_kernel(ranks, num_qs, args.mr, lin_bounds.copy(), linear=True))
+        t_lazy, lazy = best_of(args.n, lambda: sppifo_kernel(ranks, num_qs, args.mr, lazy_bounds.copy()))
+        sppifo_kernel(ranks, num_qs, args.mr, lin_bounds, linear=True)
+        sppifo_kernel(ranks, num_qs, args.mr, lazy_bounds)
+        if lin[1] != lazy[1] or not np.array_equal(lin[0], lazy[0]) or not np.array_equal(lin_bounds, lazy_bounds):
+            print(f"Mismatch at {num_qs} qs")
+            exit(1)
+        print(f"{num_qs:>7} {t_lin:>11.4f} {t_lazy:>9.4f} {t_lin/t_lazy:>7.2f}x")
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# Throughput/latency/memory benchmark of every SP-PIFO/HP-PIFO engine and mode.
+# Synthetic traces (helpers/pkt-gen.py) of several sizes, distributions and rank ranges are run through:
+#   sppifo      in-process SP-PIFO (engine.SPPIFO, compiled with Numba if installed)
+#   sppifo-py   the same loop as plain Python
+#   hppifo      in-process two-stage HP-PIFO
+#   hier        in-process three-stage hierarchy, num_qs qs per stage
+#   mp, mp-hp   sppfio() / stage1_sppifo()+stage2_sppifo() pipelines over mp.Queues (-m mp)
+#   shm, shm-hp the same pipelines over shared memory rings (-m shm)
+# Every case runs in a freshly spawned process, so its peak RSS is its own.
+# In-process engines: packets/s from the best of -n passes over the whole trace, latency from a second pass pushed in
+# chunks of -b packets (chunk time / chunk size). Pipelines: the generator stamps each packet id with the
+# send time (ids are Unix times), the consumer measures dequeue time - id, and packets/s covers the whole run.
+# Results are printed and can be saved (-o) as a JSON baseline and compared (-c) with an earlier one.
+
+import argparse
+import importlib.util
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+import engine
+import shm_ring
+from engine import HAVE_NUMBA, HierPIFO, HPPIFO, SPPIFO
+from mp_queues import PriorityQueues
+from packet import END_OF_STREAM, Packet, PACKET_DTYPE
+from shm_ring import ShmRing
+from trace_io import read_trace
+
+PERCENTILES = [50, 90, 99, 99.9]
+
+def load_script(name):
+    """Import one of the hyphenated scripts (sp-pifo.py, ...) as a module"""
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_")[:-3], os.path.join(ROOT, name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+"""
+    In-process engines. Each factory returns push(ranks) over fresh state.
+"""
+
+def make_sppifo(num_qs, max_rank):
+    return SPPIFO(num_qs, max_rank + 1).push
+
+def make_sppifo_py(num_qs, max_rank):
+    loop = engine._sppifo_loop.py_func if HAVE_NUMBA else engine._sppifo_loop
+    bounds = [0 for _ in range(num_qs)]
+    inversions_per_rank = [0 for _ in range(max_rank + 1)]
+    return lambda ranks: loop(ranks.tolist(), bounds, [0 for _ in range(len(ranks))], inversions_per_rank)
+
+def make_hppifo(num_qs, max_rank):
+    return HPPIFO(num_qs, num_qs, max_rank + 1).push
+
+def make_hier(num_qs, max_rank):
+    return HierPIFO([num_qs, num_qs, num_qs], max_rank + 1).push
+
+BATCH_ENGINES = {"sppifo": make_sppifo, "sppifo-py": make_sppifo_py, "hppifo": make_hppifo, "hier": make_hier}
+
+def bench_batch(make, ranks, num_qs, max_rank, chunk, repeat):
+    """Returns (best of repeat times for the whole trace, per-packet latency samples in seconds)"""
+    make(num_qs, max_rank)(ranks[:1000])            # JIT warm-up
+    seconds = float("inf")
+    for _ in range(repeat):
+        push = make(num_qs, max_rank)
+        start = time.perf_counter()
+        push(ranks)
+        seconds = min(seconds, time.perf_counter() - start)
+
+    push = make(num_qs, max_rank)
+    latencies = []
+    for i in range(0, len(ranks), chunk):
+        part = ranks[i:i + chunk]
+        start = time.perf_counter()
+        push(part)
+        latencies.append((time.perf_counter() - start)/len(part))
+    return seconds, np.array(latencies)
+
+"""
+    Pipelines. The stages are the simulators' own, only the generator and the consumer are swapped
+    for ones that stamp and time the packets.
+"""
+
+def stamp_packets(ranks, inp_q):
+    """Generator: one Packet per rank, id = send time"""
+    for rank in ranks.tolist():
+        inp_q.put(Packet(rank=rank, id=time.time()), block=True)
+    inp_q.put(END_OF_STREAM, block=True)
+
+def drain_queues(group, order, lat_q):
+    """Strict priority consumer over a PriorityQueues group, until END_OF_STREAM"""
+    latencies = []
+    while True:
+        pkt = group.get(order)
+        if pkt is END_OF_STREAM:
+            break
+        latencies.append(time.time() - pkt.pktid)
+    lat_q.put(np.array(latencies))
+
+def stamp_ring(ranks, ring, batch=shm_ring.BATCH):
+    """Generator: records pushed in batches, id = push time"""
+    for i in range(0, len(ranks), batch):
+        records = np.empty(min(batch, len(ranks) - i), dtype=PACKET_DTYPE)
+        records["rank"] = ranks[i:i + batch]
+        records["id"] = time.time()
+        ring.push(records)
+    ring.close()
+
+def drain_rings(rings, lat_q):
+    """Strict priority consumer over rings, until all are drained"""
+    latencies = []
+    spins = 0
+    while True:
+        for ring in rings:
+            batch = ring.pop()
+            if batch is not None:
+                latencies.append(time.time() - batch["id"])
+                spins = 0
+                break
+        else:
+            if all(ring.drained() for ring in rings):
+                break
+            spins = shm_ring.backoff(spins)
+    lat_q.put(np.concatenate(latencies) if latencies else np.empty(0))
+
+def run_procs(procs, lat_q):
+    """Start, collect the consumer's latencies, join. Returns (seconds, latencies)"""
+    start = time.perf_counter()
+    for proc in reversed(procs):
+        proc.start()                                # Consumer first: stamps start once the pipeline is up
+    latencies = lat_q.get()
+    for proc in procs:
+        proc.join()
+    return time.perf_counter() - start, latencies
+
+def bench_mp(ranks, num_qs, max_rank):
+    sp = load_script("sp-pifo.py")
+    inp_q = mp.Queue(maxsize=1)
+    group = PriorityQueues(num_qs)
+    lat_q = mp.Queue()
+    procs = [mp.Process(target=stamp_packets, args=(ranks, inp_q)),
+             mp.Process(target=sp.sppfio, args=(inp_q, group.lanes(), max_rank, mp.Value("i", 0), num_qs, mp.Array("i", max_rank + 1))),
+             mp.Process(target=drain_queues, args=(group, list(range(num_qs)), lat_q))]
+    return run_procs(procs, lat_q)
+
+def bench_mp_hp(ranks, num_qs, max_rank):
+    hp = load_script("hp-pifo.py")
+    inp_q = mp.Queue(maxsize=1)
+    group = PriorityQueues(2*num_qs)
+    s2_qs = group.lanes(0, num_qs)
+    s1_qs = group.lanes(num_qs, num_qs)
+    lat_q = mp.Queue()
+    order = list(range(num_qs)) + list(range(num_qs + 1, 2*num_qs))
+    procs = [mp.Process(target=stamp_packets, args=(ranks, inp_q)),
+             mp.Process(target=hp.stage1_sppifo, args=(inp_q, s1_qs, s2_qs, mp.Value("i", 0), mp.Array("i", max_rank + 1))),
+             mp.Process(target=hp.stage2_sppifo, args=(s1_qs, s2_qs, mp.Value("i", 0), mp.Array("i", max_rank + 1))),
+             mp.Process(target=drain_queues, args=(group, order, lat_q))]
+    return run_procs(procs, lat_q)
+
+def bench_shm(ranks, num_qs, max_rank):
+    inp_ring = ShmRing()
+    out_rings = [ShmRing() for _ in range(num_qs)]
+    lat_q = mp.Queue()
+    procs = [mp.Process(target=stamp_ring, args=(ranks, inp_ring)),
+             mp.Process(target=shm_ring.sppifo_stage, args=(inp_ring, out_rings, max_rank + 1, mp.Value("i", 0), mp.Array("i", max_rank + 1))),
+             mp.Process(target=drain_rings, args=(out_rings, lat_q))]
+    result = run_procs(procs, lat_q)
+    for ring in [inp_ring] + out_rings:
+        ring.release()
+    return result
+
+def bench_shm_hp(ranks, num_qs, max_rank):
+    inp_ring = ShmRing()
+    s1_rings = [ShmRing() for _ in range(num_qs)]
+    s2_rings = [ShmRing() for _ in range(num_qs)]
+    lat_q = mp.Queue()
+    procs = [mp.Process(target=stamp_ring, args=(ranks, inp_ring)),
+             mp.Process(target=shm_ring.sppifo_stage, args=(inp_ring, s1_rings, max_rank + 1, mp.Value("i", 0), mp.Array("i", max_rank + 1))),
+             mp.Process(target=shm_ring.sppifo_stage, args=(s1_rings[0], s2_rings, max_rank + 1, mp.Value("i", 0), mp.Array("i", max_rank + 1))),
+             mp.Process(target=drain_rings, args=(s2_rings + s1_rings[1:], lat_q))]
+    result = run_procs(procs, lat_q)
+    for ring in [inp_ring] + s1_rings + s2_rings:
+        ring.release()
+    return result
+
+PIPELINES = {"mp": bench_mp, "mp-hp": bench_mp_hp, "shm": bench_shm, "shm-hp": bench_shm_hp}
+ENGINES = list(BATCH_ENGINES) + list(PIPELINES)
+
+def run_case(case, trace, chunk, repeat, out_q):
+    """Spawned per case: run it and put the result dict in out_q"""
+    mp.set_start_method("fork", force=True)        # Pipeline stages start the way the simulators start them
+    _, ranks, max_rank = read_trace(trace)
+    ranks = np.asarray(ranks[:case["packets"]], dtype=np.int64)
+    if case["engine"] in BATCH_ENGINES:
+        seconds, latencies = bench_batch(BATCH_ENGINES[case["engine"]], ranks, case["num_qs"], max_rank, chunk, repeat)
+    else:
+        make_sppifo(2, max_rank)(ranks[:1000])      # JIT warm-up, the forked shm stages inherit it
+        seconds, latencies = PIPELINES[case["engine"]](ranks, case["num_qs"], max_rank)
+
+    # ru_maxrss is in KiB on Linux; the children figure is the largest pipeline process
+    rss_kib = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    pcts = np.percentile(latencies, PERCENTILES) if len(latencies) else [float("nan")]*len(PERCENTILES)
+    out_q.put(dict(case, seconds=seconds, pkts_per_s=len(ranks)/seconds,
+                   latency_us={f"p{p:g}": float(v)*1e6 for p, v in zip(PERCENTILES, pcts)},
+                   peak_rss_mb=rss_kib/1024))
+
+def case_key(case):
+    return (case["engine"], case["dist"], case["packets"], case["max_rank"], case["num_qs"])
+
+def environment():
+    """What the numbers were measured on"""
+    try:
+        commit = subprocess.run(["git", "-C", ROOT, "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"commit": commit, "date": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+            "numpy": np.__version__, "numba": HAVE_NUMBA, "cpus": os.cpu_count(), "machine": platform.machine()}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-e', help="Comma separated engines: " + ", ".join(ENGINES), type=str, default=",".join(ENGINES))
+    parser.add_argument('-mp', help="Comma separated trace sizes (packets)", type=str, default="100000,1000000")
+    parser.add_argument('-d', help="Comma separated rank distributions (pkt-gen.py -d)", type=str, default="unif,pois")
+    parser.add_argument('-mr', help="Comma separated max ranks", type=str, default="100,1000")
+    parser.add_argument('-q', help="Comma separated q counts (per stage for hppifo/hier/-hp)", type=str, default="2,8,32")
+    parser.add_argument('-pm', help="Packet cap for the mp/shm pipelines, which are much slower", type=int, default=20000)
+    parser.add_argument('-b', help="Chunk size for the in-process latency pass", type=int, default=1024)
+    parser.add_argument('-n', help="Whole-trace passes of the in-process engines, the fastest is kept", type=int, default=3)
+    parser.add_argument('-o', help="Save results as a JSON baseline", type=str, default=None)
+    parser.add_argument('-c', help="Compare packets/s with a JSON baseline", type=str, default=None)
+    parser.add_argument('-t', help="Slowdown vs the baseline reported as a regression", type=float, default=0.1)
+    parser.add_argument('-s', help="Seed", type=int, default=0)
+
+    args = parser.parse_args()
+
+    engines = args.e.split(",")
+    unknown = [name for name in engines if name not in ENGINES]
+    if unknown:
+        print(f"Unknown engines {unknown}")
+        exit(1)
+    sizes = [int(n) for n in args.mp.split(",")]
+    dists = args.d.split(",")
+    max_ranks = [int(n) for n in args.mr.split(",")]
+    num_qs_list = [int(n) for n in args.q.split(",")]
+
+    pkt_gen = load_script("helpers/pkt-gen.py")
+    unknown = [dist for dist in dists if dist not in pkt_gen.GENERATORS or dist == "hist"]
+    if unknown:
+        print(f"Unknown distributions {unknown}")
+        exit(1)
+
+    ctx = mp.get_context("spawn")
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'engine':>10} {'dist':>6} {'packets':>9} {'max rank':>8} {'qs':>4} {'Mpkts/s':>9} "
+              f"{'p50 us':>9} {'p99 us':>9} {'p99.9 us':>9} {'RSS MB':>8}")
+        for dist in dists:
+            for max_rank in max_ranks:
+                trace = os.path.join(tmp, f"{dist}_{max_rank}.bin")
+                pkt_gen.gen_trace(trace, dist, max(sizes), max_rank, seed=args.s, fmt="bin", t0=0)
+                for size in sizes:
+                    for name in engines:
+                        packets = min(size, args.pm) if name in PIPELINES else size
+                        for num_qs in num_qs_list:
+                            case = {"engine": name, "dist": dist, "packets": packets, "max_rank": max_rank, "num_qs": num_qs}
+                            if any(case_key(rec) == case_key(case) for rec in results):
+                                continue            # Pipeline sizes capped to the same packet count
+                            out_q = ctx.Queue()
+                            proc = ctx.Process(target=run_case, args=(case, trace, args.b, args.n, out_q))
+                            proc.start()
+                            proc.join()
+                            if proc.exitcode != 0:
+                                print(f"{name:>10} {dist:>6} {packets:>9} {max_rank:>8} {num_qs:>4} failed (exit code {proc.exitcode})")
+                                continue
+                            rec = out_q.get()
+                            results.append(rec)
+                            lat = rec["latency_us"]
+                            print(f"{name:>10} {dist:>6} {packets:>9} {max_rank:>8} {num_qs:>4} {rec['pkts_per_s']/1e6:>9.3f} "
+                                  f"{lat['p50']:>9.3f} {lat['p99']:>9.3f} {lat['p99.9']:>9.3f} {rec['peak_rss_mb']:>8.1f}")
+
+    if args.o:
+        with open(args.o, 'w') as f:
+            json.dump({"environment": environment(), "results": results}, f, indent=1)
+        print(f"Wrote {args.o}")
+
+    if args.c:
+        with open(args.c, 'r') as f:
+            baseline = {case_key(rec): rec for rec in json.load(f)["results"]}
+        regressions = 0
+        print(f"\nvs {args.c}")
+        for rec in results:
+            base = baseline.get(case_key(rec))
+            if base is None:
+                continue
+            ratio = rec["pkts_per_s"]/base["pkts_per_s"]
+            flag = " REGRESSION" if ratio < 1 - args.t else ""
+            regressions += bool(flag)
+            print(f"{rec['engine']:>10} {rec['dist']:>6} {rec['packets']:>9} {rec['max_rank']:>8} {rec['num_qs']:>4} {ratio:>7.2f}x{flag}")
+        exit(1 if regressions else 0)
@@ -1,6 +1,10 @@
+import os
 import sys
 from matplotlib import pyplot as plt
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from trace_io import rank_histogram
+
 # Check if the filename is provided
 if len(sys.argv) < 2:
     print("Usage: ./pkt-gen-hist.py <filename>")
@@ -9,25 +13,19 @@ if len(sys.argv) < 2:
 # Get the filename from the command line
 filename = sys.argv[1]
 
-# Read the ranks from the specified file
-ranks = []
-max_rank = None
-max_packets = None
-with open(filename, 'r') as f:
-    max_packets, max_rank = map(int, f.readline().strip().split(","))
-    for _ in range(max_packets):
-        id, rank = f.readline().strip().split(" ")
-        ranks.append(int(rank))
+# Count the ranks of the specified file (text or binary trace), chunk by chunk, or read its .hist sidecar
+counts = rank_histogram(filename)
+max_rank = len(counts) - 1
 
-# print(ranks)
+# print(counts)
 
-# Create the histogram with integer bins and aligned bars
-plt.hist(x=ranks, bins=range(0, max_rank + 2), rwidth=0.7, align='left')
+# Plot the counts with integer bins and aligned bars
+plt.bar(range(len(counts)), counts, width=0.7, align='center')
 plt.xlabel('Ranks')
 plt.ylabel('Frequency')
 plt.title('Histogram of Ranks')
 
-# Set x-axis ticks to integers
-plt.xticks(range(0, max_rank + 1, 1))  # Adjust the step size as needed
+# Set x-axis ticks to integers, about 20 of them
+plt.xticks(range(0, max_rank + 1, max(1, (max_rank + 1)//20)))
 
 plt.show()
@@ -1,59 +1,186 @@
 #!/usr/bin/env python3
 
 import argparse
-import numpy as np
+import os
+import sys
 import time
 
-def gen_exp(outf, max_packets, max_rank):
-    pass
-
-def gen_unif(outf, max_packets, max_rank):
-    total_pkts = 0
-    with open(outf, 'w') as f:
-        f.write(f"{max_packets}, {max_rank}\n")
-        while total_pkts < max_packets:
-            rank = np.random.randint(1, max_rank)
-            id = time.time()
-            pkt = (id, rank)
-            f.write(f"{(pkt[0]):.6f} {pkt[1]}\n")
-
-            total_pkts += 1
-
-def gen_pois(outf, max_packets, max_rank):
-    total_pkts = 0
-    lam = max_rank//2
-    with open(outf, 'w') as f:
-        f.write(f"{max_packets}, {max_rank}\n")
-        while total_pkts < max_packets:
-            rank = np.random.poisson(lam=lam)
-            while rank < 1 or rank > max_rank:
-                rank = np.random.poisson(lam=lam)
-
-            id = time.time()
-            pkt = (id, rank)
-            f.write(f"{(pkt[0]):.6f} {pkt[1]}\n")
-
-            total_pkts += 1
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from trace_io import BIN_HEADER, BIN_MAGIC, HIST_SUFFIX, ID_DTYPE, RANK_DTYPE, read_hist, write_hist
+
+CHUNK = 1 << 20                                 # Packets drawn and written per batch
+
+"""
+    Rank samplers. Each returns n ranks in [1, max_rank] as an int64 array, except unif: [1, max_rank - 1],
+    kept from the original generator. param is the distribution parameter given with -p, None for the default.
+"""
+
+def gen_unif(rng, n, max_rank, param):
+    # Same range as the original per-packet np.random.randint(1, max_rank)
+    return rng.integers(1, max_rank, size=n)
+
+def gen_pois(rng, n, max_rank, param):
+    """Poisson(lam) truncated to [1, max_rank], lam defaults to max_rank//2"""
+    lam = param if param is not None else max_rank//2
+    if lam <= 0:
+        print("Poisson lambda must be positive.")
+        exit(1)
+    # Inverse CDF of the truncated pmf, computed in logs (lam^k/k! overflows) so any lam works without redraws
+    k = np.arange(1, max_rank + 1, dtype=np.float64)
+    logp = k*np.log(lam) - np.cumsum(np.log(k))
+    cdf = np.cumsum(np.exp(logp - logp.max()))
+    cdf /= cdf[-1]
+    return np.searchsorted(cdf, rng.random(n), side='right') + 1
+
+def gen_exp(rng, n, max_rank, param):
+    """Exponential with scale param (default max_rank/4), truncated to the rank range. Low ranks are frequent."""
+    scale = param if param is not None else max_rank/4
+    # Inverse CDF of the exponential truncated to [0, max_rank), no rejection needed
+    u = rng.random(n)
+    x = -scale*np.log1p(-u*(-np.expm1(-max_rank/scale)))
+    return np.minimum(x.astype(np.int64) + 1, max_rank)
+
+def gen_invexp(rng, n, max_rank, param):
+    """Mirror image of exp. High ranks are frequent."""
+    return max_rank + 1 - gen_exp(rng, n, max_rank, param)
+
+def gen_zipf(rng, n, max_rank, param):
+    """P(rank = k) proportional to k^-a over 1..max_rank, a defaults to 1.2"""
+    a = param if param is not None else 1.2
+    weights = np.arange(1, max_rank + 1, dtype=np.float64)**-a
+    return rng.choice(max_rank, size=n, p=weights/weights.sum()) + 1
+
+def gen_pareto(rng, n, max_rank, param):
+    """Pareto with shape a (default 1.0) and scale 1, truncated to [1, max_rank + 1) and floored"""
+    a = param if param is not None else 1.0
+    # Inverse CDF of the truncated Pareto
+    u = rng.random(n)
+    x = (1 - u*(1 - float(max_rank + 1)**-a))**(-1/a)
+    return np.clip(x.astype(np.int64), 1, max_rank)
+
+def gen_hist(rng, n, max_rank, counts):
+    """Empirical histogram: counts[r] is the weight of rank r. Rank 0 and ranks above max_rank are ignored."""
+    weights = np.zeros(max_rank + 1, dtype=np.float64)
+    m = min(len(counts), max_rank + 1)
+    weights[1:m] = counts[1:m]
+    if weights.sum() <= 0:
+        print("Histogram has no weight in [1, max_rank].")
+        exit(1)
+    return rng.choice(max_rank + 1, size=n, p=weights/weights.sum())
+
+GENERATORS = {
+    "unif": gen_unif,
+    "pois": gen_pois,
+    "exp": gen_exp,
+    "invexp": gen_invexp,
+    "zipf": gen_zipf,
+    "pareto": gen_pareto,
+    "hist": gen_hist,
+}
+
+def _digits(values, out):
+    """ASCII digits of non-negative integers into the rows of out (one row per digit, right aligned, zero padded)"""
+    v = values.copy()
+    for row in range(len(out) - 1, -1, -1):
+        v, d = np.divmod(v, 10)
+        np.add(d, ord("0"), out=out[row], casting='unsafe')
+
+def format_txt(ids, ranks):
+    """
+        Text trace lines "<id> <rank>" for a chunk, as bytes, the same as np.savetxt(fmt="%.6f %d") up to
+        rounding of the last id digit. Built column-wise with numpy: savetxt formats line by line in Python.
+        Lines are laid out one character per row (contiguous column writes), leading zeros masked out.
+    """
+    micros = np.round(np.asarray(ids, dtype=np.float64)*1e6).astype(np.int64)
+    ranks = np.asarray(ranks, dtype=np.int64)
+    whole, frac = np.divmod(micros, 1000000)
+    n = len(ranks)
+    wi, wr = len(str(int(whole.max(initial=0)))), len(str(int(ranks.max(initial=0))))
+    width = wi + 8 + wr + 1                     # "<whole>.<6 digits> <rank>\n"
+    lines = np.empty((width, n), dtype=np.uint8)
+    _digits(whole, lines[:wi])
+    lines[wi] = ord(".")
+    _digits(frac, lines[wi + 1:wi + 7])
+    lines[wi + 7] = ord(" ")
+    _digits(ranks, lines[wi + 8:width - 1])
+    lines[width - 1] = ord("\n")
+    keep = np.ones((width, n), dtype=bool)
+    for first, digits, values in ((0, wi, whole), (wi + 8, wr, ranks)):
+        for k in range(digits - 1):             # Leading zero unless values >= 10**(digits - 1 - k)
+            np.greater_equal(values, 10**(digits - 1 - k), out=keep[first + k])
+    return lines.T[keep.T].tobytes()
+
+def gen_trace(outf, dist, max_packets, max_rank, seed=0, param=None, fmt="txt", t0=None, interarrival=1e-6, hist=False):
+    """
+        Write a trace of max_packets packets, CHUNK packets at a time.
+        Packet ids are timestamps starting at t0 (default: now) spaced by interarrival seconds.
+        Ranks only depend on the seed, so the same seed gives the same ranks.
+        With hist, the rank counts are also written to <outf>.hist (trace_io.rank_histogram() picks it up).
+    """
+    gen = GENERATORS[dist]
+    rng = np.random.default_rng(seed)
+    t0 = time.time() if t0 is None else t0
+
+    def ids(start, n):
+        return t0 + np.arange(start, start + n, dtype=np.float64)*interarrival
+
+    counts = np.zeros(max_rank + 1, dtype=np.int64)
+
+    def ranks(n):
+        chunk_ranks = gen(rng, n, max_rank, param)
+        if hist:
+            counts[:] += np.bincount(chunk_ranks, minlength=max_rank + 1)
+        return chunk_ranks
+
+    if fmt == "bin":
+        with open(outf, 'wb') as f:
+            f.write(BIN_HEADER.pack(BIN_MAGIC, max_packets, max_rank))
+            # Columns are contiguous: all ids first, then all ranks
+            for start in range(0, max_packets, CHUNK):
+                ids(start, min(CHUNK, max_packets - start)).astype(ID_DTYPE).tofile(f)
+            for start in range(0, max_packets, CHUNK):
+                ranks(min(CHUNK, max_packets - start)).astype(RANK_DTYPE).tofile(f)
+    else:
+        with open(outf, 'wb') as f:
+            f.write(f"{max_packets}, {max_rank}\n".encode())
+            for start in range(0, max_packets, CHUNK):
+                n = min(CHUNK, max_packets - start)
+                f.write(format_txt(ids(start, n), ranks(n)))
+
+    if hist:
+        write_hist(outf + HIST_SUFFIX, counts)
 
 if __name__ == "__main__":
-    np.random.seed(0)
     parser = argparse.ArgumentParser()
-    parser.add_argument('-d', help="Distribution: unif, pois. More will be added.", type=str)
+    parser.add_argument('-d', help="Distribution: " + ", ".join(GENERATORS), type=str)
     parser.add_argument('-o', help="Output file", type=str)
     parser.add_argument('-mp', help="Max packets to generate", type=int)
     parser.add_argument('-mr', help="Max packet ranks", type=int)
+    parser.add_argument('-p', help="Distribution parameter: pois lambda, exp/invexp scale, zipf/pareto exponent", type=float, default=None)
+    parser.add_argument('-hf', help="Histogram file for -d hist (whitespace separated counts, i-th is rank i)", type=str, default=None)
+    parser.add_argument('-s', help="Random seed", type=int, default=0)
+    parser.add_argument('-f', help="Output format: txt or bin (see trace_io.py). "
+                        "txt takes about 0.5s per million packets, bin is much faster and recommended for large traces", type=str, default="txt")
+    parser.add_argument('-ia', help="Inter-arrival time between packet ids, in seconds", type=float, default=1e-6)
+    parser.add_argument('-hs', help="Also write the rank histogram to <output>.hist, for instant plotting", action="store_true")
 
     args = parser.parse_args()
 
-    if args.d == "exp":
-        gen_exp(args.o, args.mp, args.mr)
-    elif args.d == "unif":
-        gen_unif(args.o, args.mp, args.mr)
-    elif args.d == "pois":
-        gen_pois(args.o, args.mp, args.mr)
-    else:
+    if args.d not in GENERATORS:
         print("Incorrect distribution.")
         exit(1)
 
-    # Parse arguments for distribution of packets
+    if args.f not in ("txt", "bin"):
+        print(f"Unknown format {args.f}")
+        exit(1)
+
+    param = args.p
+    if args.d == "hist":
+        if args.hf is None:
+            print("-d hist needs a histogram file (-hf).")
+            exit(1)
+        param = read_hist(args.hf).astype(np.float64)
 
+    gen_trace(args.o, args.d, args.mp, args.mr, seed=args.s, param=param, fmt=args.f, interarrival=args.ia, hist=args.hs)
@@ -1,24 +1,48 @@
+import os
 import sys
+import numpy as np
 from matplotlib import pyplot as plt
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from trace_io import HIST_SUFFIX, bincount_ranks, is_trace, rank_histogram, read_hist
+
+BLOCK = 1 << 24                                 # Bytes of the rank list parsed at a time
+
+def iter_rank_list(filename):
+    """Yield int64 arrays from a whitespace separated rank list (e.g. pois_hist.txt), one block at a time"""
+    rest = ""
+    with open(filename, 'r') as f:
+        while True:
+            block = f.read(BLOCK)
+            if not block:
+                break
+            block = rest + block
+            cut = max(block.rfind(" "), block.rfind("\n"))     # Last token may continue in the next block
+            rest = block[cut + 1:]
+            yield np.array(block[:cut + 1].split(), dtype=np.int64)
+    if rest.strip():
+        yield np.array(rest.split(), dtype=np.int64)
+
 # Check if the filename is provided
 if len(sys.argv) < 2:
-    print("Usage: python script.py <filename>")
+    print("Usage: python script.py <filename> (rank list, trace or .hist counts)")
     sys.exit(1)
 
 # Get the filename from the command line
 filename = sys.argv[1]
 
-# Read the ranks from the specified file
-ranks = []
-with open(filename, 'r') as f:
-    ranks = [int(x) for x in f.readline().strip().split(" ")]
+# Count the ranks from the specified file without holding them all in memory
+if filename.endswith(HIST_SUFFIX):
+    counts = read_hist(filename)
+elif is_trace(filename):
+    counts = rank_histogram(filename)
+else:
+    counts = bincount_ranks(iter_rank_list(filename))
 
-max_rank = max(ranks)
-print(ranks)
+print(counts)
 
-# Create the histogram
-plt.hist(x=ranks, bins=max_rank, rwidth=0.7)
+# Create the histogram from the counts
+plt.bar(range(len(counts)), counts, width=0.7)
 plt.xlabel('Ranks')
 plt.ylabel('Frequency')
 plt.title('Histogram of Ranks')
@@ -1,35 +1,44 @@
+import os
 import sys
 from matplotlib import pyplot as plt
 from io import StringIO
 
 # Check if the filename is provided
 if len(sys.argv) < 2:
-    print("Usage: python script.py <filename>")
+    print("Usage: python script.py <filename> (_inv_per_rank.csv or _results.npz)")
     sys.exit(1)
 
 # Get the filename from the command line
 filename = sys.argv[1]
 
-# Read the ranks from the specified file
-ranks = []
-content = None
-with open(filename, 'r') as f:
-    content = f.read()
-
 # Read data into dictionary from file
 data = {}
-file = StringIO(content)
+if filename.endswith(".npz"):
+    # Columnar results (results.write_columnar): normalize the raw per-rank counts here
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    from results import read_columnar
 
-lines = file.readlines()
-for i in range(0, len(lines), 2):  # Step by 2 lines (one for MR/NQs, one for values)
-    # Parse MR and NQs
-    header = lines[i].strip()
-    mr_value = int(header.split("MR: ")[1].split(",")[0])
-    nqs_value = int(header.split("NQs: ")[1])
-    
-    # Parse y-values
-    y_values = list(map(float, lines[i + 1].strip().split()))
-    data[(mr_value, nqs_value)] = y_values
+    cols = read_columnar(filename)["sppifo"]
+    norm = cols["inversions_per_rank"]/(cols["iterations"]*cols["max_packets"])[:, None]
+    for mr_value, nqs_value, y_values in zip(cols["max_rank"].tolist(), cols["num_qs"].tolist(), norm):
+        data[(mr_value, nqs_value)] = y_values[:mr_value]
+else:
+    # Legacy _inv_per_rank.csv
+    with open(filename, 'r') as f:
+        content = f.read()
+
+    file = StringIO(content)
+
+    lines = file.readlines()
+    for i in range(0, len(lines), 2):  # Step by 2 lines (one for MR/NQs, one for values)
+        # Parse MR and NQs
+        header = lines[i].strip()
+        mr_value = int(header.split("MR: ")[1].split(",")[0])
+        nqs_value = int(header.split("NQs: ")[1])
+
+        # Parse y-values
+        y_values = list(map(float, lines[i + 1].strip().split()))
+        data[(mr_value, nqs_value)] = y_values
 
 uniq_mr_values = sorted({key[0] for key in data.keys()})
 fig, axs = plt.subplots(len(uniq_mr_values), 1)
@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+# Convert text packet traces (helpers/pkt-gen.py output) to the binary trace format in trace_io.py
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from trace_io import convert_txt, is_binary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', help="Input text trace", type=str)
+    parser.add_argument('-o', help="Output binary trace (default: input with .bin extension)", type=str, default=None)
+
+    args = parser.parse_args()
+
+    if is_binary(args.i):
+        print(f"{args.i} is already a binary trace.")
+        exit(1)
+
+    outf = args.o if args.o else os.path.splitext(args.i)[0] + ".bin"
+    convert_txt(args.i, outf)
+    print(f"Wrote {outf}")
@@ -5,12 +5,28 @@
 
 # TODO: Try different packet ranks. Uniform, Exponential, Inverse Exponential, Poisson
 
-import time
 import random
 import multiprocessing as mp
 import numpy as np
 import argparse
 
+from mp_queues import PriorityQueues, generate_packet
+from packet import END_OF_STREAM, STAGE_HANDOFF
+import shm_ring
+from shm_ring import ShmRing
+from engine import HierPIFO, HPPIFO, hier_stream, hppifo_batch, hppifo_stream
+from results import (write_hp_csv, write_hp_dequeue_csv, write_hp_long_csv, write_hier_csv, write_hier_dequeue_csv,
+                     write_hier_long_csv, write_hier_steady_csv, write_hier_windows_csv, write_steady_csv, write_windows_csv,
+                     write_replay_csv, write_delay_per_rank, write_columnar, normalized)
+from scheduler import pifo_record, simulate, summarize
+from cache import ResultCache
+from instrument import Recorder, instrument_path
+from replay import parse_replay, replay, summarize_replay
+from sweep import run_sweep
+from trace_io import cached_trace, expand_traces, iter_chunks, iter_ranks, read_header
+from warmstart import canonical, file_histogram, parse_warm_start, warm_run
+from windows import make_windows, parse_window
+
 # NUM_OF_S1_QUEUES = [2, 4, 8, 16]
 # NUM_OF_S2_QUEUES = [2, 4, 8, 16]
 
@@ -19,54 +35,19 @@ NUM_OF_S2_QUEUES = [2, 4, 8, 16]
 
 ITERATIONS = 1                                  # Not needed since, constant packets
 
-class Packet:
-    def __init__(self, rank, id) -> None:
-        self.rank = rank
-        self.pktid = id                         # Unix time in seconds
-    
-    def __repr__(self) -> str:
-        return(f"Rank: {self.rank}, ID: {self.pktid}")
-
-def generate_packet(inpf, inp_q):
-    """Read packets from file and put in input q"""
-    with open(inpf, 'r') as f:
-        total_pkts, max_rank = map(int, f.readline().strip().split(","))
-        for _ in range(total_pkts):
-            id, rank = f.readline().strip().split(" ")
-            pkt = Packet(rank=int(rank), id=float(id))
-            inp_q.put(pkt, block=True)
-
-        """Last sentinel packet"""
-        inp_q.put(Packet(-1, -1), block=True)
-        print("Sent last packet")
-
-def consume_packet(s1_qs, s2_qs):
-    """Consume packet from s1 qs as well, except the first q"""
+def consume_packet(qs, num_s1_qs, num_s2_qs):
+    """
+        Consume packet from s1 qs as well, except the first q.
+        qs is one PriorityQueues group: s2 qs first (highest priority), then s1 qs.
+        The first s1 q is left for stage 2.
+    """
+    order = list(range(num_s2_qs)) + list(range(num_s2_qs + 1, num_s2_qs + num_s1_qs))
     while True:
-        selected_q = None
-
-        """Select a queue from the second stage first (has highest priority)"""
-        for q in s2_qs:
-            if not q.empty():
-                selected_q = q
-                break
-        
-        """If second stage q is not selected, then choose from first stage, except the 1st q in first stage"""
-        if selected_q == None:
-            for i, q in enumerate(s1_qs):              # First q has highest priority
-                if i == 0:
-                    continue
-
-                if not q.empty():
-                    selected_q = q
-                    break
-                
-        if selected_q:
-            pkt = selected_q.get()
-            # print(f"Consumed {pkt}")
-            if pkt.pktid == -1:
-                # print("Received last packet")
-                break
+        pkt = qs.get(order)                     # Sleeps while all these qs are empty
+        # print(f"Consumed {pkt}")
+        if pkt is END_OF_STREAM:
+            # print("Received last packet")
+            break
 
 def stage1_sppifo(inpq, s1_qs, s2_qs, avg_inv, avg_inv_per_rank):
     """
@@ -82,9 +63,9 @@ def stage1_sppifo(inpq, s1_qs, s2_qs, avg_inv, avg_inv_per_rank):
     
     while True:
         pkt = inpq.get()
-        if pkt.pktid == -1:
+        if pkt is END_OF_STREAM:
             s1_qs[-1].put(pkt)                  # Put into lowest priority q
-            s1_qs[0].put(Packet(-2, -2))                  # Indicate s2 that last packet arrived
+            s1_qs[0].put(STAGE_HANDOFF)                  # Indicate s2 that last packet arrived
             print("S1 rxd last packet")
             break
 
@@ -137,7 +118,7 @@ def stage2_sppifo(s1_qs, s2_qs, avg_inv, avg_inv_per_rank):
 
     while True:
         pkt = inpq.get()
-        if pkt.pktid == -2:
+        if pkt is STAGE_HANDOFF:
             # s2_qs[-1].put(pkt)
             print("S2 rxd last packet")
             break
@@ -160,29 +141,336 @@ def stage2_sppifo(s1_qs, s2_qs, avg_inv, avg_inv_per_rank):
             avg_inv_per_rank[pkt.rank] += 1
             cost = bounds[-1] - pkt.rank
             for i, bound in enumerate(bounds):
-                if i != len(s1_qs)-1:
+                if i != len(s2_qs)-1:
                     bounds[i] = bounds[i] - cost
 
     avg_inv.value += inversions
 
+def run_config(cfg):
+    """
+        Batch engine worker for one configuration: trace, num_s1_qs, num_s2_qs, chunk, rates.
+        With a chunk size the trace is streamed chunk by chunk instead of loaded whole.
+        With (enq_rate, deq_rate) rates the trace is also replayed through the dequeue model,
+        serving qs in the same order as consume_packet().
+        engine "pifo" runs the ideal PIFO reference instead (independent of the q counts, run once per trace),
+        engine "hier" an N-stage hierarchy (see run_hier_config()).
+        With instrument (every, npz path) the first iteration is instrumented and the samples written there (instrument.py).
+        With a warm_start spec (warmstart.py) the trace is run once more from warm bounds, into the steady_* fields.
+        With a window spec (windows.py) the first iteration also counts inversions per window, into the s1_window_*/s2_window_* fields.
+        With a replay spec (replay.py) the qs are also replayed in time with a link rate and q limits, into the replay_* fields.
+    """
+    if cfg["engine"] == "pifo":
+        return pifo_record(cfg["trace"], cfg["rates"])
+    if cfg["engine"] == "hier":
+        return run_hier_config(cfg)
+
+    inpf, num_s1_qs, num_s2_qs, chunk = cfg["trace"], cfg["num_s1_qs"], cfg["num_s2_qs"], cfg["chunk"]
+    if chunk:
+        max_packets, max_rank = read_header(inpf)
+        """Time windows need the ids too"""
+        run = lambda recorder, windows: hppifo_stream(iter_chunks(inpf, chunk) if windows else iter_ranks(inpf, chunk),
+                                                      num_s1_qs, num_s2_qs, max_rank, recorder, windows)[:4]
+    else:
+        ids, ranks, max_rank = cached_trace(inpf)
+        max_packets = len(ranks)
+        run = lambda recorder, windows: hppifo_batch(ranks, num_s1_qs, num_s2_qs, max_rank, recorder, windows, ids)
+
+    recorder = Recorder(cfg["instrument"][0]) if cfg.get("instrument") else None
+    windows = make_windows(cfg["window"], 2) if cfg.get("window") else None
+    s1_inversions = 0
+    s2_inversions = 0
+    s1_inversions_per_rank = np.zeros(max_rank, dtype=np.int64)
+    s2_inversions_per_rank = np.zeros(max_rank, dtype=np.int64)
+    for it in range(ITERATIONS):
+        s1_inv, s1_inv_per_rank, s2_inv, s2_inv_per_rank = run(recorder if it == 0 else None, windows if it == 0 else None)
+        s1_inversions += s1_inv
+        s2_inversions += s2_inv
+        s1_inversions_per_rank += s1_inv_per_rank
+        s2_inversions_per_rank += s2_inv_per_rank
+
+    rec = {"engine": "hppifo", "trace": inpf, "num_s1_qs": num_s1_qs, "num_s2_qs": num_s2_qs, "max_rank": max_rank,
+           "max_packets": max_packets, "iterations": ITERATIONS,
+           "s1_inversions": s1_inversions, "s2_inversions": s2_inversions,
+           "s1_inversions_per_rank": s1_inversions_per_rank.tolist(), "s2_inversions_per_rank": s2_inversions_per_rank.tolist()}
+
+    if cfg.get("warm_start"):
+        hp = HPPIFO(num_s1_qs, num_s2_qs, max_rank)
+        steady_packets = warm_run(hp, cfg["warm_start"], inpf, iter_ranks(inpf, chunk) if chunk else [ranks])
+        rec.update({"warm_start": canonical(cfg["warm_start"]), "steady_packets": steady_packets,
+                    "steady_s1_inversions": hp.s1.inversions, "steady_s2_inversions": hp.s2.inversions,
+                    "steady_s1_inversions_per_rank": hp.s1.inversions_per_rank, "steady_s2_inversions_per_rank": hp.s2.inversions_per_rank})
+
+    if windows:
+        s1, s2 = windows
+        rec["window"] = cfg["window"]
+        rec.update({"s1_" + field: value for field, value in s1.fields().items()})
+        rec.update({"s2_" + field: value for field, value in s2.fields().items()})
+
+    if cfg["rates"]:
+        enq_rate, deq_rate = cfg["rates"]
+        s1_qids, s2_qids = [], []
+        hp = HPPIFO(num_s1_qs, num_s2_qs, max_rank)
+        hp.push(ranks, s1_qids=s1_qids, s2_qids=s2_qids)
+        qids = hp.global_qids([s1_qids, s2_qids])
+        rec.update({"enq_rate": enq_rate, "deq_rate": deq_rate})
+        deq_recorder = recorder.dequeue(num_s1_qs + num_s2_qs - 1) if recorder else None
+        rec.update(summarize(simulate(ranks, qids, num_s1_qs + num_s2_qs - 1, max_rank, enq_rate, deq_rate, recorder=deq_recorder)))
+    if cfg.get("replay"):
+        s1_qids, s2_qids = [], []
+        hp = HPPIFO(num_s1_qs, num_s2_qs, max_rank)
+        hp.push(ranks, s1_qids=s1_qids, s2_qids=s2_qids)
+        qids = hp.global_qids([s1_qids, s2_qids])
+        num_qs = num_s1_qs + num_s2_qs - 1
+        rec.update(summarize_replay(replay(cfg["replay"], ids, ranks, qids, num_qs), ranks, qids, num_qs, max_rank))
+    if recorder:
+        recorder.flush(cfg["instrument"][1])
+    return rec
+
+def run_hier_config(cfg):
+    """
+        Batch engine worker for an N-stage hierarchy: trace, stage_qs (q count per stage),
+        feeds (per stage, the qs feeding the next stage, None for the highest priority q), chunk, rates.
+        Record has per stage lists: inversions, inversions_per_rank, packets, enqueued (packets put in each q),
+        and window_* with a window spec. A replay spec adds the replay_* fields, as in run_config().
+    """
+    inpf, stage_qs, feeds, chunk = cfg["trace"], cfg["stage_qs"], cfg["feeds"], cfg["chunk"]
+    if chunk:
+        max_packets, max_rank = read_header(inpf)
+        chunks = lambda: iter_ranks(inpf, chunk)
+        id_chunks = lambda: iter_chunks(inpf, chunk)
+    else:
+        ids, ranks, max_rank = cached_trace(inpf)
+        max_packets = len(ranks)
+        chunks = lambda: [ranks]
+        id_chunks = lambda: [(ids, ranks)]
+
+    recorder = Recorder(cfg["instrument"][0]) if cfg.get("instrument") else None
+    stage_windows = make_windows(cfg["window"], len(stage_qs)) if cfg.get("window") else None
+    inversions = [0 for _ in stage_qs]
+    for it in range(ITERATIONS):
+        """Time windows need the ids too"""
+        windows = stage_windows if it == 0 else None
+        stage_inv, inversions_per_rank, packets, enqueued = hier_stream(id_chunks() if windows else chunks(), stage_qs, max_rank, feeds,
+                                                                         recorder if it == 0 else None, windows)
+        inversions = [total + inv for total, inv in zip(inversions, stage_inv)]
+
+    hier = HierPIFO(stage_qs, max_rank, feeds)
+    rec = {"engine": "hier", "trace": inpf, "stage_qs": list(stage_qs), "feeds": hier.feeds,
+           "stages": "/".join(map(str, stage_qs)), "feed_qs": "/".join(" ".join(map(str, feed)) for feed in hier.feeds),
+           "max_rank": max_rank, "max_packets": max_packets, "iterations": ITERATIONS,
+           "inversions": inversions, "inversions_per_rank": inversions_per_rank, "packets": packets, "enqueued": enqueued}
+
+    if cfg.get("warm_start"):
+        warm = HierPIFO(stage_qs, max_rank, feeds)
+        steady_packets = warm_run(warm, cfg["warm_start"], inpf, chunks())
+        rec.update({"warm_start": canonical(cfg["warm_start"]), "steady_packets": steady_packets,
+                    "steady_inversions": [stage.inversions for stage in warm.stages],
+                    "steady_inversions_per_rank": [stage.inversions_per_rank for stage in warm.stages],
+                    "steady_stage_packets": [stage.packets for stage in warm.stages], "steady_enqueued": warm.enqueued})
+
+    if stage_windows:
+        rec["window"] = cfg["window"]
+        for field in stage_windows[0].fields():
+            rec[field] = [windows.fields()[field] for windows in stage_windows]
+
+    if cfg["rates"] or cfg.get("replay"):
+        """One pass for the q every packet finally waits in, shared by the dequeue model and the replay"""
+        qids = [[] for _ in stage_qs]
+        hier.push(ranks, qids=qids)
+        gqids = hier.global_qids(qids)
+        num_qs = len(hier.service_order())
+    if cfg["rates"]:
+        enq_rate, deq_rate = cfg["rates"]
+        rec.update({"enq_rate": enq_rate, "deq_rate": deq_rate})
+        deq_recorder = recorder.dequeue(num_qs) if recorder else None
+        rec.update(summarize(simulate(ranks, gqids, num_qs, max_rank, enq_rate, deq_rate, recorder=deq_recorder)))
+    if cfg.get("replay"):
+        rec.update(summarize_replay(replay(cfg["replay"], ids, ranks, gqids, num_qs), ranks, gqids, num_qs, max_rank))
+    if recorder:
+        recorder.flush(cfg["instrument"][1])
+    return rec
+
+def parse_feeds(spec):
+    """ "0 1/0" -> [[0, 1], [0]]: per stage, the qs feeding the next stage. Raises ValueError """
+    try:
+        return [[int(q) for q in stage.replace(",", " ").split()] for stage in spec.split("/")]
+    except ValueError:
+        raise ValueError(f"Bad feeds {spec!r}: q numbers per stage, stages separated by /, e.g. \"0 1/0\"") from None
+
 if __name__ == "__main__":
     random.seed(0)
     np.random.seed(0)
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("-i", help="Input packet file", type=str)
+    parser.add_argument("-i", help="Input packet file (text or binary trace), or a directory/glob of traces (batch mode, one long-format table)", type=str)
     parser.add_argument("-o", help="Ouput file (CSV)", type=str)
+    parser.add_argument("-m", help="Engine mode: batch (in-process), mp (hardware-like, one process per stage) or shm (mp over shared memory rings)", type=str, default="batch")
+    parser.add_argument("-w", help="Worker processes for the batch sweep (default: one per CPU)", type=int, default=None)
+    parser.add_argument("-c", help="Stream the trace in chunks of this many packets instead of loading it whole (batch mode)", type=int, default=None)
+    parser.add_argument("-r", help="enq_rate,deq_rate in packets per tick: also replay through the dequeue model (scheduler.py)", type=str, default=None)
+    parser.add_argument("-k", help="Result cache (SQLite file) for batch mode: reuse cells computed before, store new ones", type=str, default=None)
+    parser.add_argument("-s", help="Per-stage q counts of an N-stage hierarchy, e.g. 8,4,2 (batch mode). Repeat to sweep several", type=str, action="append", default=None)
+    parser.add_argument("-f", help="With -s: per stage, the qs feeding the next one, stages separated by /, e.g. \"0 1/0\" (default: q 0 of every stage)", type=str, default=None)
+    parser.add_argument("-x", help="Instrument batch runs into <out>_instr_*.npz: bounds and cumulative packets per q every this many packets, with -r also the per-q backlog (occupancy) every this many ticks", type=int, default=None)
+    parser.add_argument("-ws", help="Warm start (batch mode): hist, hist:<file> or prefix:N seed, settle:N, warmup:N, comma separated (see warmstart.py). Steady-state inversions go to <out>_steady.csv", type=str, default=None)
+    parser.add_argument("-tw", help="Inversions per window (batch mode): N packets, or trace time as 0.5s, 20ms, 100us (see windows.py). Goes to <out>_windows.csv", type=str, default=None)
+    parser.add_argument("-rp", help="Time-driven replay (batch mode, no -c): link:R pkts/s, buffer:N per q, poisson:R or uniform:R arrivals (default: trace stamps), seed:N, comma separated (see replay.py). Drops and delays go to <out>_replay.csv", type=str, default=None)
 
     args = parser.parse_args()
 
+    if args.m not in ("batch", "mp", "shm"):
+        print(f"Unknown mode {args.m}")
+        exit(1)
+
+    if args.x is not None and (args.m != "batch" or args.x < 1):
+        print("-x takes a positive sample period and needs batch mode")
+        exit(1)
+    if args.ws is not None:
+        try:
+            parse_warm_start(args.ws)
+        except ValueError as e:
+            print(e)
+            exit(1)
+        if args.m != "batch":
+            print("-ws needs batch mode")
+            exit(1)
+    if args.tw is not None:
+        try:
+            parse_window(args.tw)
+        except ValueError as e:
+            print(e)
+            exit(1)
+        if args.m != "batch":
+            print("-tw needs batch mode")
+            exit(1)
+    if args.rp is not None:
+        try:
+            parse_replay(args.rp)
+        except ValueError as e:
+            print(e)
+            exit(1)
+        if args.m != "batch" or args.c:
+            print("-rp needs batch mode without -c")
+            exit(1)
+    """Instrumented runs are always computed, a cached cell has no samples"""
+    cache = ResultCache(args.k, iterations=ITERATIONS) if args.k and not args.x else None
+
+    rates = None
+    if args.r:
+        try:
+            rates = tuple(map(float, args.r.split(",")))
+        except ValueError:
+            print(f"Bad -r {args.r}: enq_rate,deq_rate are numbers of packets per tick")
+            exit(1)
+        if args.m != "batch" or args.c or len(rates) != 2 or min(rates) <= 0:
+            print("-r takes positive enq_rate,deq_rate and needs batch mode without -c")
+            exit(1)
+
+    traces = expand_traces(args.i)
+    if not traces:
+        print(f"No traces found at {args.i}")
+        exit(1)
+    multi = traces != [args.i]
+    if args.ws and parse_warm_start(args.ws)["hist"]:
+        """Check the histogram file against every trace before starting the workers"""
+        try:
+            for inpf in traces:
+                file_histogram(parse_warm_start(args.ws), inpf)
+        except (OSError, ValueError) as e:
+            print(e)
+            exit(1)
+    if (args.s or multi) and args.m != "batch":
+        print("-s and a directory or glob of traces need batch mode")
+        exit(1)
+
+    if args.m == "batch":
+        if args.s:
+            try:
+                stage_qs_list = [[int(n) for n in spec.split(",")] for spec in args.s]
+                feeds = parse_feeds(args.f) if args.f else None
+                for stage_qs in stage_qs_list:
+                    HierPIFO(stage_qs, 1, feeds)        # Check the hierarchy before starting the workers
+            except ValueError as e:
+                print(e)
+                exit(1)
+        if not args.c:
+            """Parse every trace once in the parent, forked workers inherit them"""
+            for inpf in traces:
+                cached_trace(inpf)
+        configs = []
+        for inpf in traces:
+            if rates:
+                """Ideal PIFO reference first, it runs alongside the HP-PIFO configurations"""
+                configs.append({"engine": "pifo", "trace": inpf, "rates": rates})
+            if args.s:
+                configs.extend({"engine": "hier", "trace": inpf, "stage_qs": stage_qs, "feeds": feeds, "chunk": args.c, "rates": rates}
+                               for stage_qs in stage_qs_list)
+            else:
+                configs.extend({"engine": "hppifo", "trace": inpf, "num_s1_qs": num_s1_qs, "num_s2_qs": num_s2_qs, "chunk": args.c, "rates": rates}
+                               for num_s1_qs in NUM_OF_S1_QUEUES for num_s2_qs in NUM_OF_S2_QUEUES)
+        if args.ws:
+            for cfg in configs:
+                if cfg["engine"] != "pifo":
+                    cfg["warm_start"] = args.ws
+        if args.tw:
+            for cfg in configs:
+                if cfg["engine"] != "pifo":
+                    cfg["window"] = args.tw
+        if args.rp:
+            for cfg in configs:
+                if cfg["engine"] != "pifo":
+                    cfg["replay"] = args.rp
+        if args.x:
+            for cfg in configs:
+                if cfg["engine"] == "hier":
+                    label = "_".join(map(str, cfg["stage_qs"]))
+                elif cfg["engine"] == "hppifo":
+                    label = f"{cfg['num_s1_qs']}_{cfg['num_s2_qs']}"
+                else:
+                    continue
+                cfg["instrument"] = (args.x, instrument_path(args.o, cfg["trace"] if multi else None, label))
+        """One pool for all traces, workers stay warm from one trace to the next"""
+        records = run_sweep(run_config, configs, args.w, cache)
+        if cache:
+            print(cache)
+        pifo = {rec["trace"]: rec for rec in records if rec["engine"] == "pifo"}
+        records = [rec for rec in records if rec["engine"] != "pifo"]
+
+        write_columnar(str(args.o[:-4]) + "_results.npz", {"hier" if args.s else "hppifo": records, "pifo": list(pifo.values())})
+        if args.ws and args.s:
+            write_hier_steady_csv(str(args.o[:-4]) + "_steady.csv", records)
+        elif args.ws:
+            write_steady_csv(str(args.o[:-4]) + "_steady.csv", records, [("Num S1 Qs", "num_s1_qs"), ("Num S2 Qs", "num_s2_qs")],
+                             [("S1 ", "s1_inversions"), ("S2 ", "s2_inversions")])
+        if args.tw and args.s:
+            write_hier_windows_csv(str(args.o[:-4]) + "_windows.csv", records)
+        elif args.tw:
+            write_windows_csv(str(args.o[:-4]) + "_windows.csv", records, [("Num S1 Qs", "num_s1_qs"), ("Num S2 Qs", "num_s2_qs")],
+                              [(1, "s1_"), (2, "s2_")])
+        if args.rp:
+            write_replay_csv(str(args.o[:-4]) + "_replay.csv", records,
+                             [("Stage Qs", "stages"), ("Feeds", "feed_qs")] if args.s else [("Num S1 Qs", "num_s1_qs"), ("Num S2 Qs", "num_s2_qs")])
+        if multi:
+            (write_hier_long_csv if args.s else write_hp_long_csv)(args.o, records, pifo)
+        elif args.s:
+            write_hier_csv(args.o, records)
+            if rates:
+                write_hier_dequeue_csv(str(args.o[:-4]) + "_dequeue.csv", records, pifo[args.i])
+                write_delay_per_rank(str(args.o[:-4]) + "_delay_per_rank.csv", records, pifo[args.i], ["stages", "feed_qs"])
+        else:
+            write_hp_csv(args.o, records)
+            if rates:
+                write_hp_dequeue_csv(str(args.o[:-4]) + "_dequeue.csv", records, pifo[args.i])
+                write_delay_per_rank(str(args.o[:-4]) + "_delay_per_rank.csv", records, pifo[args.i], ["num_s1_qs", "num_s2_qs"])
+        exit(0)
+
     s1_avg_inv = mp.Value("i", 0)
     s2_avg_inv = mp.Value("i", 0)
 
     with open(args.o, 'w') as f:
         f.write("Num S1 Qs, Num S2 Qs, Max Rank, S1 Norm. Mean Inversions, S2 Norm. Mean Inversions\n")
 
-    with open(args.i, 'r') as f:
-        max_packets, max_rank = map(int, f.readline().strip().split(","))
+    max_packets, max_rank = read_header(args.i)
 
     for num_s1_qs in NUM_OF_S1_QUEUES: 
         for num_s2_qs in NUM_OF_S2_QUEUES:
@@ -193,15 +481,34 @@ if __name__ == "__main__":
             s2_avg_inv_per_rank = mp.Array("i", max_rank)
 
             for _ in range(ITERATIONS):
+                if args.m == "shm":
+                    """Stage 2 reads the highest priority s1 ring, the consumer serves s2 rings then s1[1:]"""
+                    inp_ring = ShmRing()
+                    s1_rings = [ShmRing() for _ in range(num_s1_qs)]
+                    s2_rings = [ShmRing() for _ in range(num_s2_qs)]
+                    procs = [mp.Process(target=shm_ring.generate_packet, args=(args.i, inp_ring)),
+                             mp.Process(target=shm_ring.sppifo_stage, args=(inp_ring, s1_rings, max_rank, s1_avg_inv, s1_avg_inv_per_rank)),
+                             mp.Process(target=shm_ring.sppifo_stage, args=(s1_rings[0], s2_rings, max_rank, s2_avg_inv, s2_avg_inv_per_rank)),
+                             mp.Process(target=shm_ring.consume_packet, args=(s2_rings + s1_rings[1:], ))]
+                    for proc in procs:
+                        proc.start()
+                    for proc in procs:
+                        proc.join()
+                    for ring in [inp_ring] + s1_rings + s2_rings:
+                        ring.release()
+                    continue
+
                 inp_q = mp.Queue(maxsize=1)
 
-                s1_qs = [mp.Queue() for _ in range(num_s1_qs)]
-                s2_qs = [mp.Queue() for _ in range(num_s2_qs)]
+                """One group for both stages so the consumer can sleep on all of its qs at once"""
+                qs = PriorityQueues(num_s2_qs + num_s1_qs)
+                s2_qs = qs.lanes(0, num_s2_qs)
+                s1_qs = qs.lanes(num_s2_qs, num_s1_qs)
 
                 packet_generator = mp.Process(target=generate_packet, args=(args.i, inp_q))
                 s1_sppifo_proc = mp.Process(target=stage1_sppifo, args=(inp_q, s1_qs, s2_qs, s1_avg_inv, s1_avg_inv_per_rank))
                 s2_sppifo_proc = mp.Process(target=stage2_sppifo, args=(s1_qs, s2_qs, s2_avg_inv, s2_avg_inv_per_rank))
-                packet_consumer = mp.Process(target=consume_packet, args=(s1_qs, s2_qs))
+                packet_consumer = mp.Process(target=consume_packet, args=(qs, num_s1_qs, num_s2_qs))
 
                 packet_generator.start()
                 s1_sppifo_proc.start()
@@ -229,7 +536,7 @@ if __name__ == "__main__":
                 #     q.close()
             with open(args.o, 'a') as f:
                 # TODO: In s2, normalize by total no. of packets or only the packets that were in the s2?
-                f.write(f"{num_s1_qs}, {num_s2_qs}, {max_rank}, {((s1_avg_inv.value/ITERATIONS)/max_packets):.3f}, {((s2_avg_inv.value/ITERATIONS)/max_packets):.3f}\n")
+                f.write(f"{num_s1_qs}, {num_s2_qs}, {max_rank}, {normalized(s1_avg_inv.value, max_packets, ITERATIONS):.3f}, {normalized(s2_avg_inv.value, max_packets, ITERATIONS):.3f}\n")
 
             # TODO: How to calculate avg inversion per rank. Would there be inversions in stage 1? Yes, but for highest priority q
             # But do they matter? You want to check the inversions when packets go out.
@@ -0,0 +1,108 @@
+# Opt-in instrumentation for the in-process engines and the dequeue model.
+# A Recorder hands out one StageRecorder per SP-PIFO stage (engine.SPPIFO.recorder) and one DequeueRecorder
+# for scheduler.simulate(). They only write into arrays allocated up front, and flush() saves everything
+# to one .npz at the end, readable with results.read_columnar() ("<stage>.<field>" arrays).
+# Engines without a recorder take exactly the same code path as before.
+#
+# Per stage:
+#   bounds       (samples, num_qs) bound of every q (column q is q's bound, q 0 highest priority) ...
+#   q_cumulative (samples, num_qs) ... and packets put in every q so far (cumulative: the engines never dequeue,
+#                so this is not an occupancy; the per-q occupancy is the dequeue model's backlog, with -r) ...
+#   packet       (samples, ) ... after this many packets, every `every` packets
+#   enqueued, forwarded, served, inversions, time_s   totals: packets in, sent on to the next stage,
+#                                                     left to be served from this stage, inversions, seconds in push()
+# Dequeue model:
+#   backlog      (samples, num_qs) packets waiting in every q, every `every` ticks
+#   tick         (samples, )
+
+import os
+
+import numpy as np
+
+EVERY = 4096                                    # Default sample period (packets or ticks)
+CAPACITY = 4096                                 # Default samples kept; later ones are counted but dropped
+
+class StageRecorder:
+    """Samples and counters of one SP-PIFO stage"""
+    def __init__(self, name, num_qs, every=EVERY, capacity=CAPACITY) -> None:
+        self.name = name
+        self.every = every
+        self.bounds = np.zeros((capacity, num_qs), dtype=np.int64)
+        self.q_cumulative = np.zeros((capacity, num_qs), dtype=np.int64)
+        self.packet = np.zeros(capacity, dtype=np.int64)
+        self.q_counts = np.zeros(num_qs, dtype=np.int64)   # Running per-q packet counts
+        self.samples = 0                                    # Samples taken, may exceed capacity
+        self.enqueued = 0
+        self.forwarded = 0
+        self.inversions = 0
+        self.time_s = 0.0
+
+    def __repr__(self) -> str:
+        return(f"StageRecorder: {self.name}, {self.enqueued} pkts, {self.samples} samples, {self.time_s:.3f}s")
+
+    def arrays(self):
+        kept = min(self.samples, len(self.packet))
+        return {"bounds": self.bounds[:kept, ::-1],        # SPPIFO.bounds order is lowest priority q first
+                "q_cumulative": self.q_cumulative[:kept],
+                "packet": self.packet[:kept],
+                "enqueued": np.array(self.enqueued),
+                "forwarded": np.array(self.forwarded),
+                "served": np.array(self.enqueued - self.forwarded),
+                "inversions": np.array(self.inversions),
+                "time_s": np.array(self.time_s)}
+
+class DequeueRecorder:
+    """Per-q backlog of scheduler.simulate(), sampled every `every` ticks (the compiled loop fills the arrays)"""
+    def __init__(self, name, num_qs, every=EVERY, capacity=CAPACITY) -> None:
+        self.name = name
+        self.every = every
+        self.backlog = np.zeros((capacity, num_qs), dtype=np.int64)
+        self.tick = np.zeros(capacity, dtype=np.int64)
+        self.samples = 0
+
+    def __repr__(self) -> str:
+        return(f"DequeueRecorder: {self.name}, {self.samples} samples")
+
+    def arrays(self):
+        kept = min(self.samples, len(self.tick))
+        return {"backlog": self.backlog[:kept], "tick": self.tick[:kept]}
+
+class Recorder:
+    """Collects the stage and dequeue recorders of one run and writes them out together"""
+    def __init__(self, every=EVERY, capacity=CAPACITY) -> None:
+        if every < 1 or capacity < 1:
+            raise ValueError("every and capacity must be positive")
+        self.every = every
+        self.capacity = capacity
+        self.parts = []
+
+    def __repr__(self) -> str:
+        return(f"Recorder: every {self.every}, " + ", ".join(part.name for part in self.parts))
+
+    def stage(self, name, num_qs):
+        """New StageRecorder, to set as SPPIFO.recorder"""
+        part = StageRecorder(name, num_qs, self.every, self.capacity)
+        self.parts.append(part)
+        return part
+
+    def dequeue(self, num_qs, name="dequeue"):
+        """New DequeueRecorder, to pass to scheduler.simulate()"""
+        part = DequeueRecorder(name, num_qs, self.every, self.capacity)
+        self.parts.append(part)
+        return part
+
+    def flush(self, outf):
+        """Save every part as "<name>.<field>" arrays in one compressed .npz"""
+        arrays = {"every": np.array(self.every)}
+        for part in self.parts:
+            for field, value in part.arrays().items():
+                arrays[f"{part.name}.{field}"] = value
+        np.savez_compressed(outf, **arrays)
+
+def instrument_path(outf, trace, label):
+    """
+        <outf minus .csv>_instr[_<trace file name>]_<label>.npz, trace only needed when a sweep covers several traces.
+        The whole file name is kept: a.txt, a.bin and a.txt.gz in one sweep get separate files.
+    """
+    name = "" if trace is None else "_" + os.path.basename(trace)
+    return f"{outf[:-4]}_instr{name}_{label}.npz"
@@ -0,0 +1,66 @@
+# Multi-seed Monte Carlo replication for the synthetic-rank sweeps.
+# Every replica draws its ranks from its own generator, spawned from one root seed with numpy's SeedSequence,
+# so replicas are independent and the whole run is reproducible. Replica r gets the same seed in every cell
+# (common random numbers), which makes the differences between cells less noisy than the cells themselves.
+# Replicas run in rounds: every cell still short of its confidence target gets one more batch of replicas,
+# the batches of all cells running in parallel on the sweep pool (sweep.run_sweep()), one batch per task.
+
+from statistics import NormalDist
+
+import numpy as np
+
+from sweep import run_sweep
+
+def replica_seeds(seed, replicas):
+    """One independent SeedSequence per replica, to build np.random.default_rng(seeds[r]) from"""
+    return np.random.SeedSequence(seed).spawn(replicas)
+
+def t_quantile(p, dof):
+    """Student t quantile, Cornish-Fisher expansion around the normal one (error below 1e-3 from 4 degrees of freedom)"""
+    z = NormalDist().inv_cdf(p)
+    v = dof
+    return (z + (z**3 + z)/(4*v) + (5*z**5 + 16*z**3 + 3*z)/(96*v**2)
+            + (3*z**7 + 19*z**5 + 17*z**3 - 15*z)/(384*v**3)
+            + (79*z**9 + 776*z**7 + 1482*z**5 - 1920*z**3 - 945*z)/(92160*v**4))
+
+def confidence_interval(values, level=0.95):
+    """(mean, sample std, CI half width) of per-replica values; std and half width are nan below 2 replicas"""
+    values = np.asarray(values, dtype=np.float64)
+    mean = float(values.mean())
+    if len(values) < 2:
+        return mean, float("nan"), float("nan")
+    std = float(values.std(ddof=1))
+    return mean, std, t_quantile(0.5 + level/2, len(values) - 1)*std/np.sqrt(len(values))
+
+def run_replicas(run_batch, cells, metric, seed=0, batch=8, min_replicas=8, max_replicas=128,
+                 ci_width=None, level=0.95, workers=None):
+    """
+        Replicate every cell until the CI of metric is narrow enough.
+        run_batch((cell, seeds)) must be a module level function returning one record per seed.
+        A cell stops once it has min_replicas and the full width of its level CI of rec[metric] is at most
+        ci_width, or at max_replicas (ci_width None: always max_replicas).
+        Returns {cell: list of replica records, in replica order}.
+    """
+    seeds = replica_seeds(seed, max_replicas)
+    replicas = {cell: [] for cell in cells}
+    active = list(cells)
+    while active:
+        tasks = []
+        for cell in active:
+            done = len(replicas[cell])
+            tasks.append((cell, seeds[done:min(done + batch, max_replicas)]))
+        for (cell, _), recs in zip(tasks, run_sweep(run_batch, tasks, workers)):
+            replicas[cell].extend(recs)
+
+        still = []
+        for cell in active:
+            n = len(replicas[cell])
+            if n >= max_replicas:
+                continue
+            if ci_width is not None and n >= min_replicas:
+                _, _, half = confidence_interval([rec[metric] for rec in replicas[cell]], level)
+                if 2*half <= ci_width:
+                    continue
+            still.append(cell)
+        active = still
+    return replicas
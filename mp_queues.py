@@ -0,0 +1,68 @@
+# Strict priority output queues for the multiprocess (hardware-like) mode.
+# Every q is still an mp.Queue, but a shared per-q packet count guarded by an mp.Condition tells the
+# consumer which qs hold packets. The consumer sleeps on the condition while all of its qs are empty
+# instead of polling q.empty(), which also avoids trusting empty() while a feeder thread is still flushing.
+# Also holds the trace reader that feeds the pipelines' input q.
+
+import multiprocessing as mp
+
+from packet import Packet, END_OF_STREAM
+from trace_io import iter_trace
+
+def generate_packet(inpf, inp_q):
+    """Read packets from file (any trace_io format) and put in input q, then END_OF_STREAM"""
+    for id, rank in iter_trace(inpf):
+        pkt = Packet(rank=rank, id=id)
+        inp_q.put(pkt, block=True)
+
+    inp_q.put(END_OF_STREAM, block=True)
+    print("Sent last packet")
+
+class PriorityQueues:
+    """A group of qs sharing one condition. Lower index is higher priority when several qs are served together."""
+    def __init__(self, num_qs) -> None:
+        self.qs = [mp.Queue() for _ in range(num_qs)]
+        self.counts = mp.Array("i", num_qs, lock=False)       # Guarded by cond
+        self.cond = mp.Condition()
+
+    def __len__(self) -> int:
+        return len(self.qs)
+
+    def put(self, i, pkt):
+        """Put pkt in q i and wake up whoever waits on it"""
+        self.qs[i].put(pkt)
+        with self.cond:
+            self.counts[i] += 1
+            self.cond.notify_all()                  # Waiters may watch different qs
+
+    def get(self, order):
+        """
+            Block until one of the qs in order has a packet, then take it from the first such q.
+            The count is only raised after put(), so the blocking get on the chosen q always has a packet coming.
+        """
+        counts = self.counts
+        with self.cond:
+            self.cond.wait_for(lambda: any(counts[i] for i in order))
+            for i in order:
+                if counts[i]:
+                    counts[i] -= 1
+                    break
+        return self.qs[i].get()
+
+    def lanes(self, start=0, num_qs=None):
+        """Per-q handles with the put()/get() calls of an mp.Queue, for code that indexes a list of qs"""
+        if num_qs is None:
+            num_qs = len(self.qs) - start
+        return [Lane(self, i) for i in range(start, start + num_qs)]
+
+class Lane:
+    """One q of a PriorityQueues group"""
+    def __init__(self, group, i) -> None:
+        self.group = group
+        self.i = i
+
+    def put(self, pkt, block=True):
+        self.group.put(self.i, pkt)
+
+    def get(self):
+        return self.group.get([self.i])
@@ -0,0 +1,37 @@
+# Packet representation shared by every simulator.
+#   Packet        one packet as an object, for the packet-at-a-time (mp) pipelines
+#   PACKET_DTYPE  the same fields as a NumPy structured dtype, for bulk paths (shm rings, batch loaders)
+# Control signals travel through the same qs as packets but are separate objects, so no pktid value is reserved.
+
+import numpy as np
+
+PACKET_DTYPE = np.dtype([("rank", "<i8"), ("id", "<f8")])
+
+class Packet:
+    __slots__ = ("rank", "pktid")
+
+    def __init__(self, rank, id) -> None:
+        self.rank = rank
+        self.pktid = id                         # Unix time in seconds
+
+    def __repr__(self) -> str:
+        return(f"Rank: {self.rank}, ID: {self.pktid}")
+
+class Signal:
+    """
+        Out-of-band control message. Each one is a module level singleton and pickles by name,
+        so it is still the same object after going through an mp.Queue and can be tested with `is`.
+    """
+    __slots__ = ("name",)
+
+    def __init__(self, name) -> None:
+        self.name = name
+
+    def __repr__(self) -> str:
+        return(f"Signal: {self.name}")
+
+    def __reduce__(self):
+        return self.name
+
+END_OF_STREAM = Signal("END_OF_STREAM")         # No more packets
+STAGE_HANDOFF = Signal("STAGE_HANDOFF")         # Upstream stage finished, downstream stage may stop
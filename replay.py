@@ -0,0 +1,179 @@
+# Time-driven replay of the SP-PIFO/HP-PIFO qs.
+# scheduler.simulate() runs on an abstract tick clock with unbounded qs. This replays the same q assignment
+# in continuous time: packets arrive at their trace stamps (the time.time() ids) or from a synthetic process,
+# a link serves them at a fixed packet rate from the highest priority non-empty q (non-preemptive), and a
+# packet arriving at a full q is tail-dropped. The q of every packet is decided by the engine beforehand,
+# dropped packets included (bounds move on every arrival, as in the engines).
+# Event-driven and compiled (Numba if available): one pass over the arrivals, O(1) work per packet.
+# Spec items, comma separated:
+#   link:R          service rate, packets per second (required)
+#   buffer:N        capacity of every q in packets, not counting the one being sent (default: unlimited)
+#   poisson:R       Poisson arrivals at R packets per second instead of the trace stamps
+#   uniform:R       evenly spaced arrivals at R packets per second instead of the trace stamps
+#   seed:N          seed of the poisson arrivals (default 0)
+# e.g. "link:1e6,buffer:64" or "link:1e6,buffer:64,poisson:9e5"
+# Traces whose ids are packet numbers rather than stamps (e.g. some converted traces) need a synthetic process.
+
+import numpy as np
+
+from engine import HAVE_NUMBA
+from warmstart import canonical
+
+if HAVE_NUMBA:
+    from numba import njit
+
+VERSION = 1
+PERCENTILES = (50, 90, 99, 99.9)
+WORD_BITS = 32                                  # Non-empty q bitmap word size (int64 words, kept clear of the sign bit)
+
+def parse_replay(spec):
+    """Spec string -> {"link": R, "buffer": N or 0, "arrivals": "trace", "poisson" or "uniform", "rate": R, "seed": N}"""
+    rp = {"link": 0.0, "buffer": 0, "arrivals": "trace", "rate": 0.0, "seed": 0}
+    for item in spec.replace(",", " ").split():
+        name, _, value = item.partition(":")
+        if name not in ("link", "buffer", "poisson", "uniform", "seed"):
+            raise ValueError(f"Replay {spec}: unknown item {item}, expected link:R, buffer:N, poisson:R, uniform:R or seed:N")
+        try:
+            number = int(value) if name in ("buffer", "seed") else float(value)
+        except ValueError:
+            raise ValueError(f"Replay {spec}: {name} needs a number") from None
+        if name in ("poisson", "uniform"):
+            if rp["arrivals"] != "trace":
+                raise ValueError(f"Replay {spec}: only one of poisson and uniform")
+            rp["arrivals"], rp["rate"] = name, number
+        else:
+            rp[name] = number
+        if number <= 0 and name != "seed":
+            raise ValueError(f"Replay {spec}: {name} must be positive")
+    if not rp["link"]:
+        raise ValueError(f"Replay {spec}: link:R is required")
+    return rp
+
+def arrival_times(rp, ids):
+    """Arrival time of every packet in seconds from the earliest one, in trace order"""
+    n = len(ids)
+    if rp["arrivals"] == "poisson":
+        gaps = np.random.default_rng(rp["seed"]).exponential(1/rp["rate"], n)
+        gaps[:1] = 0
+        return np.cumsum(gaps)
+    if rp["arrivals"] == "uniform":
+        return np.arange(n, dtype=np.float64)/rp["rate"]
+    ids = np.asarray(ids, dtype=np.float64)
+    return ids - ids.min() if n else ids.copy()
+
+def _serve(heads, tails, lengths, words, nxt, starts, free_at, service):
+    """Start sending the head of the highest priority non-empty q at free_at. Returns when the link is free again"""
+    w = 0
+    while words[w] == 0:
+        w += 1
+    low = words[w] & -words[w]
+    bit = 0
+    while low > 1:
+        low >>= 1
+        bit += 1
+    q = w*WORD_BITS + bit
+    pkt = heads[q]
+    heads[q] = nxt[pkt]
+    lengths[q] -= 1
+    if lengths[q] == 0:
+        tails[q] = -1
+        words[w] &= ~(1 << bit)
+    starts[pkt] = free_at
+    return free_at + service
+
+def _replay_loop(arrivals, order, qids, num_qs, service, capacity, starts):
+    """
+        Replay packets order[0], order[1], ... (arrival order) into their q. starts gets the time every packet
+        started being sent, -1 for dropped ones. capacity 0 is unlimited. Returns the number of drops.
+    """
+    heads = np.full(num_qs, -1, dtype=np.int64)
+    tails = np.full(num_qs, -1, dtype=np.int64)
+    lengths = np.zeros(num_qs, dtype=np.int64)
+    words = np.zeros((num_qs + WORD_BITS - 1)//WORD_BITS + 1, dtype=np.int64)   # Spare last word stops the scan
+    words[-1] = 1
+    nxt = np.full(len(arrivals), -1, dtype=np.int64)    # Next packet in the same q, one linked list per q
+    free_at = -np.inf                               # Link idle until the first arrival
+    backlog = 0
+    drops = 0
+    for i in range(len(order)):
+        pkt = order[i]
+        t = arrivals[pkt]
+        while backlog > 0 and free_at <= t:
+            free_at = _serve(heads, tails, lengths, words, nxt, starts, free_at, service)
+            backlog -= 1
+        if backlog == 0 and free_at < t:
+            free_at = t                             # Idle link
+        q = qids[pkt]
+        if capacity and lengths[q] >= capacity:
+            starts[pkt] = -1.0
+            drops += 1
+            continue
+        if tails[q] < 0:
+            heads[q] = pkt
+            words[q//WORD_BITS] |= 1 << (q % WORD_BITS)
+        else:
+            nxt[tails[q]] = pkt
+        tails[q] = pkt
+        lengths[q] += 1
+        backlog += 1
+    while backlog > 0:
+        free_at = _serve(heads, tails, lengths, words, nxt, starts, free_at, service)
+        backlog -= 1
+    return drops
+
+if HAVE_NUMBA:
+    _serve = njit(cache=True, nogil=True)(_serve)
+    _replay_loop = njit(cache=True, nogil=True)(_replay_loop)
+
+def replay(spec, ids, ranks, qids, num_qs):
+    """
+        Replay a trace (ids, ranks) through num_qs strict priority qs (q 0 highest priority) under the parse_replay() spec.
+        qids is the q of every packet, e.g. the qids of engine.sppifo_kernel() or HierPIFO.global_qids().
+        Returns a dict with:
+            arrival     arrival time of every packet (seconds, trace order)
+            start       time it started being sent, nan if dropped
+            dropped     bool mask of dropped packets
+            service     seconds to send one packet
+            spec        canonical() spec
+    """
+    rp = parse_replay(spec)
+    arrivals = arrival_times(rp, ids)
+    qids = np.asarray(qids, dtype=np.int64)
+    if len(qids) and (qids.min() < 0 or qids.max() >= num_qs):
+        raise ValueError(f"qids out of range for {num_qs} qs")
+    """Stamps can step back (clock adjustments), serve in time order; ties keep trace order"""
+    order = np.arange(len(arrivals)) if np.all(arrivals[1:] >= arrivals[:-1]) else np.argsort(arrivals, kind='stable')
+    starts = np.empty(len(arrivals), dtype=np.float64)
+    _replay_loop(arrivals, order, qids, num_qs, 1/rp["link"], rp["buffer"], starts)
+    dropped = starts < 0
+    starts[dropped] = np.nan
+    return {"arrival": arrivals, "start": starts, "dropped": dropped, "service": 1/rp["link"], "spec": canonical(spec)}
+
+def summarize_replay(out, ranks, qids, num_qs, max_rank):
+    """
+        Result record fields (all prefixed replay_) for a replay() result. Delays are queueing delays
+        (start - arrival, seconds), percentiles over the packets that were not dropped.
+    """
+    ranks = np.asarray(ranks, dtype=np.int64)
+    qids = np.asarray(qids, dtype=np.int64)
+    dropped = out["dropped"]
+    num_ranks = max(max_rank, int(ranks.max(initial=0)) + 1)
+    delays = (out["start"] - out["arrival"])[~dropped]
+    sent = ranks[~dropped]
+    counts = np.bincount(sent, minlength=num_ranks)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        delay_per_rank = np.bincount(sent, weights=delays, minlength=num_ranks)/counts
+    rec = {"replay": out["spec"],
+           "replay_packets": len(ranks),
+           "replay_drops": int(dropped.sum()),
+           "replay_drop_rate": float(dropped.mean()) if len(ranks) else 0.0,
+           "replay_drops_per_q": np.bincount(qids[dropped], minlength=num_qs).tolist(),
+           "replay_drops_per_rank": np.bincount(ranks[dropped], minlength=num_ranks).tolist(),
+           "replay_mean_delay": float(delays.mean()) if len(delays) else 0.0,
+           "replay_max_delay": float(delays.max()) if len(delays) else 0.0,
+           "replay_delay_per_rank": delay_per_rank.tolist(),
+           "replay_duration": float(np.nanmax(out["start"]) + out["service"]) if len(delays) else 0.0}
+    values = np.percentile(delays, PERCENTILES) if len(delays) else np.zeros(len(PERCENTILES))
+    for p, value in zip(PERCENTILES, values):
+        rec[f"replay_delay_p{p:g}".replace(".", "_")] = float(value)
+    return rec
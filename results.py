@@ -0,0 +1,301 @@
+# Writers for the result files produced by the simulators.
+# Records are dicts returned by the sweep workers, inversion counts are totals over all iterations.
+# Besides the CSVs, write_columnar() stores whole records, per-rank arrays included, in one .npz file
+# that read_columnar() loads back without any text parsing.
+
+import numpy as np
+
+COLUMNAR_VERSION = 1
+WINDOW_FIELDS = ("window_index", "window_start", "window_packets", "window_inversions")   # windows.InversionWindows.fields()
+
+def normalized(count, packets, iterations=1):
+    """Mean count per iteration per packet, 0 for a trace with no packets"""
+    return (count/iterations)/packets if packets else 0.0
+
+def write_sp_csv(outf, records):
+    """Num Qs, Max Rank, Norm. Mean Inversions"""
+    with open(outf, 'w') as f:
+        f.write("Num Qs, Max Rank, Norm. Mean Inversions\n")
+        for rec in records:
+            norm = normalized(rec["inversions"], rec["max_packets"], rec["iterations"])
+            f.write(f"{rec['num_qs']}, {rec['max_rank']}, {norm:.3f}\n")
+
+def write_mc_csv(outf, records):
+    """Num Qs, Max Rank, Replicas, Norm. Mean Inversions, Std, CI Low, CI High (Monte Carlo records, CI at ci_level)"""
+    with open(outf, 'w') as f:
+        f.write("Num Qs, Max Rank, Replicas, Norm. Mean Inversions, Std, CI Low, CI High\n")
+        for rec in records:
+            f.write(f"{rec['num_qs']}, {rec['max_rank']}, {rec['iterations']}, {rec['mean']:.4f}, {rec['std']:.4f}, "
+                    f"{rec['ci_low']:.4f}, {rec['ci_high']:.4f}\n")
+
+def append_inv_per_rank(outf, records):
+    """Append one "MR: x, NQs: y" line and one row of normalized inversions per rank for every record"""
+    with open(outf, 'a') as f:
+        for rec in records:
+            f.write(f"MR: {rec['max_rank']}, NQs: {rec['num_qs']}\n")
+            for item in rec["inversions_per_rank"]:
+                f.write(f"{normalized(item, rec['max_packets'], rec['iterations']):.3f} ")
+            f.write("\n")
+
+def write_hp_csv(outf, records):
+    """Num S1 Qs, Num S2 Qs, Max Rank, S1 Norm. Mean Inversions, S2 Norm. Mean Inversions"""
+    with open(outf, 'w') as f:
+        f.write("Num S1 Qs, Num S2 Qs, Max Rank, S1 Norm. Mean Inversions, S2 Norm. Mean Inversions\n")
+        for rec in records:
+            s1_norm = normalized(rec["s1_inversions"], rec["max_packets"], rec["iterations"])
+            s2_norm = normalized(rec["s2_inversions"], rec["max_packets"], rec["iterations"])
+            f.write(f"{rec['num_s1_qs']}, {rec['num_s2_qs']}, {rec['max_rank']}, {s1_norm:.3f}, {s2_norm:.3f}\n")
+
+def write_hier_csv(outf, records):
+    """
+        One row per stage of every N-stage hierarchy record:
+        Stage Qs, Feeds, Max Rank, Stage, Packets, Norm. Mean Inversions, Q Share.
+        Stage Qs/Feeds are "/" separated per stage. Q Share is the share of the stage's packets put in each q
+        (not an occupancy: the engines never dequeue).
+    """
+    with open(outf, 'w') as f:
+        f.write("Stage Qs, Feeds, Max Rank, Stage, Packets, Norm. Mean Inversions, Q Share\n")
+        for rec in records:
+            for k, (inv, packets, enqueued) in enumerate(zip(rec["inversions"], rec["packets"], rec["enqueued"])):
+                norm = normalized(inv, rec["max_packets"], rec["iterations"])
+                share = " ".join(f"{n/packets if packets else 0:.3f}" for n in enqueued)
+                f.write(f"{rec['stages']}, {rec['feed_qs']}, {rec['max_rank']}, {k + 1}, {packets}, {norm:.3f}, {share}\n")
+
+DEQUEUE_HEADER = ("Enq Rate, Deq Rate, Norm. Dequeue Inversions, Norm. Pairwise Inversions, Norm. Unpifoness, "
+                  "Mean Delay, PIFO Mean Delay")
+
+def dequeue_fields(rec, pifo):
+    """The DEQUEUE_HEADER columns of a record, against the ideal PIFO record of its trace"""
+    packets = rec["max_packets"]
+    return (f"{rec['enq_rate']}, {rec['deq_rate']}, "
+            f"{normalized(rec['dequeue_inversions'], packets):.3f}, {normalized(rec['pairwise_inversions'], packets):.3f}, "
+            f"{normalized(rec['unpifoness'], packets):.3f}, {rec['mean_delay']:.3f}, {pifo['mean_delay']:.3f}")
+
+def write_sp_dequeue_csv(outf, records, pifo):
+    """
+        Num Qs, Max Rank, Enq Rate, Deq Rate, Norm. Dequeue Inversions, Norm. Pairwise Inversions, Norm. Unpifoness,
+        Mean Delay, PIFO Mean Delay. The ideal PIFO has no inversions, so the inversion columns are the gap to it.
+    """
+    with open(outf, 'w') as f:
+        f.write("Num Qs, Max Rank, " + DEQUEUE_HEADER + "\n")
+        for rec in records:
+            f.write(f"{rec['num_qs']}, {rec['max_rank']}, " + dequeue_fields(rec, pifo) + "\n")
+
+def write_hp_dequeue_csv(outf, records, pifo):
+    """Same as write_sp_dequeue_csv(), keyed by Num S1 Qs, Num S2 Qs"""
+    with open(outf, 'w') as f:
+        f.write("Num S1 Qs, Num S2 Qs, Max Rank, " + DEQUEUE_HEADER + "\n")
+        for rec in records:
+            f.write(f"{rec['num_s1_qs']}, {rec['num_s2_qs']}, {rec['max_rank']}, " + dequeue_fields(rec, pifo) + "\n")
+
+def write_hier_dequeue_csv(outf, records, pifo):
+    """Same as write_sp_dequeue_csv(), keyed by Stage Qs, Feeds"""
+    with open(outf, 'w') as f:
+        f.write("Stage Qs, Feeds, Max Rank, " + DEQUEUE_HEADER + "\n")
+        for rec in records:
+            f.write(f"{rec['stages']}, {rec['feed_qs']}, {rec['max_rank']}, " + dequeue_fields(rec, pifo) + "\n")
+
+def write_sp_long_csv(outf, records, pifos):
+    """
+        Records of several traces in one table, one row per record:
+        Trace, Num Qs, Max Rank, Max Packets, Norm. Mean Inversions.
+        pifos maps each trace to its ideal PIFO record; if there are any, the DEQUEUE_HEADER columns follow.
+    """
+    with open(outf, 'w') as f:
+        f.write("Trace, Num Qs, Max Rank, Max Packets, Norm. Mean Inversions" + (", " + DEQUEUE_HEADER if pifos else "") + "\n")
+        for rec in records:
+            norm = normalized(rec["inversions"], rec["max_packets"], rec["iterations"])
+            row = f"{rec['trace']}, {rec['num_qs']}, {rec['max_rank']}, {rec['max_packets']}, {norm:.3f}"
+            f.write(row + (", " + dequeue_fields(rec, pifos[rec["trace"]]) if pifos else "") + "\n")
+
+def write_hp_long_csv(outf, records, pifos):
+    """Same as write_sp_long_csv() for two-stage records: Trace, Num S1 Qs, Num S2 Qs, ..., S1/S2 Norm. Mean Inversions"""
+    with open(outf, 'w') as f:
+        f.write("Trace, Num S1 Qs, Num S2 Qs, Max Rank, Max Packets, S1 Norm. Mean Inversions, S2 Norm. Mean Inversions"
+                + (", " + DEQUEUE_HEADER if pifos else "") + "\n")
+        for rec in records:
+            s1_norm = normalized(rec["s1_inversions"], rec["max_packets"], rec["iterations"])
+            s2_norm = normalized(rec["s2_inversions"], rec["max_packets"], rec["iterations"])
+            row = (f"{rec['trace']}, {rec['num_s1_qs']}, {rec['num_s2_qs']}, {rec['max_rank']}, {rec['max_packets']}, "
+                   f"{s1_norm:.3f}, {s2_norm:.3f}")
+            f.write(row + (", " + dequeue_fields(rec, pifos[rec["trace"]]) if pifos else "") + "\n")
+
+def write_hier_long_csv(outf, records, pifos):
+    """
+        Same as write_hier_csv() with a leading Trace column, one row per stage.
+        The DEQUEUE_HEADER columns, if any, describe the whole hierarchy and repeat on every stage row.
+    """
+    with open(outf, 'w') as f:
+        f.write("Trace, Stage Qs, Feeds, Max Rank, Stage, Packets, Norm. Mean Inversions, Q Share"
+                + (", " + DEQUEUE_HEADER if pifos else "") + "\n")
+        for rec in records:
+            for k, (inv, packets, enqueued) in enumerate(zip(rec["inversions"], rec["packets"], rec["enqueued"])):
+                norm = normalized(inv, rec["max_packets"], rec["iterations"])
+                share = " ".join(f"{n/packets if packets else 0:.3f}" for n in enqueued)
+                row = f"{rec['trace']}, {rec['stages']}, {rec['feed_qs']}, {rec['max_rank']}, {k + 1}, {packets}, {norm:.3f}, {share}"
+                f.write(row + (", " + dequeue_fields(rec, pifos[rec["trace"]]) if pifos else "") + "\n")
+
+def write_steady_csv(outf, records, keys, inversions):
+    """
+        Cold start vs warm start (warmstart.py): Trace, the keys columns, Max Rank, Warm Start, Steady Packets,
+        then for every inversion field a Norm. Cold and a Norm. Steady column.
+        keys are (header, field) pairs, e.g. ("Num Qs", "num_qs"); inversions are (header prefix, field) pairs,
+        e.g. ("S1 ", "s1_inversions"), whose warm-started count is "steady_<field>".
+        Cold counts are normalized by max_packets, steady ones by the packets counted after the warm-up.
+    """
+    with open(outf, 'w') as f:
+        f.write("Trace, " + "".join(f"{header}, " for header, _ in keys) + "Max Rank, Warm Start, Steady Packets"
+                + "".join(f", {prefix}Norm. Cold Inversions, {prefix}Norm. Steady Inversions" for prefix, _ in inversions) + "\n")
+        for rec in records:
+            row = f"{rec['trace']}, " + "".join(f"{rec[field]}, " for _, field in keys)
+            row += f"{rec['max_rank']}, {rec['warm_start']}, {rec['steady_packets']}"
+            for _, field in inversions:
+                cold = normalized(rec[field], rec["max_packets"], rec["iterations"])
+                steady = normalized(rec["steady_" + field], rec["steady_packets"])
+                row += f", {cold:.3f}, {steady:.3f}"
+            f.write(row + "\n")
+
+def write_hier_steady_csv(outf, records):
+    """Same as write_steady_csv() for N-stage records, one row per stage: Trace, Stage Qs, Feeds, Max Rank, Stage, ..."""
+    with open(outf, 'w') as f:
+        f.write("Trace, Stage Qs, Feeds, Max Rank, Stage, Warm Start, Steady Packets, Norm. Cold Inversions, Norm. Steady Inversions\n")
+        for rec in records:
+            for k, (inv, steady_inv) in enumerate(zip(rec["inversions"], rec["steady_inversions"])):
+                cold = normalized(inv, rec["max_packets"], rec["iterations"])
+                steady = normalized(steady_inv, rec["steady_packets"])
+                f.write(f"{rec['trace']}, {rec['stages']}, {rec['feed_qs']}, {rec['max_rank']}, {k + 1}, "
+                        f"{rec['warm_start']}, {rec['steady_packets']}, {cold:.3f}, {steady:.3f}\n")
+
+def write_windows_csv(outf, records, keys, stages):
+    """
+        Windowed inversions (windows.py), one row per window: Trace, the keys columns, Max Rank, Window Size, Stage,
+        Window, Start, Packets, Inversions, Norm. Inversions (normalized by the packets of the window).
+        keys are (header, field) pairs as in write_steady_csv(); stages are (stage number, field prefix) pairs,
+        e.g. (1, "s1_"), whose windows are "<prefix>window_index" etc.
+    """
+    with open(outf, 'w') as f:
+        f.write("Trace, " + "".join(f"{header}, " for header, _ in keys)
+                + "Max Rank, Window Size, Stage, Window, Start, Packets, Inversions, Norm. Inversions\n")
+        for rec in records:
+            head = f"{rec['trace']}, " + "".join(f"{rec[field]}, " for _, field in keys) + f"{rec['max_rank']}, {rec['window']}"
+            for stage, prefix in stages:
+                _write_windows(f, head, stage, [rec[prefix + field] for field in WINDOW_FIELDS])
+
+def write_hier_windows_csv(outf, records):
+    """Same as write_windows_csv() for N-stage records, whose window fields are per stage lists"""
+    with open(outf, 'w') as f:
+        f.write("Trace, Stage Qs, Feeds, Max Rank, Window Size, Stage, Window, Start, Packets, Inversions, Norm. Inversions\n")
+        for rec in records:
+            head = f"{rec['trace']}, {rec['stages']}, {rec['feed_qs']}, {rec['max_rank']}, {rec['window']}"
+            for k, columns in enumerate(zip(*(rec[field] for field in WINDOW_FIELDS))):
+                _write_windows(f, head, k + 1, columns)
+
+def _write_windows(f, head, stage, columns):
+    """Rows of one stage's windows: columns are the WINDOW_FIELDS lists"""
+    for index, start, packets, inversions in zip(*columns):
+        norm = inversions/packets if packets else 0
+        f.write(f"{head}, {stage}, {index}, {start:g}, {packets}, {inversions}, {norm:.3f}\n")
+
+def write_replay_csv(outf, records, keys):
+    """
+        Time-driven replay (replay.py), one row per record: Trace, the keys columns, Max Rank, Replay, Packets, Drops,
+        Drop Rate, then the mean, percentile and max queueing delays in microseconds.
+        keys are (header, field) pairs as in write_steady_csv().
+    """
+    percentiles = [key[len("replay_delay_p"):] for key in (records[0] if records else [])
+                   if key.startswith("replay_delay_p") and key[len("replay_delay_p"):].replace("_", "").isdigit()]
+    with open(outf, 'w') as f:
+        f.write("Trace, " + "".join(f"{header}, " for header, _ in keys) + "Max Rank, Replay, Packets, Drops, Drop Rate, Mean Delay (us)"
+                + "".join(f", P{p.replace('_', '.')} Delay (us)" for p in percentiles) + ", Max Delay (us)\n")
+        for rec in records:
+            row = f"{rec['trace']}, " + "".join(f"{rec[field]}, " for _, field in keys)
+            row += f"{rec['max_rank']}, {rec['replay']}, {rec['replay_packets']}, {rec['replay_drops']}, {rec['replay_drop_rate']:.4f}"
+            for field in ["replay_mean_delay"] + [f"replay_delay_p{p}" for p in percentiles] + ["replay_max_delay"]:
+                row += f", {rec[field]*1e6:.3f}"
+            f.write(row + "\n")
+
+def write_delay_per_rank(outf, records, pifo, keys):
+    """
+        One row per rank: Rank, PIFO, then the mean delay of every record, in ticks.
+        Record columns are named from keys, e.g. "num_qs=4". Ranks no packet had are written as nan.
+    """
+    columns = [pifo["delay_per_rank"]] + [rec["delay_per_rank"] for rec in records]
+    names = ["PIFO"] + [" ".join(f"{key}={rec[key]}" for key in keys) for rec in records]
+    with open(outf, 'w') as f:
+        f.write("Rank, " + ", ".join(names) + "\n")
+        for rank in range(max(len(col) for col in columns)):
+            f.write(f"{rank}, " + ", ".join(f"{col[rank]:.3f}" if rank < len(col) else "nan" for col in columns) + "\n")
+
+def _nested_shape(value):
+    """Shape of a scalar or (possibly ragged) nested list, taking the longest list at every level"""
+    if not isinstance(value, (list, tuple, np.ndarray)):
+        return ()
+    inner = [_nested_shape(item) for item in value]
+    if not inner or not inner[0]:
+        return (len(value), )
+    return (len(value), ) + tuple(max(dims) for dims in zip(*inner))
+
+def _has_float(value):
+    """True if a scalar or nested list holds any float"""
+    if isinstance(value, np.ndarray):
+        return value.dtype.kind == 'f'
+    if isinstance(value, (list, tuple)):
+        return any(_has_float(item) for item in value)
+    return isinstance(value, (float, np.floating))
+
+def _fill(out, value):
+    """Copy a nested list into the front corner of out"""
+    if isinstance(value, (list, tuple, np.ndarray)) and len(value) and isinstance(value[0], (list, tuple, np.ndarray)):
+        for i, item in enumerate(value):
+            _fill(out[i], item)
+    else:
+        out[:len(value)] = value
+
+def _column(values):
+    """
+        One column of a record group as an array. Lists (e.g. inversions_per_rank) of different lengths
+        are padded to the longest: 0 for integer columns, nan for float columns.
+        Returns None for fields that are neither numbers, strings nor lists of numbers.
+    """
+    if all(isinstance(v, str) for v in values):
+        return np.array(values)
+    if all(isinstance(v, (bool, int, float, np.number)) for v in values):
+        return np.array(values)
+    if not all(isinstance(v, (list, tuple, np.ndarray)) for v in values):
+        return None
+
+    shape = tuple(max(dims) for dims in zip(*(_nested_shape(v) for v in values)))
+    is_float = any(_has_float(v) for v in values)
+    out = np.full((len(values), ) + shape, np.nan if is_float else 0, dtype=np.float64 if is_float else np.int64)
+    for row, v in zip(out, values):
+        _fill(row, v)
+    return out
+
+def write_columnar(outf, groups):
+    """
+        Columnar copy of the results: groups maps a name (e.g. "sppifo", "pifo") to its list of records.
+        Every record field becomes one array "<name>.<field>" with a row per record, so per-config metadata
+        (num_qs, max_rank, ...) and per-rank arrays (inversions_per_rank, ...) sit side by side.
+        Counts are stored raw, not normalized. Saved as a compressed .npz.
+    """
+    arrays = {"format_version": np.array(COLUMNAR_VERSION)}
+    for name, records in groups.items():
+        if not records:
+            continue
+        for field in records[0]:
+            if not all(field in rec for rec in records):
+                continue
+            column = _column([rec[field] for rec in records])
+            if column is not None:
+                arrays[f"{name}.{field}"] = column
+    np.savez_compressed(outf, **arrays)
+
+def read_columnar(inpf):
+    """Load a write_columnar() file as {group name: {field: array}}"""
+    groups = {}
+    with np.load(inpf) as data:
+        for key in data.files:
+            if "." in key:
+                name, field = key.split(".", 1)
+                groups.setdefault(name, {})[field] = data[key]
+    return groups
@@ -0,0 +1,250 @@
+# Deterministic dequeue model for the SP-PIFO/HP-PIFO queues.
+# The engines only decide which q a packet goes to. This module replays the trace through those qs
+# with a fixed enqueue rate and a link-rate dequeue clock, records the real departure order
+# and counts inversions against an ideal PIFO serving the same backlog.
+# The ideal PIFO itself is strict priority with one FIFO per rank (a bucket queue), see simulate_pifo().
+# Compiled (Numba if available): one pass over the ticks, idle stretches skipped, O(log R) work per packet.
+
+import numpy as np
+
+from engine import HAVE_NUMBA
+from trace_io import cached_trace
+
+if HAVE_NUMBA:
+    from numba import njit
+
+VERSION = 2
+
+WORD_BITS = 32                                  # Non-empty q bitmap word size (int64 words, kept clear of the sign bit)
+
+"""Binary indexed trees over ranks (int64 arrays of num_ranks + 1), O(log n) update and prefix sum"""
+
+def _fenwick_add(tree, i, delta):
+    """count[i] += delta"""
+    i += 1
+    while i < len(tree):
+        tree[i] += delta
+        i += i & -i
+
+def _fenwick_prefix(tree, i):
+    """Sum of count[0..i-1]"""
+    total = 0
+    while i > 0:
+        total += tree[i]
+        i -= i & -i
+    return total
+
+def _simulate_loop(ranks, qids, num_qs, num_ranks, enq_rate, deq_rate, count_inversions, every, backlog_rows, sample_ticks,
+                   order, arrival_tick, departure_tick, inversions_per_rank):
+    """
+        The tick loop of simulate(). One linked list per q, a bitmap of the non-empty qs and idle stretches
+        skipped in one step, so the work is O(log R) per packet whatever the rates.
+        Fills order, arrival_tick, departure_tick, inversions_per_rank and, every `every` ticks (0: never),
+        the backlog_rows/sample_ticks samples while they fit.
+        Returns (pairwise_inversions, unpifoness, dequeue_inversions, ticks, samples taken).
+    """
+    total_pkts = len(ranks)
+    heads = np.full(num_qs, -1, dtype=np.int64)
+    tails = np.full(num_qs, -1, dtype=np.int64)
+    lengths = np.zeros(num_qs, dtype=np.int64)
+    words = np.zeros((num_qs + WORD_BITS - 1)//WORD_BITS + 1, dtype=np.int64)   # Spare last word stops the scan
+    words[-1] = 1
+    lowest = len(words) - 1                         # No q in a word below this one has packets
+    nxt_pkt = np.full(total_pkts, -1, dtype=np.int64)   # Next packet in the same q
+    waiting = np.zeros(num_ranks + 1, dtype=np.int64)       # Packets waiting, per rank
+    waiting_sum = np.zeros(num_ranks + 1, dtype=np.int64)   # Sum of their ranks, per rank
+
+    pairwise_inversions = 0
+    unpifoness = 0
+    dequeue_inversions = 0
+    departed = 0
+    samples = 0
+    nxt = 0
+    backlog = 0
+    enq_credit = 0.0
+    deq_credit = 0.0
+    tick = 0
+    next_sample = 0 if every else -1                # Next tick to sample the backlog at, never if -1
+    while nxt < total_pkts or backlog:
+        if backlog == 0 and enq_credit + enq_rate < 1:
+            # Idle until the next arrival: jump there. The link does not save up transmissions while idle
+            skip = int(np.ceil((1 - enq_credit)/enq_rate)) - 1
+            while skip > 0 and enq_credit + skip*enq_rate >= 1:
+                skip -= 1
+            enq_credit += skip*enq_rate
+            deq_credit = (deq_credit + skip*deq_rate) % 1.0
+            while 0 <= next_sample < tick + skip:
+                if samples < len(sample_ticks):
+                    backlog_rows[samples, :] = 0
+                    sample_ticks[samples] = next_sample
+                samples += 1
+                next_sample += every
+            tick += skip
+
+        # Arrivals
+        enq_credit += enq_rate
+        while enq_credit >= 1 and nxt < total_pkts:
+            q = qids[nxt]
+            if tails[q] < 0:
+                heads[q] = nxt
+                words[q//WORD_BITS] |= 1 << (q % WORD_BITS)
+                lowest = min(lowest, q//WORD_BITS)
+            else:
+                nxt_pkt[tails[q]] = nxt
+            tails[q] = nxt
+            lengths[q] += 1
+            if count_inversions:
+                rank = ranks[nxt]
+                _fenwick_add(waiting, rank, 1)
+                _fenwick_add(waiting_sum, rank, rank)
+            arrival_tick[nxt] = tick
+            backlog += 1
+            nxt += 1
+            enq_credit -= 1
+
+        # Departures, highest priority non-empty q first
+        deq_credit += deq_rate
+        while deq_credit >= 1 and backlog:
+            w = lowest
+            while words[w] == 0:
+                w += 1
+            lowest = w
+            low = words[w] & -words[w]
+            bit = 0
+            while low > 1:
+                low >>= 1
+                bit += 1
+            q = w*WORD_BITS + bit
+            pkt = heads[q]
+            heads[q] = nxt_pkt[pkt]
+            lengths[q] -= 1
+            if lengths[q] == 0:
+                tails[q] = -1
+                words[w] &= ~(1 << bit)
+
+            backlog -= 1
+            deq_credit -= 1
+            order[departed] = pkt
+            departed += 1
+            departure_tick[pkt] = tick
+            if not count_inversions:
+                continue
+
+            rank = ranks[pkt]
+            _fenwick_add(waiting, rank, -1)
+            _fenwick_add(waiting_sum, rank, -rank)
+            overtaken = _fenwick_prefix(waiting, rank)
+            if overtaken:
+                pairwise_inversions += overtaken
+                unpifoness += overtaken*rank - _fenwick_prefix(waiting_sum, rank)
+                dequeue_inversions += 1
+                inversions_per_rank[rank] += 1
+
+        if not backlog:
+            deq_credit -= int(deq_credit)           # An idle link does not save up transmissions
+        if tick == next_sample:
+            if samples < len(sample_ticks):
+                backlog_rows[samples, :] = lengths
+                sample_ticks[samples] = tick
+            samples += 1
+            next_sample += every
+        tick += 1
+    return pairwise_inversions, unpifoness, dequeue_inversions, tick, samples
+
+if HAVE_NUMBA:
+    _fenwick_add = njit(cache=True, nogil=True)(_fenwick_add)
+    _fenwick_prefix = njit(cache=True, nogil=True)(_fenwick_prefix)
+    _simulate_loop = njit(cache=True, nogil=True)(_simulate_loop)
+
+def simulate(ranks, qids, num_qs, max_rank, enq_rate=1.0, deq_rate=1.0, count_inversions=True, recorder=None):
+    """
+        Replay packets through strict priority FIFO qs (q 0 has the highest priority).
+        Every tick, enq_rate packets arrive (in trace order) into their q from qids,
+        then the link sends deq_rate packets from the highest priority non-empty q.
+        Fractional rates accumulate from tick to tick.
+
+        An inversion is a pair of packets where the higher rank one departs while the lower rank one
+        is already waiting, i.e. a pair an ideal PIFO over the same backlog would have sent the other way round.
+        count_inversions=False skips the O(log R) inversion bookkeeping (counts are then 0).
+        recorder, an instrument.DequeueRecorder, samples the per-q backlog every recorder.every ticks.
+        Returns a dict with:
+            order               packet indices in departure order
+            arrival_tick        tick each packet (by index) arrived at
+            departure_tick      tick each packet (by index) left at
+            pairwise_inversions total inversion pairs
+            unpifoness          sum of rank differences over the inversion pairs
+            dequeue_inversions  departures that overtook at least one lower rank packet
+            inversions_per_rank dequeue_inversions split by the rank of the departing packet
+            delay_per_rank      mean departure - arrival ticks per rank (nan for ranks not in the trace)
+            ticks               ticks until the last packet left
+    """
+    if enq_rate <= 0 or deq_rate <= 0:
+        raise ValueError("enq_rate and deq_rate must be positive")
+    ranks = np.asarray(ranks, dtype=np.int64)
+    qids = np.asarray(qids, dtype=np.int64)
+
+    total_pkts = len(ranks)
+    num_ranks = max(max_rank, int(ranks.max(initial=0)) + 1)
+    order = np.empty(total_pkts, dtype=np.int64)
+    arrival_tick = np.empty(total_pkts, dtype=np.int64)
+    departure_tick = np.empty(total_pkts, dtype=np.int64)
+    inversions_per_rank = np.zeros(num_ranks, dtype=np.int64)
+    if recorder is None:
+        every, backlog_rows, sample_ticks = 0, np.zeros((0, num_qs), dtype=np.int64), np.zeros(0, dtype=np.int64)
+    else:
+        every, backlog_rows, sample_ticks = recorder.every, recorder.backlog, recorder.tick
+    pairwise_inversions, unpifoness, dequeue_inversions, ticks, samples = _simulate_loop(
+        ranks, qids, num_qs, num_ranks, float(enq_rate), float(deq_rate), bool(count_inversions), every,
+        backlog_rows, sample_ticks, order, arrival_tick, departure_tick, inversions_per_rank)
+    if recorder is not None:
+        recorder.samples = samples
+
+    return {"order": order,
+            "arrival_tick": arrival_tick,
+            "departure_tick": departure_tick,
+            "pairwise_inversions": int(pairwise_inversions),
+            "unpifoness": int(unpifoness),
+            "dequeue_inversions": int(dequeue_inversions),
+            "inversions_per_rank": inversions_per_rank.tolist(),
+            "delay_per_rank": delay_per_rank(ranks, departure_tick - arrival_tick, num_ranks),
+            "ticks": int(ticks)}
+
+def delay_per_rank(ranks, delays, num_ranks):
+    """Mean delay per rank, nan for ranks with no packets"""
+    ranks = np.asarray(ranks, dtype=np.int64)
+    counts = np.bincount(ranks, minlength=num_ranks)
+    sums = np.bincount(ranks, weights=delays, minlength=num_ranks)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums/counts
+
+def simulate_pifo(ranks, max_rank, enq_rate=1.0, deq_rate=1.0):
+    """
+        Ideal PIFO over the same arrivals and link clock as simulate().
+        A PIFO that breaks rank ties in arrival order is strict priority with one FIFO per rank,
+        so this is simulate() with the rank as the q index: O(1) enqueue, dequeue finds
+        the lowest non-empty rank from a bitmask. Returns the same dict, with no inversions
+        (nothing is ever overtaken, so the inversion bookkeeping is skipped).
+    """
+    ranks = np.asarray(ranks, dtype=np.int64)
+    num_ranks = max(max_rank, int(ranks.max(initial=0)) + 1)
+    return simulate(ranks, ranks, num_ranks, max_rank, enq_rate, deq_rate, count_inversions=False)
+
+def summarize(deq):
+    """Result record fields for a simulate()/simulate_pifo() result"""
+    delays = deq["departure_tick"] - deq["arrival_tick"]
+    return {"pairwise_inversions": deq["pairwise_inversions"],
+            "unpifoness": deq["unpifoness"],
+            "dequeue_inversions": deq["dequeue_inversions"],
+            "dequeue_inversions_per_rank": deq["inversions_per_rank"],
+            "mean_delay": float(delays.mean()) if len(delays) else 0.0,
+            "delay_per_rank": deq["delay_per_rank"].tolist(),
+            "ticks": deq["ticks"]}
+
+def pifo_record(inpf, rates):
+    """Sweep worker body for the ideal PIFO reference of one trace, at (enq_rate, deq_rate)"""
+    _, ranks, max_rank = cached_trace(inpf)
+    enq_rate, deq_rate = rates
+    rec = {"engine": "pifo", "trace": inpf, "max_rank": max_rank, "max_packets": len(ranks),
+           "enq_rate": enq_rate, "deq_rate": deq_rate}
+    rec.update(summarize(simulate_pifo(ranks, max_rank, enq_rate, deq_rate)))
+    return rec
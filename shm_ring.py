@@ -0,0 +1,171 @@
+# Shared memory ring buffers for the multiprocess (hardware-like) mode.
+# Each ring is a fixed-size array of (rank, id) records in multiprocessing.shared_memory with a
+# single producer and a single consumer. The producer only writes head, the consumer only writes tail,
+# so no lock is needed. Packets move between stages in batches, without pickling: a stage pushes each q's share
+# of a batch with one ring operation. An empty/full ring is polled (with a spare CPU), then waited on with sleeps.
+# End of stream is a closed flag in the ring header, not a magic packet id.
+
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from engine import sppifo_kernel
+from packet import PACKET_DTYPE
+from trace_io import iter_packets
+
+RECORD = PACKET_DTYPE
+HEAD, TAIL, CLOSED = 0, 1, 2                    # Slots in the ring header
+HEADER_SLOTS = 4
+RING_SIZE = 1 << 14                             # Records per ring
+BATCH = 4096                                    # Records moved per pop
+SPIN = 2000 if (os.cpu_count() or 1) > 1 else 0 # Polls before yielding: with a CPU per stage the other side is running
+
+def backoff(spins):
+    """
+        Wait a little longer every time the ring is found empty/full: poll SPIN times, then yield,
+        then sleep up to 1ms. Returns the new spin count.
+    """
+    if spins >= SPIN:
+        if spins < SPIN + 16:
+            time.sleep(0)
+        else:
+            time.sleep(min(1e-3, 1e-5*(spins - SPIN - 15)))
+    return spins + 1
+
+class ShmRing:
+    """Single producer, single consumer ring of RECORDs in shared memory"""
+    def __init__(self, capacity=RING_SIZE, name=None) -> None:
+        size = HEADER_SLOTS*8 + capacity*RECORD.itemsize
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.capacity = capacity
+        self.ctrl = np.ndarray((HEADER_SLOTS,), dtype=np.uint64, buffer=self.shm.buf)
+        self.data = np.ndarray((capacity,), dtype=RECORD, buffer=self.shm.buf, offset=HEADER_SLOTS*8)
+        if self.owner:
+            self.ctrl[:] = 0
+
+    def __reduce__(self):
+        """Reattach by name when sent to a spawned process"""
+        return (ShmRing, (self.capacity, self.shm.name))
+
+    def __repr__(self) -> str:
+        return(f"ShmRing: {self.shm.name}, {len(self)}/{self.capacity} records")
+
+    def __len__(self) -> int:
+        return int(self.ctrl[HEAD] - self.ctrl[TAIL])
+
+    def push(self, records):
+        """Append records (RECORD array), waiting while the ring is full"""
+        ctrl = self.ctrl
+        cap = self.capacity
+        done = 0
+        spins = 0
+        while done < len(records):
+            head = int(ctrl[HEAD])
+            free = cap - (head - int(ctrl[TAIL]))
+            if free == 0:
+                spins = backoff(spins)
+                continue
+            spins = 0
+            n = min(free, len(records) - done)
+            start = head % cap
+            first = min(n, cap - start)
+            self.data[start:start + first] = records[done:done + first]
+            if first < n:
+                self.data[:n - first] = records[done + first:done + n]
+            ctrl[HEAD] = head + n                   # Publish only after the records are written
+            done += n
+
+    def pop(self, max_n=BATCH):
+        """Take up to max_n records without waiting. Returns None if the ring is empty."""
+        ctrl = self.ctrl
+        tail = int(ctrl[TAIL])
+        n = min(int(ctrl[HEAD]) - tail, max_n)
+        if n <= 0:
+            return None
+        start = tail % self.capacity
+        first = min(n, self.capacity - start)
+        if first == n:
+            out = self.data[start:start + n].copy()
+        else:
+            out = np.concatenate((self.data[start:start + first], self.data[:n - first]))
+        ctrl[TAIL] = tail + n                       # Free the slots only after copying out
+        return out
+
+    def close(self):
+        """Producer side: no more records will be pushed"""
+        self.ctrl[CLOSED] = 1
+
+    def drained(self):
+        """Closed and empty. Check after a pop() returned None."""
+        return bool(self.ctrl[CLOSED]) and len(self) == 0
+
+    def release(self):
+        """Detach, and free the memory if this process created the ring"""
+        del self.ctrl, self.data
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+def pop_wait(ring):
+    """Blocking pop(). Returns None once the ring is drained."""
+    spins = 0
+    while True:
+        batch = ring.pop()
+        if batch is not None:
+            return batch
+        if ring.drained():
+            return None
+        spins = backoff(spins)
+
+def generate_packet(inpf, ring, chunk=BATCH):
+    """Read packets from file (any trace_io format) into the input ring"""
+    for records in iter_packets(inpf, chunk):
+        ring.push(records)
+    ring.close()
+
+def sppifo_stage(inp, outs, max_rank, avg_inv, avg_inv_per_rank):
+    """
+        SP-PIFO between rings: outs[0] is the highest priority q.
+        Uses the batch engine kernel on every popped batch, so results match the other modes.
+        A batch is split by q with one stable sort, in order within every q, and each q gets one push.
+    """
+    num_qs = len(outs)
+    bounds = np.zeros(num_qs, dtype=np.int64)
+    inversions = 0
+    inversions_per_rank = np.zeros(max_rank, dtype=np.int64)
+    while True:
+        batch = pop_wait(inp)
+        if batch is None:
+            break
+        qids, inv, inv_per_rank = sppifo_kernel(batch["rank"], num_qs, max_rank, bounds)
+        inversions += inv
+        inversions_per_rank += inv_per_rank         # ValueError past max_rank, as SPPIFO raises
+        batch = batch[np.argsort(qids, kind='stable')]
+        ends = np.cumsum(np.bincount(qids, minlength=num_qs)).tolist()
+        start = 0
+        for ring, end in zip(outs, ends):
+            if end > start:
+                ring.push(batch[start:end])
+            start = end
+
+    for ring in outs:
+        ring.close()
+    avg_inv.value += inversions
+    for r in np.flatnonzero(inversions_per_rank).tolist():
+        avg_inv_per_rank[r] += int(inversions_per_rank[r])
+
+def consume_packet(rings):
+    """Strict priority dequeue, one batch at a time from the first non-empty ring, until all rings are drained"""
+    spins = 0
+    while True:
+        for ring in rings:
+            if ring.pop() is not None:
+                spins = 0
+                break
+        else:
+            if all(ring.drained() for ring in rings):
+                break
+            spins = backoff(spins)
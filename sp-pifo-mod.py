@@ -5,11 +5,22 @@
 
 # TODO: Try different packet ranks. Uniform, Exponential, Inverse Exponential, Poisson
 
+import math
+import os
 import time
 import random
 import multiprocessing as mp
 import numpy as np
 
+from mp_queues import PriorityQueues
+from packet import Packet, END_OF_STREAM
+from engine import sppifo_batch
+from results import write_sp_csv, write_mc_csv, append_inv_per_rank, write_columnar
+from sweep import run_sweep
+from montecarlo import confidence_interval, replica_seeds, run_replicas
+from adaptive import adaptive_sweep
+from estimator import mean_field, steady_state
+
 NUM_OF_QUEUES = [2, 4, 8, 16]
 # NUM_OF_QUEUES = [8]
 
@@ -22,17 +33,29 @@ DIST_TYPE = "pois"
 MAX_PACKETS = 100000
 ITERATIONS = 10
 
-class Packet:
-    def __init__(self, rank, id) -> None:
-        self.rank = rank
-        self.pktid = id                         # Unix time in seconds
-    
-    def __repr__(self) -> str:
-        return(f"Rank: {self.rank}, ID: {self.pktid}")
+MODE = "batch"                                          # batch (in-process sweep), adaptive (refined sweep), mc (Monte Carlo replicas),
+                                                        # estimate (analytical, estimator.py), mp (one process per stage)
+
+SEED = 0                                                # Root of the per-replica/per-iteration seeds (mc, mp)
+MC_BATCH = 8                                            # Replicas per worker task
+MC_MIN_REPLICAS = 8
+MC_MAX_REPLICAS = 128
+MC_CI_WIDTH = 0.002                                     # Stop a cell once its CI of the norm. inversions is this narrow
+MC_LEVEL = 0.95
 
-def generate_packet(inp_q, dist_type, max_rank):
+ADAPTIVE_BUDGET = 64                                    # Configurations run in total, NUM_OF_QUEUES x MAX_RANKS grid included
+
+def generate_packet(inp_q, dist_type, max_rank, seed=None, hist_path=None):
+    """
+        Send MAX_PACKETS packets, then END_OF_STREAM. seed (a SeedSequence) reseeds this process:
+        forked generators otherwise all start from the parent's random state and send the same ranks.
+        The ranks are also written to hist_path, if given.
+    """
+    if seed is not None:
+        random.seed(int(seed.generate_state(1)[0]))
+        np.random.seed(seed.generate_state(1))
     total_pkts = 0
-    with open(DIST_TYPE + "_hist.txt", 'w') as hist_file:
+    with open(hist_path or os.devnull, 'w') as hist_file:
         if dist_type == "unif":
             while total_pkts < MAX_PACKETS:
                 rank = random.randint(1, max_rank)               # MAX value subject to change
@@ -42,7 +65,7 @@ def generate_packet(inp_q, dist_type, max_rank):
                 total_pkts += 1
                 hist_file.write(f"{rank} ")
                 # time.sleep(0.0001)
-            inp_q.put(Packet(-1, -1), block=True)           # Send a sentinel pkt
+            inp_q.put(END_OF_STREAM, block=True)            # No more packets
             # print("Generator sent a SENTINEL packet")
         elif dist_type == "exp":
             pass
@@ -61,26 +84,55 @@ def generate_packet(inp_q, dist_type, max_rank):
                 inp_q.put(pkt, block=True)
                 total_pkts += 1
                 hist_file.write(f"{rank} ")
-            inp_q.put(Packet(-1, -1), block=True)
+            inp_q.put(END_OF_STREAM, block=True)
         else:
             print(f"Unknown distribution {dist_type}")
             exit(1)
 
+def gen_ranks(dist_type, max_rank, num_pkts, rng=None):
+    """
+        Draw num_pkts ranks in one go, same distributions as generate_packet().
+        From rng (a np.random.Generator) if given, else from the global np.random state.
+    """
+    integers = np.random.randint if rng is None else rng.integers
+    poisson = np.random.poisson if rng is None else rng.poisson
+    if dist_type == "unif":
+        return integers(1, max_rank + 1, size=num_pkts)
+    elif dist_type == "pois":
+        # Generate packets between max rank and 1, redraw the ones out of range
+        lam = max_rank//2
+        ranks = poisson(lam=lam, size=num_pkts)
+        bad = (ranks < 1) | (ranks > max_rank)
+        while bad.any():
+            ranks[bad] = poisson(lam=lam, size=int(bad.sum()))
+            bad = (ranks < 1) | (ranks > max_rank)
+        return ranks
+    else:
+        print(f"Unknown distribution {dist_type}")
+        exit(1)
+
+def rank_pmf(dist_type, max_rank):
+    """Probability of every rank 0..max_rank under gen_ranks(), for the estimator"""
+    ranks = np.arange(max_rank + 1)
+    if dist_type == "unif":
+        pmf = (ranks >= 1).astype(np.float64)
+    elif dist_type == "pois":
+        lam = max_rank//2
+        pmf = np.array([math.exp(r*math.log(lam) - lam - math.lgamma(r + 1)) if r >= 1 else 0.0 for r in ranks])
+    else:
+        print(f"Unknown distribution {dist_type}")
+        exit(1)
+    return pmf/pmf.sum()
+
 def consume_packet(out_qs):
+    """Strict priority dequeue from a PriorityQueues group. First q has highest priority."""
+    order = list(range(len(out_qs)))
     while True:
-        # TODO (DONE): figure out which Q to consume. 
-        selected_q = None
-        for q in out_qs:              # Last q has highest priority
-            if not q.empty():
-                selected_q = q
-                break
-                
-        if selected_q:
-            pkt = selected_q.get()
-            # print(pkt)
-            if pkt.pktid == -1:
-                # print("Received last packet")
-                break
+        pkt = out_qs.get(order)                 # Sleeps while all qs are empty
+        # print(pkt)
+        if pkt is END_OF_STREAM:
+            # print("Received last packet")
+            break
 
 def sppfio(inpq, outqs, rank, avg_inv, num_qs, avg_inv_per_rank):
     # TODO: put packet in designated Q
@@ -91,7 +143,7 @@ def sppfio(inpq, outqs, rank, avg_inv, num_qs, avg_inv_per_rank):
     
     while True:
         pkt = inpq.get()
-        if pkt.pktid == -1:
+        if pkt is END_OF_STREAM:
             outqs[-1].put(pkt)                  # Put into lowest priority q
             break
 
@@ -125,10 +177,98 @@ def sppfio(inpq, outqs, rank, avg_inv, num_qs, avg_inv_per_rank):
     #         f.write(f"{item} ")
     #     f.write("\n")
 
+def run_config(cfg):
+    """Batch engine worker for one (num_qs, max_rank) configuration"""
+    num_qs, max_rank = cfg
+    np.random.seed(0)
+
+    inversions = 0
+    inversions_per_rank = [0 for _ in range(max_rank)]
+    for _ in range(ITERATIONS):
+        ranks = gen_ranks(DIST_TYPE, max_rank, MAX_PACKETS)
+        inv, inv_per_rank = sppifo_batch(ranks, num_qs, max_rank)
+        inversions += inv
+        for r, item in enumerate(inv_per_rank):
+            inversions_per_rank[r] += item
+
+    return {"num_qs": num_qs, "max_rank": max_rank, "max_packets": MAX_PACKETS,
+            "iterations": ITERATIONS, "inversions": inversions, "inversions_per_rank": inversions_per_rank}
+
+def run_replica_batch(task):
+    """Monte Carlo worker: one (num_qs, max_rank) cell, one record per replica seed, each from its own rank stream"""
+    (num_qs, max_rank), seeds = task
+    recs = []
+    for seed in seeds:
+        ranks = gen_ranks(DIST_TYPE, max_rank, MAX_PACKETS, np.random.default_rng(seed))
+        inv, inv_per_rank = sppifo_batch(ranks, num_qs, max_rank)
+        recs.append({"inversions": inv, "norm_inversions": inv/MAX_PACKETS, "inversions_per_rank": inv_per_rank})
+    return recs
+
+def mc_record(cell, replicas):
+    """
+        Sweep record of a cell from its replica records: totals over the replicas (iterations = replicas, so
+        write_sp_csv() gives the mean), plus the mean, std and MC_LEVEL CI of the norm. inversions.
+    """
+    num_qs, max_rank = cell
+    norm = [rec["norm_inversions"] for rec in replicas]
+    mean, std, half = confidence_interval(norm, MC_LEVEL)
+    return {"num_qs": num_qs, "max_rank": max_rank, "max_packets": MAX_PACKETS, "iterations": len(replicas),
+            "inversions": sum(rec["inversions"] for rec in replicas),
+            "inversions_per_rank": np.sum([rec["inversions_per_rank"] for rec in replicas], axis=0).tolist(),
+            "mean": mean, "std": std, "ci_low": mean - half, "ci_high": mean + half, "ci_level": MC_LEVEL,
+            "replica_inversions": norm}
 
 if __name__ == "__main__":
     random.seed(0)
     np.random.seed(0)
+
+    if MODE == "batch":
+        records = run_sweep(run_config, [(num_qs, max_rank) for num_qs in NUM_OF_QUEUES for max_rank in MAX_RANKS])
+        write_sp_csv(DIST_TYPE + ".csv", records)
+        append_inv_per_rank(DIST_TYPE + "_inv_per_rank.csv", records)
+        write_columnar(DIST_TYPE + "_results.npz", {"sppifo": records})
+
+        """Rank histogram of the last configuration, as the mp generator leaves it"""
+        np.random.seed(0)
+        with open(DIST_TYPE + "_hist.txt", 'w') as hist_file:
+            hist_file.write(" ".join(map(str, gen_ranks(DIST_TYPE, MAX_RANKS[-1], MAX_PACKETS).tolist())) + " ")
+        exit(0)
+
+    if MODE == "adaptive":
+        """Coarse grid first, then midpoints where the norm. inversions change most"""
+        records = adaptive_sweep(run_config, lambda rec: rec["inversions"]/rec["iterations"]/rec["max_packets"],
+                                 [(num_qs, max_rank) for num_qs in NUM_OF_QUEUES for max_rank in MAX_RANKS], ADAPTIVE_BUDGET)
+        write_sp_csv(DIST_TYPE + ".csv", records)
+        append_inv_per_rank(DIST_TYPE + "_inv_per_rank.csv", records)
+        write_columnar(DIST_TYPE + "_results.npz", {"sppifo": records})
+        exit(0)
+
+    if MODE == "estimate":
+        """Expected inversions over MAX_PACKETS packets from the exact rank distribution, no packets simulated"""
+        records = []
+        for num_qs in NUM_OF_QUEUES:
+            for max_rank in MAX_RANKS:
+                pmf = rank_pmf(DIST_TYPE, max_rank)
+                rate, per_rank = mean_field(pmf, num_qs, MAX_PACKETS)
+                records.append({"num_qs": num_qs, "max_rank": max_rank, "max_packets": MAX_PACKETS, "iterations": 1,
+                                "inversions": rate*MAX_PACKETS, "inversions_per_rank": (per_rank*MAX_PACKETS).tolist(),
+                                "steady_state": steady_state(pmf, num_qs)[0]})
+        write_sp_csv(DIST_TYPE + "_estimate.csv", records)
+        append_inv_per_rank(DIST_TYPE + "_estimate_inv_per_rank.csv", records)
+        write_columnar(DIST_TYPE + "_estimate_results.npz", {"sppifo": records})
+        exit(0)
+
+    if MODE == "mc":
+        cells = [(num_qs, max_rank) for num_qs in NUM_OF_QUEUES for max_rank in MAX_RANKS]
+        replicas = run_replicas(run_replica_batch, cells, "norm_inversions", SEED, MC_BATCH, MC_MIN_REPLICAS, MC_MAX_REPLICAS,
+                                MC_CI_WIDTH, MC_LEVEL)
+        records = [mc_record(cell, replicas[cell]) for cell in cells]
+        write_sp_csv(DIST_TYPE + ".csv", records)
+        write_mc_csv(DIST_TYPE + "_mc.csv", records)
+        append_inv_per_rank(DIST_TYPE + "_inv_per_rank.csv", records)
+        write_columnar(DIST_TYPE + "_results.npz", {"sppifo": records})
+        exit(0)
+
     avg_inv = mp.Value("i", 0)
     with open(DIST_TYPE + ".csv", 'w') as f:
         f.write("Num Qs, Max Rank, Norm. Mean Inversions\n")
@@ -137,12 +277,16 @@ if __name__ == "__main__":
         for max_rank in MAX_RANKS:  
             avg_inv.value = 0
             avg_inv_per_rank = mp.Array("i", max_rank)
-            for _ in range(ITERATIONS):
+            seeds = replica_seeds(SEED, ITERATIONS)
+            for it in range(ITERATIONS):
                 inp_q = mp.Queue(maxsize=1)
-                out_qs = [mp.Queue() for _ in range(num_qs)]
+                out_group = PriorityQueues(num_qs)
+                out_qs = out_group.lanes()
 
-                packet_generator = mp.Process(target=generate_packet, args=(inp_q, DIST_TYPE, max_rank))
-                packet_consumer = mp.Process(target=consume_packet, args=(out_qs, ))
+                """Ranks of the first iteration go to one file per max rank"""
+                hist_path = f"{DIST_TYPE}_{max_rank}_hist.txt" if it == 0 else None
+                packet_generator = mp.Process(target=generate_packet, args=(inp_q, DIST_TYPE, max_rank, seeds[it], hist_path))
+                packet_consumer = mp.Process(target=consume_packet, args=(out_group, ))
                 sp_pifo_proc = mp.Process(target=sppfio, args=(inp_q, out_qs, max_rank, avg_inv, num_qs, avg_inv_per_rank))
 
                 sp_pifo_proc.start()
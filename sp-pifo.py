@@ -5,12 +5,27 @@
 
 # TODO: Try different packet ranks. Uniform, Exponential, Inverse Exponential, Poisson
 
-import time
 import random
 import multiprocessing as mp
 import numpy as np
 import argparse
 
+from mp_queues import PriorityQueues, generate_packet
+from packet import END_OF_STREAM
+import shm_ring
+from shm_ring import ShmRing
+from engine import SPPIFO, sppifo_batch, sppifo_kernel, sppifo_stream
+from results import (write_sp_csv, write_sp_dequeue_csv, write_sp_long_csv, write_steady_csv, write_windows_csv, write_replay_csv,
+                     write_delay_per_rank, append_inv_per_rank, write_columnar, normalized)
+from scheduler import pifo_record, simulate, summarize
+from cache import ResultCache
+from instrument import Recorder, instrument_path
+from replay import parse_replay, replay, summarize_replay
+from sweep import run_sweep
+from trace_io import cached_trace, expand_traces, iter_chunks, iter_ranks, read_header
+from warmstart import canonical, file_histogram, parse_warm_start, warm_run
+from windows import make_windows, parse_window
+
 NUM_OF_QUEUES = [2, 4, 8, 16]
 # NUM_OF_QUEUES = [8]
 
@@ -23,27 +38,6 @@ DIST_TYPE = "pois"                                      # not needed
 MAX_PACKETS = 100000                                    # not needed
 ITERATIONS = 1                                          # only 1 since constant packets
 
-class Packet:
-    def __init__(self, rank, id) -> None:
-        self.rank = rank
-        self.pktid = id                         # Unix time in seconds
-    
-    def __repr__(self) -> str:
-        return(f"Rank: {self.rank}, ID: {self.pktid}")
-
-def generate_packet(inpf, inp_q):
-    """Read packets from file and put in input q"""
-    with open(inpf, 'r') as f:
-        total_pkts, max_rank = map(int, f.readline().strip().split(","))
-        for _ in range(total_pkts):
-            id, rank = f.readline().strip().split(" ")
-            pkt = Packet(rank=int(rank), id=float(id))
-            inp_q.put(pkt, block=True)
-
-        """Last sentinel packet"""
-        inp_q.put(Packet(-1, -1), block=True)
-        print("Sent last packet")
-
 """
 def generate_packet(inp_q, dist_type, max_rank):
     total_pkts = 0
@@ -83,20 +77,14 @@ def generate_packet(inp_q, dist_type, max_rank):
 """
 
 def consume_packet(out_qs):
+    """Strict priority dequeue from a PriorityQueues group. First q has highest priority."""
+    order = list(range(len(out_qs)))
     while True:
-        # TODO (DONE): figure out which Q to consume. 
-        selected_q = None
-        for q in out_qs:              # Last q has highest priority
-            if not q.empty():
-                selected_q = q
-                break
-                
-        if selected_q:
-            pkt = selected_q.get()
-            # print(pkt)
-            if pkt.pktid == -1:
-                # print("Received last packet")
-                break
+        pkt = out_qs.get(order)                 # Sleeps while all qs are empty
+        # print(pkt)
+        if pkt is END_OF_STREAM:
+            # print("Received last packet")
+            break
 
 def sppfio(inpq, outqs, rank, avg_inv, num_qs, avg_inv_per_rank):
     # TODO: put packet in designated Q
@@ -107,7 +95,7 @@ def sppfio(inpq, outqs, rank, avg_inv, num_qs, avg_inv_per_rank):
     
     while True:
         pkt = inpq.get()
-        if pkt.pktid == -1:
+        if pkt is END_OF_STREAM:
             outqs[-1].put(pkt)                  # Put into lowest priority q
             break
 
@@ -141,19 +129,203 @@ def sppfio(inpq, outqs, rank, avg_inv, num_qs, avg_inv_per_rank):
     #         f.write(f"{item} ")
     #     f.write("\n")
 
+def run_config(cfg):
+    """
+        Batch engine worker for one configuration: trace, num_qs, chunk, rates.
+        With a chunk size the trace is streamed chunk by chunk instead of loaded whole.
+        With (enq_rate, deq_rate) rates the trace is also replayed through the dequeue model.
+        With instrument (every, npz path) the first iteration is instrumented and the samples written there (instrument.py).
+        With a warm_start spec (warmstart.py) the trace is run once more from warm bounds, into the steady_* fields.
+        With a window spec (windows.py) the first iteration also counts inversions per window, into the window_* fields.
+        With a replay spec (replay.py) the qs are also replayed in time with a link rate and q limits, into the replay_* fields.
+        engine "pifo" runs the ideal PIFO reference instead (independent of num_qs, run once per trace).
+    """
+    if cfg["engine"] == "pifo":
+        return pifo_record(cfg["trace"], cfg["rates"])
+
+    inpf, num_qs, chunk = cfg["trace"], cfg["num_qs"], cfg["chunk"]
+    if chunk:
+        max_packets, max_rank = read_header(inpf)
+        """Time windows need the ids too"""
+        run = lambda recorder, windows: sppifo_stream(iter_chunks(inpf, chunk) if windows else iter_ranks(inpf, chunk),
+                                                      num_qs, max_rank, recorder, windows)[:2]
+    else:
+        ids, ranks, max_rank = cached_trace(inpf)
+        max_packets = len(ranks)
+        run = lambda recorder, windows: sppifo_batch(ranks, num_qs, max_rank, recorder=recorder, windows=windows, ids=ids)
+
+    recorder = Recorder(cfg["instrument"][0]) if cfg.get("instrument") else None
+    windows, = make_windows(cfg["window"]) if cfg.get("window") else [None]
+    inversions = 0
+    inversions_per_rank = [0 for _ in range(max_rank)]
+    for it in range(ITERATIONS):
+        inv, inv_per_rank = run(recorder if it == 0 else None, windows if it == 0 else None)
+        inversions += inv
+        for r, item in enumerate(inv_per_rank):
+            inversions_per_rank[r] += item
+
+    rec = {"engine": "sppifo", "trace": inpf, "num_qs": num_qs, "max_rank": max_rank, "max_packets": max_packets,
+           "iterations": ITERATIONS, "inversions": inversions, "inversions_per_rank": inversions_per_rank}
+
+    if cfg.get("warm_start"):
+        sp = SPPIFO(num_qs, max_rank)
+        steady_packets = warm_run(sp, cfg["warm_start"], inpf, iter_ranks(inpf, chunk) if chunk else [ranks])
+        rec.update({"warm_start": canonical(cfg["warm_start"]), "steady_packets": steady_packets,
+                    "steady_inversions": sp.inversions, "steady_inversions_per_rank": sp.inversions_per_rank})
+
+    if windows:
+        rec.update({"window": cfg["window"], **windows.fields()})
+
+    if cfg["rates"]:
+        enq_rate, deq_rate = cfg["rates"]
+        qids = []
+        sppifo_batch(ranks, num_qs, max_rank, qids=qids)
+        rec.update({"enq_rate": enq_rate, "deq_rate": deq_rate})
+        deq_recorder = recorder.dequeue(num_qs) if recorder else None
+        rec.update(summarize(simulate(ranks, qids, num_qs, max_rank, enq_rate, deq_rate, recorder=deq_recorder)))
+    if cfg.get("replay"):
+        qids = sppifo_kernel(ranks, num_qs, max_rank)[0]
+        rec.update(summarize_replay(replay(cfg["replay"], ids, ranks, qids, num_qs), ranks, qids, num_qs, max_rank))
+    if recorder:
+        recorder.flush(cfg["instrument"][1])
+    return rec
 
 if __name__ == "__main__":
     random.seed(0)
     np.random.seed(0)
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("-i", help="Input packet file", type=str)
+    parser.add_argument("-i", help="Input packet file (text or binary trace), or a directory/glob of traces (batch mode, one long-format table)", type=str)
     parser.add_argument("-o", help="Ouput file (CSV)", type=str)
+    parser.add_argument("-m", help="Engine mode: batch (in-process), mp (hardware-like, one process per stage) or shm (mp over shared memory rings)", type=str, default="batch")
+    parser.add_argument("-w", help="Worker processes for the batch sweep (default: one per CPU)", type=int, default=None)
+    parser.add_argument("-c", help="Stream the trace in chunks of this many packets instead of loading it whole (batch mode)", type=int, default=None)
+    parser.add_argument("-r", help="enq_rate,deq_rate in packets per tick: also replay through the dequeue model (scheduler.py)", type=str, default=None)
+    parser.add_argument("-k", help="Result cache (SQLite file) for batch mode: reuse cells computed before, store new ones", type=str, default=None)
+    parser.add_argument("-x", help="Instrument batch runs into <out>_instr_*.npz: bounds and cumulative packets per q every this many packets, with -r also the per-q backlog (occupancy) every this many ticks", type=int, default=None)
+    parser.add_argument("-ws", help="Warm start (batch mode): hist, hist:<file> or prefix:N seed, settle:N, warmup:N, comma separated (see warmstart.py). Steady-state inversions go to <out>_steady.csv", type=str, default=None)
+    parser.add_argument("-tw", help="Inversions per window (batch mode): N packets, or trace time as 0.5s, 20ms, 100us (see windows.py). Goes to <out>_windows.csv", type=str, default=None)
+    parser.add_argument("-rp", help="Time-driven replay (batch mode, no -c): link:R pkts/s, buffer:N per q, poisson:R or uniform:R arrivals (default: trace stamps), seed:N, comma separated (see replay.py). Drops and delays go to <out>_replay.csv", type=str, default=None)
 
     args = parser.parse_args()
+
+    if args.m not in ("batch", "mp", "shm"):
+        print(f"Unknown mode {args.m}")
+        exit(1)
+
+    if args.x is not None and (args.m != "batch" or args.x < 1):
+        print("-x takes a positive sample period and needs batch mode")
+        exit(1)
+    if args.ws is not None:
+        try:
+            parse_warm_start(args.ws)
+        except ValueError as e:
+            print(e)
+            exit(1)
+        if args.m != "batch":
+            print("-ws needs batch mode")
+            exit(1)
+    if args.tw is not None:
+        try:
+            parse_window(args.tw)
+        except ValueError as e:
+            print(e)
+            exit(1)
+        if args.m != "batch":
+            print("-tw needs batch mode")
+            exit(1)
+    if args.rp is not None:
+        try:
+            parse_replay(args.rp)
+        except ValueError as e:
+            print(e)
+            exit(1)
+        if args.m != "batch" or args.c:
+            print("-rp needs batch mode without -c")
+            exit(1)
+    """Instrumented runs are always computed, a cached cell has no samples"""
+    cache = ResultCache(args.k, iterations=ITERATIONS) if args.k and not args.x else None
     
-    with open(args.i, 'r') as f:
-        max_packets, max_rank = map(int, f.readline().strip().split(","))
+    rates = None
+    if args.r:
+        try:
+            rates = tuple(map(float, args.r.split(",")))
+        except ValueError:
+            print(f"Bad -r {args.r}: enq_rate,deq_rate are numbers of packets per tick")
+            exit(1)
+        if args.m != "batch" or args.c or len(rates) != 2 or min(rates) <= 0:
+            print("-r takes positive enq_rate,deq_rate and needs batch mode without -c")
+            exit(1)
+
+    traces = expand_traces(args.i)
+    if not traces:
+        print(f"No traces found at {args.i}")
+        exit(1)
+    multi = traces != [args.i]
+    if args.ws and parse_warm_start(args.ws)["hist"]:
+        """Check the histogram file against every trace before starting the workers"""
+        try:
+            for inpf in traces:
+                file_histogram(parse_warm_start(args.ws), inpf)
+        except (OSError, ValueError) as e:
+            print(e)
+            exit(1)
+    if multi and args.m != "batch":
+        print("A directory or glob of traces needs batch mode")
+        exit(1)
+
+    if args.m == "batch":
+        if not args.c:
+            """Parse every trace once in the parent, forked workers inherit them"""
+            for inpf in traces:
+                cached_trace(inpf)
+        configs = []
+        for inpf in traces:
+            if rates:
+                """Ideal PIFO reference first, it runs alongside the SP-PIFO configurations"""
+                configs.append({"engine": "pifo", "trace": inpf, "rates": rates})
+            configs.extend({"engine": "sppifo", "trace": inpf, "num_qs": num_qs, "chunk": args.c, "rates": rates} for num_qs in NUM_OF_QUEUES)
+        if args.ws:
+            for cfg in configs:
+                if cfg["engine"] != "pifo":
+                    cfg["warm_start"] = args.ws
+        if args.tw:
+            for cfg in configs:
+                if cfg["engine"] != "pifo":
+                    cfg["window"] = args.tw
+        if args.rp:
+            for cfg in configs:
+                if cfg["engine"] != "pifo":
+                    cfg["replay"] = args.rp
+        if args.x:
+            for cfg in configs:
+                if cfg["engine"] != "pifo":
+                    cfg["instrument"] = (args.x, instrument_path(args.o, cfg["trace"] if multi else None, f"{cfg['num_qs']}q"))
+        """One pool for all traces, workers stay warm from one trace to the next"""
+        records = run_sweep(run_config, configs, args.w, cache)
+        if cache:
+            print(cache)
+        pifo = {rec["trace"]: rec for rec in records if rec["engine"] == "pifo"}
+        records = [rec for rec in records if rec["engine"] != "pifo"]
+
+        write_columnar(str(args.o[:-4]) + "_results.npz", {"sppifo": records, "pifo": list(pifo.values())})
+        if args.ws:
+            write_steady_csv(str(args.o[:-4]) + "_steady.csv", records, [("Num Qs", "num_qs")], [("", "inversions")])
+        if args.tw:
+            write_windows_csv(str(args.o[:-4]) + "_windows.csv", records, [("Num Qs", "num_qs")], [(1, "")])
+        if args.rp:
+            write_replay_csv(str(args.o[:-4]) + "_replay.csv", records, [("Num Qs", "num_qs")])
+        if multi:
+            write_sp_long_csv(args.o, records, pifo)
+            exit(0)
+        write_sp_csv(args.o, records)
+        append_inv_per_rank(str(args.o[:-4]) + "_inv_per_rank.csv", records)
+        if rates:
+            write_sp_dequeue_csv(str(args.o[:-4]) + "_dequeue.csv", records, pifo[args.i])
+            write_delay_per_rank(str(args.o[:-4]) + "_delay_per_rank.csv", records, pifo[args.i], ["num_qs"])
+        exit(0)
+
+    max_packets, max_rank = read_header(args.i)
 
     avg_inv = mp.Value("i", 0)
     with open(args.o, 'w') as f:
@@ -163,12 +335,27 @@ if __name__ == "__main__":
         avg_inv.value = 0
         avg_inv_per_rank = mp.Array("i", max_rank)
         for _ in range(ITERATIONS):
+            if args.m == "shm":
+                inp_ring = ShmRing()
+                out_rings = [ShmRing() for _ in range(num_qs)]
+                procs = [mp.Process(target=shm_ring.generate_packet, args=(args.i, inp_ring)),
+                         mp.Process(target=shm_ring.sppifo_stage, args=(inp_ring, out_rings, max_rank, avg_inv, avg_inv_per_rank)),
+                         mp.Process(target=shm_ring.consume_packet, args=(out_rings, ))]
+                for proc in procs:
+                    proc.start()
+                for proc in procs:
+                    proc.join()
+                for ring in [inp_ring] + out_rings:
+                    ring.release()
+                continue
+
             inp_q = mp.Queue(maxsize=1)
-            out_qs = [mp.Queue() for _ in range(num_qs)]
+            out_group = PriorityQueues(num_qs)
+            out_qs = out_group.lanes()
 
             # packet_generator = mp.Process(target=generate_packet, args=(inp_q, DIST_TYPE, max_rank))
             packet_generator = mp.Process(target=generate_packet, args=(args.i, inp_q))
-            packet_consumer = mp.Process(target=consume_packet, args=(out_qs, ))
+            packet_consumer = mp.Process(target=consume_packet, args=(out_group, ))
             sp_pifo_proc = mp.Process(target=sppfio, args=(inp_q, out_qs, max_rank, avg_inv, num_qs, avg_inv_per_rank))
 
             sp_pifo_proc.start()
@@ -192,11 +379,11 @@ if __name__ == "__main__":
             #     q.close()
         # with open(DIST_TYPE + ".csv", 'a') as f:
         with open(args.o, 'a') as f:
-            f.write(f"{num_qs}, {max_rank}, {((avg_inv.value/ITERATIONS)/max_packets):.3f}\n")
+            f.write(f"{num_qs}, {max_rank}, {normalized(avg_inv.value, max_packets, ITERATIONS):.3f}\n")
 
         # with open(DIST_TYPE + "_inv_per_rank.csv", 'a') as f:
         with open(str(args.o[:-4]) + "_inv_per_rank.csv", 'a') as f:
             f.write(f"MR: {max_rank}, NQs: {num_qs}\n")
             for item in avg_inv_per_rank:
-                f.write(f"{((item/ITERATIONS)/max_packets):.3f} ")
+                f.write(f"{normalized(item, max_packets, ITERATIONS):.3f} ")
             f.write("\n")
@@ -0,0 +1,43 @@
+# Parallel parameter sweeps.
+# Every configuration is independent, so they are fanned out over a pool of worker processes
+# and each one returns its own result record.
+# With a ResultCache (cache.py), cells computed before are read back instead of run again.
+
+import os
+import multiprocessing as mp
+
+def default_workers():
+    """One worker per CPU"""
+    return os.cpu_count() or 1
+
+def run_sweep(run_config, configs, workers=None, cache=None):
+    """
+        Call run_config(cfg) for every configuration and return the result records.
+        Records come back in the same order as configs, whichever worker finishes first.
+        run_config must be a module level function so it can be sent to the workers.
+        With a cache, only configurations missing from it are run, and their records are stored as they finish.
+    """
+    configs = list(configs)
+    records = [cache.get(cfg) if cache else None for cfg in configs]
+    todo = [i for i, rec in enumerate(records) if rec is None]
+    if not todo:
+        return records
+
+    if workers is None:
+        workers = default_workers()
+    workers = max(1, min(workers, len(todo)))
+
+    def store(i, rec):
+        records[i] = rec
+        if cache:
+            cache.put(configs[i], rec)
+
+    if workers == 1:
+        for i in todo:
+            store(i, run_config(configs[i]))
+        return records
+
+    with mp.Pool(processes=workers) as pool:
+        for i, rec in zip(todo, pool.imap(run_config, [configs[i] for i in todo], chunksize=1)):
+            store(i, rec)
+    return records
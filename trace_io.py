@@ -0,0 +1,253 @@
+# Packet trace loaders shared by the simulators.
+# Two trace formats, detected from the first bytes of the file:
+#   text   (helpers/pkt-gen.py): "max_packets, max_rank" header, then one "<id> <rank>" line per packet.
+#   binary: 24 byte header (magic, total_pkts, max_rank as little endian u64), then all ids as float64,
+#           then all ranks as int32. Both columns are contiguous so they can be np.memmap'ed without copying.
+# Either format may be gzip-compressed. Compressed traces are streamed, never memory mapped.
+
+import glob
+import gzip
+import os
+import struct
+from functools import lru_cache
+from itertools import islice
+
+import numpy as np
+
+from packet import PACKET_DTYPE
+
+BIN_MAGIC = b"PIFOTRC1"
+BIN_HEADER = struct.Struct("<8sQQ")
+ID_DTYPE = np.dtype("<f8")
+RANK_DTYPE = np.dtype("<i4")
+GZIP_MAGIC = b"\x1f\x8b"
+
+CHUNK = 1 << 16                                 # Default packets per chunk when streaming
+HEADER_LIMIT = 256                              # A text header longer than this is not a trace
+HIST_SUFFIX = ".hist"                           # Rank histogram sidecar: <trace>.hist
+
+def is_gzip(inpf):
+    """True if inpf is gzip-compressed"""
+    with open(inpf, 'rb') as f:
+        return f.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+
+def open_trace(inpf, mode='rb'):
+    """Open a trace for reading, decompressing on the fly if needed. mode is 'rb' or 'r'."""
+    if is_gzip(inpf):
+        return gzip.open(inpf, 'rt' if mode == 'r' else 'rb')
+    return open(inpf, mode)
+
+def is_binary(inpf):
+    """True if inpf is a binary trace (plain or compressed)"""
+    with open_trace(inpf) as f:
+        return f.read(len(BIN_MAGIC)) == BIN_MAGIC
+
+def read_header(inpf):
+    """Return (total_pkts, max_rank) from the trace header"""
+    if is_binary(inpf):
+        with open_trace(inpf) as f:
+            _, total_pkts, max_rank = BIN_HEADER.unpack(f.read(BIN_HEADER.size))
+        return total_pkts, max_rank
+
+    with open_trace(inpf, 'r') as f:
+        total_pkts, max_rank = map(int, f.readline(HEADER_LIMIT).strip().split(","))
+    return total_pkts, max_rank
+
+def is_trace(inpf):
+    """True if inpf starts with a valid trace header (either format)"""
+    try:
+        read_header(inpf)
+        return True
+    except (OSError, ValueError, struct.error):
+        return False
+
+def expand_traces(spec):
+    """
+        Trace files named by spec, sorted: a single file, a directory or a glob pattern.
+        Directory entries and glob matches that are not traces (e.g. .hist sidecars) are skipped.
+    """
+    if os.path.isdir(spec):
+        paths = [os.path.join(spec, name) for name in sorted(os.listdir(spec))]
+    elif os.path.isfile(spec):
+        return [spec]
+    else:
+        paths = sorted(glob.glob(spec))
+    return [path for path in paths if os.path.isfile(path) and is_trace(path)]
+
+def read_binary(inpf):
+    """Map the id and rank columns of a binary trace. No data is read until it is used."""
+    total_pkts, max_rank = read_header(inpf)
+    ids_off = BIN_HEADER.size
+    ranks_off = ids_off + total_pkts*ID_DTYPE.itemsize
+    if total_pkts == 0:
+        return np.empty(0, ID_DTYPE), np.empty(0, RANK_DTYPE), max_rank
+
+    ids = np.memmap(inpf, dtype=ID_DTYPE, mode='r', offset=ids_off, shape=(total_pkts,))
+    ranks = np.memmap(inpf, dtype=RANK_DTYPE, mode='r', offset=ranks_off, shape=(total_pkts,))
+    return ids, ranks, max_rank
+
+def read_trace(inpf):
+    """
+        Load a whole trace in one go.
+        Returns (ids, ranks, max_rank). Text traces are parsed into float64/int64 arrays,
+        binary traces are memory mapped (float64/int32).
+    """
+    if is_gzip(inpf):
+        ids, ranks = [], []
+        for chunk_ids, chunk_ranks in iter_chunks(inpf, chunk=1 << 20):
+            ids.append(chunk_ids)
+            ranks.append(chunk_ranks)
+        _, max_rank = read_header(inpf)
+        if not ranks:
+            return np.empty(0, np.float64), np.empty(0, np.int64), max_rank
+        return np.concatenate(ids), np.concatenate(ranks), max_rank
+
+    if is_binary(inpf):
+        return read_binary(inpf)
+
+    with open(inpf, 'r') as f:
+        total_pkts, max_rank = map(int, f.readline().strip().split(","))
+        cols = np.loadtxt(f, dtype=np.float64, max_rows=total_pkts, ndmin=2) if total_pkts else np.empty((0, 2))
+    if cols.size == 0:
+        """Header only, loadtxt gives a (0, 1) array"""
+        return np.empty(0, np.float64), np.empty(0, np.int64), max_rank
+
+    ids = cols[:, 0].copy()
+    ranks = cols[:, 1].astype(np.int64)
+    return ids, ranks, max_rank
+
+@lru_cache(maxsize=None)
+def cached_trace(inpf):
+    """
+        read_trace() memoized per process, every trace kept (a bounded cache would evict and reparse in large sweeps).
+        Load in the parent before starting a worker pool so forked workers inherit the arrays instead of reparsing.
+    """
+    return read_trace(inpf)
+
+def iter_chunks(inpf, chunk=CHUNK):
+    """
+        Yield (ids, ranks) arrays of at most chunk packets, reading the trace sequentially.
+        Memory use depends on chunk only, not on the trace length.
+    """
+    total_pkts, _ = read_header(inpf)
+
+    if is_binary(inpf) and not is_gzip(inpf):
+        ids, ranks, _ = read_binary(inpf)
+        for start in range(0, total_pkts, chunk):
+            yield np.array(ids[start:start + chunk]), np.array(ranks[start:start + chunk])
+        return
+
+    if is_binary(inpf):
+        # Two readers over the compressed stream, one positioned on each column
+        with open_trace(inpf) as id_f, open_trace(inpf) as rank_f:
+            id_f.seek(BIN_HEADER.size)
+            rank_f.seek(BIN_HEADER.size + total_pkts*ID_DTYPE.itemsize)
+            for start in range(0, total_pkts, chunk):
+                n = min(chunk, total_pkts - start)
+                ids = np.frombuffer(id_f.read(n*ID_DTYPE.itemsize), dtype=ID_DTYPE)
+                ranks = np.frombuffer(rank_f.read(n*RANK_DTYPE.itemsize), dtype=RANK_DTYPE)
+                yield ids, ranks
+        return
+
+    with open_trace(inpf, 'r') as f:
+        f.readline()
+        left = total_pkts
+        while left > 0:
+            lines = list(islice(f, min(chunk, left)))
+            if not lines:
+                break
+            cols = np.loadtxt(lines, dtype=np.float64, ndmin=2)
+            left -= len(lines)
+            yield cols[:, 0].copy(), cols[:, 1].astype(np.int64)
+
+def iter_ranks(inpf, chunk=CHUNK):
+    """Yield rank arrays of at most chunk packets"""
+    for _, ranks in iter_chunks(inpf, chunk):
+        yield ranks
+
+def bincount_ranks(chunks, num_ranks=0):
+    """Count of every rank over an iterable of rank arrays, at least num_ranks entries long"""
+    counts = np.zeros(num_ranks, dtype=np.int64)
+    for ranks in chunks:
+        if len(ranks) == 0:
+            continue
+        chunk_counts = np.bincount(ranks)
+        if len(chunk_counts) > len(counts):
+            counts = np.pad(counts, (0, len(chunk_counts) - len(counts)))
+        counts[:len(chunk_counts)] += chunk_counts
+    return counts
+
+def rank_histogram(inpf, chunk=1 << 20):
+    """
+        Count of every rank in a trace (at least max_rank entries), streamed in chunks so it runs in constant memory.
+        If the trace has an up to date <trace>.hist sidecar, that is read instead.
+    """
+    sidecar = inpf + HIST_SUFFIX
+    if os.path.isfile(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(inpf):
+        return read_hist(sidecar)
+    _, max_rank = read_header(inpf)
+    return bincount_ranks(iter_ranks(inpf, chunk), max_rank)
+
+def read_hist(histf):
+    """Whitespace separated counts, i-th value is the count of rank i"""
+    with open(histf, 'r') as f:
+        return np.array(f.read().split(), dtype=np.int64)
+
+def write_hist(outf, counts):
+    """Write counts in the read_hist() format (also accepted by pkt-gen.py -d hist)"""
+    with open(outf, 'w') as f:
+        f.write(" ".join(map(str, np.asarray(counts).tolist())) + "\n")
+
+def iter_packets(inpf, chunk=CHUNK):
+    """Yield packet.PACKET_DTYPE arrays of at most chunk packets"""
+    for ids, ranks in iter_chunks(inpf, chunk):
+        packets = np.empty(len(ranks), dtype=PACKET_DTYPE)
+        packets["rank"] = ranks
+        packets["id"] = ids
+        yield packets
+
+def iter_trace(inpf):
+    """Yield (id, rank) per packet, for the packet-at-a-time generators"""
+    for ids, ranks in iter_chunks(inpf):
+        yield from zip(ids.tolist(), ranks.tolist())
+
+def write_binary(outf, ids, ranks, max_rank):
+    """Write a binary trace"""
+    ids = np.ascontiguousarray(ids, dtype=ID_DTYPE)
+    ranks = np.ascontiguousarray(ranks, dtype=RANK_DTYPE)
+    if len(ids) != len(ranks):
+        raise ValueError(f"{len(ids)} ids but {len(ranks)} ranks")
+
+    with open(outf, 'wb') as f:
+        f.write(BIN_HEADER.pack(BIN_MAGIC, len(ranks), max_rank))
+        ids.tofile(f)
+        ranks.tofile(f)
+
+def convert_txt(inpf, outf, chunk=CHUNK):
+    """
+        Convert a text trace to a binary trace, streamed chunk by chunk: memory depends on chunk only.
+        The id and rank columns are written through two handles, each at its own offset.
+    """
+    total_pkts, max_rank = read_header(inpf)
+    ranks_off = BIN_HEADER.size + total_pkts*ID_DTYPE.itemsize
+    written = 0
+    with open(outf, 'wb') as id_f, open(outf, 'r+b') as rank_f:
+        id_f.write(BIN_HEADER.pack(BIN_MAGIC, total_pkts, max_rank))
+        rank_f.seek(ranks_off)
+        for ids, ranks in iter_chunks(inpf, chunk):
+            np.ascontiguousarray(ids, dtype=ID_DTYPE).tofile(id_f)
+            np.ascontiguousarray(ranks, dtype=RANK_DTYPE).tofile(rank_f)
+            written += len(ranks)
+
+    if written < total_pkts:
+        """Fewer lines than the header says: move the ranks up behind the ids and fix the count"""
+        with open(outf, 'r+b') as f:
+            f.write(BIN_HEADER.pack(BIN_MAGIC, written, max_rank))
+            dst = BIN_HEADER.size + written*ID_DTYPE.itemsize
+            step = chunk*RANK_DTYPE.itemsize
+            for start in range(0, written*RANK_DTYPE.itemsize, step):
+                f.seek(ranks_off + start)
+                block = f.read(step)
+                f.seek(dst + start)
+                f.write(block)
+            f.truncate(dst + written*RANK_DTYPE.itemsize)
@@ -0,0 +1,88 @@
+# Warm-start settings for the batch engines.
+# From all-zero bounds SP-PIFO spends the first stretch of a trace converging, which inflates inversions on
+# short traces. A warm start seeds the bounds from the rank distribution (engine.quantile_bounds()),
+# discards a warm-up window (engine.push_steady()), or both. Spec items, comma separated:
+#   hist            seed from the trace's own rank histogram (trace_io.rank_histogram(), .hist sidecar if present)
+#   hist:<file>     seed from a histogram file (trace_io.read_hist() format)
+#   prefix:N        seed from the ranks of the first N packets
+#   settle:N        after seeding, push N ranks drawn from the seed histogram and keep the bounds they leave
+#   warmup:N        push the first N packets, then zero the counters
+# e.g. "prefix:10000,warmup:5000" (or space separated)
+# The quantile split is not where SP-PIFO settles: with many qs its bounds bunch up near the top ranks.
+# settle:N moves them there from synthetic traffic, so short traces are measured in the steady state
+# instead of spending packets of the trace on it.
+
+import numpy as np
+
+from engine import push_steady
+from trace_io import iter_ranks, rank_histogram, read_header, read_hist
+
+def parse_warm_start(spec):
+    """Spec string -> {"seed": None, "hist" or "prefix", "hist": file or None, "prefix": N, "settle": N, "warmup": N}"""
+    ws = {"seed": None, "hist": None, "prefix": 0, "settle": 0, "warmup": 0}
+    for item in spec.replace(",", " ").split():
+        name, _, value = item.partition(":")
+        if name in ("hist", "prefix"):
+            if ws["seed"]:
+                raise ValueError(f"Warm start {spec}: only one of hist and prefix")
+            ws["seed"] = name
+        if name == "hist":
+            ws["hist"] = value or None
+        elif name in ("prefix", "settle", "warmup"):
+            if not value.isdigit() or int(value) < 1:
+                raise ValueError(f"Warm start {spec}: {name} needs a positive packet count")
+            ws[name] = int(value)
+        else:
+            raise ValueError(f"Warm start {spec}: unknown item {item}, expected hist[:file], prefix:N, settle:N or warmup:N")
+    if ws["settle"] and not ws["seed"]:
+        raise ValueError(f"Warm start {spec}: settle needs a hist or prefix seed")
+    return ws
+
+def spec_files(spec):
+    """Files a spec reads besides the trace (a hist:<file> seed), so result caches can key on their contents"""
+    ws = parse_warm_start(spec)
+    return [ws["hist"]] if ws["hist"] else []
+
+def canonical(spec):
+    """Spec with space separated items, as stored in records (no commas in CSV fields)"""
+    return " ".join(spec.replace(",", " ").split())
+
+def file_histogram(ws, inpf):
+    """The hist:<file> histogram, checked against the rank range of inpf (up to its max_rank). Raises ValueError"""
+    hist = read_hist(ws["hist"])
+    max_rank = read_header(inpf)[1]
+    if np.any(hist[max_rank + 1:]):
+        raise ValueError(f"Warm start histogram {ws['hist']} has ranks up to {np.flatnonzero(hist)[-1]}, "
+                         f"{inpf} only up to {max_rank}")
+    return hist[:max_rank + 1]
+
+def seed_histogram(ws, inpf):
+    """Rank histogram the bounds are seeded from, None if ws does not seed them"""
+    if ws["seed"] == "hist":
+        return file_histogram(ws, inpf) if ws["hist"] else rank_histogram(inpf)
+    if ws["seed"] == "prefix":
+        prefix = next(iter_ranks(inpf, ws["prefix"]), np.zeros(0, dtype=np.int64))
+        return np.bincount(np.asarray(prefix, dtype=np.int64))
+    return None
+
+def warm_run(pifo, spec, inpf, chunks):
+    """
+        Run a fresh SPPIFO or HierPIFO over chunks (the ranks of inpf) with the warm start spec.
+        Its counters then hold steady-state values only. Returns the packets they cover.
+    """
+    ws = parse_warm_start(spec)
+    hist = seed_histogram(ws, inpf)
+    if hist is not None:
+        pifo.seed(hist)
+    if ws["settle"] and hist.sum():
+        push_steady(pifo, synthetic_ranks(hist, ws["settle"]), ws["settle"])
+    return push_steady(pifo, chunks, ws["warmup"])
+
+def synthetic_ranks(hist, packets, seed=0, chunk=1 << 20):
+    """Yield packets ranks drawn from hist (i.i.d., fixed seed), in chunks"""
+    hist = np.asarray(hist, dtype=np.float64)
+    cdf = np.cumsum(hist)/hist.sum()
+    cdf[-1] = 1.0                               # Rounding may leave it just under 1, searchsorted would then return len(hist)
+    rng = np.random.default_rng(seed)
+    for start in range(0, packets, chunk):
+        yield np.searchsorted(cdf, rng.random(min(chunk, packets - start)), side='right')
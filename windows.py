@@ -0,0 +1,91 @@
+# Windowed inversion metrics for non-stationary traces.
+# One total per run hides bursts and shifts in the rank mix, so an SP-PIFO stage (engine.SPPIFO.windows)
+# can also count packets and inversions per window: every N packets, or every W seconds of trace time
+# (packet ids are time.time() stamps). Filled chunk by chunk while the engine runs, one entry per window,
+# so memory grows with the number of windows, not packets. Ids are expected in non-decreasing order;
+# a stamp that jumps back to an earlier window starts a new entry for it.
+
+from array import array
+
+import numpy as np
+
+def parse_window(spec):
+    """ "10000" -> (10000, None): packet windows, "0.5s"/"20ms"/"100us" -> (None, seconds): time windows. Raises ValueError """
+    try:
+        for suffix, scale in (("us", 1e-6), ("ms", 1e-3), ("s", 1.0)):
+            if spec.endswith(suffix):
+                packets, seconds = None, float(spec[:-len(suffix)])*scale
+                break
+        else:
+            packets, seconds = int(spec), None
+    except ValueError:
+        raise ValueError(f"Bad window {spec!r}: N packets, or a time such as 0.5s, 20ms, 100us") from None
+    if (packets or seconds or 0) <= 0:
+        raise ValueError(f"Bad window {spec!r}: must be positive")
+    return packets, seconds
+
+class InversionWindows:
+    """Packets and inversions per window of one stage: packets per window, or seconds per window"""
+    def __init__(self, packets=None, seconds=None) -> None:
+        if (packets is None) == (seconds is None):
+            raise ValueError("Windows are either packets or seconds long")
+        if (packets or seconds) <= 0:
+            raise ValueError("Window length must be positive")
+        self.size = packets or seconds
+        self.by_time = seconds is not None
+        self.origin = None                      # Stamp of the first packet, start of window 0 (time windows)
+        self.seen = 0
+        self.index = array('q')                 # Window number of every entry
+        self.packets = array('q')
+        self.inversions = array('q')
+
+    def __repr__(self) -> str:
+        unit = "s" if self.by_time else " pkts"
+        return(f"InversionWindows: {self.size}{unit}, {len(self.index)} windows, {self.seen} pkts")
+
+    def split(self, n, ids=None):
+        """
+            Cut the next n packets at window boundaries.
+            Returns (window number of every run, index one past the end of every run).
+        """
+        if self.by_time:
+            if ids is None:
+                raise ValueError("Time windows need the packet ids")
+            ids = np.asarray(ids, dtype=np.float64)
+            if self.origin is None and n:
+                self.origin = float(ids[0])
+            win = np.floor((ids - self.origin)/self.size).astype(np.int64)
+            ends = np.append(np.flatnonzero(np.diff(win)) + 1, n).astype(np.int64) if n else np.zeros(0, dtype=np.int64)
+            wins = win[ends - 1]
+        else:
+            """Boundaries fall every size packets, no per-packet work"""
+            first, last = self.seen//self.size, (self.seen + n - 1)//self.size
+            wins = np.arange(first, last + 1, dtype=np.int64) if n else np.zeros(0, dtype=np.int64)
+            ends = np.minimum((wins + 1)*self.size - self.seen, n)
+        self.seen += n
+        return wins, ends
+
+    def add(self, wins, packets, inversions):
+        """Fold the per-run counts of split() in; a run continuing the last window adds to it"""
+        for w, n, inv in zip(wins.tolist(), packets.tolist(), inversions.tolist()):
+            if self.index and self.index[-1] == w:
+                self.packets[-1] += n
+                self.inversions[-1] += inv
+            else:
+                self.index.append(w)
+                self.packets.append(n)
+                self.inversions.append(inv)
+
+    def starts(self):
+        """Start of every window: packet number, or seconds after the first packet"""
+        return [w*self.size for w in self.index]
+
+    def fields(self):
+        """Record fields (lists) of the windows"""
+        return {"window_index": self.index.tolist(), "window_start": self.starts(),
+                "window_packets": self.packets.tolist(), "window_inversions": self.inversions.tolist()}
+
+def make_windows(spec, stages=1):
+    """A fresh InversionWindows for every stage, with the parse_window() spec"""
+    packets, seconds = parse_window(spec)
+    return [InversionWindows(packets, seconds) for _ in range(stages)]